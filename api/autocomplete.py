@@ -0,0 +1,242 @@
+import os
+import re
+import heapq
+import pickle
+import threading
+import unicodedata
+
+from array import array
+from bisect import bisect_left
+
+from api.errors import MissingDataError
+
+
+class PrefixIndex(object):
+    """
+    This class completes entity names (persons, countries, topics,
+    classifications) in memory, ranking the entities by the number of
+    documents mentioning them across all collections.
+
+    Every entity type has a sorted array of keys, the normalized name of an
+    entity and every word of it, pointing to the entity. The entities of a
+    prefix are the range of keys starting with it, found with two bisects.
+    The top entities of the short prefixes, which match most of the keys,
+    are computed when the index is built.
+
+    When a prefix has fewer matches than requested, the prefixes one edit
+    away (a deleted, substituted, inserted or transposed character) complete
+    the results.
+
+    The index is built from the entity listings of the Registry by the build
+    script (build.py autocomplete), never while answering a request, and
+    saved to a snapshot file.
+    """
+    # Entity types completed when no type is requested
+    DEFAULT_TYPES = ['persons', 'countries', 'topics']
+
+    # Prefixes up to this length are answered from precomputed lists
+    TOP_PREFIX_LENGTH = 3
+    TOP_SIZE = 100
+
+    WORD_SEPARATOR = re.compile(r'[\s,;:/()\-\.]+')
+
+    def __init__(self, controller, snapshot_path):
+        self.controller = controller
+        self.snapshot_path = snapshot_path
+        self.types = None
+        self.lock = threading.Lock()
+
+
+    def complete(self, session, text, entity_type=None, limit=10):
+        """
+        This function returns the entities whose name, or a word of it,
+        starts with text.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  text: string
+        @param text: The text typed by the user.
+        @type  entity_type: string
+        @param entity_type: The entity type to complete (optional, persons,
+            countries and topics by default).
+        @type  limit: number
+        @param limit: The maximum number of entities returned.
+
+        @rtype:   list
+        @return:  The entities, with their name, type, document count and
+            id in every collection, the most mentioned first.
+
+        @raise MissingDataError: If the index has not been built.
+        """
+        types = self.__load()
+        prefix = PrefixIndex.normalize(text or '')
+        entity_types = [entity_type] if entity_type else PrefixIndex.DEFAULT_TYPES
+
+        matches = []
+        for entity_type in entity_types:
+            if entity_type in types:
+                matches.extend((entry[2], entity_type, index) for index, entry in
+                               self.__matches(types[entity_type], prefix, limit))
+        matches = heapq.nlargest(limit, matches)
+
+        if len(matches) < limit and len(prefix) > PrefixIndex.TOP_PREFIX_LENGTH:
+            found = set((entity_type, index) for (count, entity_type, index) in matches)
+            near = []
+            for entity_type in entity_types:
+                if entity_type in types:
+                    near.extend((entry[2], entity_type, index) for index, entry in
+                                self.__near_matches(types[entity_type], prefix, limit)
+                                if (entity_type, index) not in found)
+            matches.extend(heapq.nlargest(limit - len(matches), near))
+
+        results = []
+        for (count, entity_type, index) in matches:
+            (name, ids, count) = types[entity_type]['entries'][index]
+            results.append({'name': name, 'type': entity_type, 'count': count, 'ids': ids})
+        return results
+
+
+    def build(self, session):
+        """
+        This function builds the index from the entity listings of every
+        collection and saves it to the snapshot file.
+        """
+        types = {}
+        for entity_type in self.controller.entity_names:
+            # Entities of the same name are merged across collections
+            merged = {}
+            for collection, database in sorted(self.controller.collection_names.items()):
+                if entity_type not in self.controller.Entities[database]:
+                    continue
+                (entity_ids, listing) = self.controller.registry.listing(session, database, entity_type)
+                for (entity_id, name, count) in listing:
+                    if not name or name.lower() == 'null':
+                        continue
+                    name = name.strip()
+                    if name not in merged:
+                        merged[name] = ({}, [0])
+                    merged[name][0][collection] = entity_id
+                    merged[name][1][0] += count
+
+            entries = [(name, ids, total[0]) for name, (ids, total) in merged.items()]
+            types[entity_type] = self.__build_type(entries)
+
+        snapshot_dir = os.path.dirname(self.snapshot_path)
+        if snapshot_dir and not os.path.exists(snapshot_dir):
+            os.makedirs(snapshot_dir)
+        temp_path = '{}.tmp'.format(self.snapshot_path)
+        with open(temp_path, 'wb') as outfile:
+            pickle.dump(types, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.snapshot_path)
+
+        return types
+
+
+    def reload(self):
+        """
+        This function drops the index, so that the snapshot file rewritten
+        by the build script is read on its next use.
+        """
+        with self.lock:
+            self.types = None
+
+
+    @staticmethod
+    def normalize(text):
+        """
+        This function lowercases text, strips its accents and collapses its
+        whitespace.
+        """
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+        return ' '.join(text.lower().split())
+
+
+    def __build_type(self, entries):
+        keyed = []
+        for index, (name, ids, count) in enumerate(entries):
+            normalized = PrefixIndex.normalize(name)
+            keys = {normalized}
+            keys.update(word for word in PrefixIndex.WORD_SEPARATOR.split(normalized) if word)
+            keyed.extend((key, index) for key in keys)
+        keyed.sort()
+
+        top = {}
+        for (key, index) in keyed:
+            for length in range(1, min(len(key), PrefixIndex.TOP_PREFIX_LENGTH) + 1):
+                top.setdefault(key[:length], set()).add(index)
+        for prefix, indexes in top.items():
+            ranked = heapq.nlargest(PrefixIndex.TOP_SIZE, indexes, key=lambda index: entries[index][2])
+            top[prefix] = array('I', ranked)
+
+        alphabet = sorted(set(char for (key, index) in keyed for char in key))
+        return {'keys': [key for (key, index) in keyed],
+                'indexes': array('I', [index for (key, index) in keyed]),
+                'entries': entries,
+                'top': top,
+                'alphabet': ''.join(alphabet)}
+
+
+    def __matches(self, index_type, prefix, limit):
+        """
+        This function returns the (index, entry) pairs of the top entities
+        having a key starting with prefix.
+        """
+        entries = index_type['entries']
+        if not prefix:
+            return []
+
+        if len(prefix) <= PrefixIndex.TOP_PREFIX_LENGTH:
+            return [(index, entries[index]) for index in index_type['top'].get(prefix, [])[:limit]]
+
+        indexes = self.__range(index_type, prefix)
+        ranked = heapq.nlargest(limit, indexes, key=lambda index: entries[index][2])
+        return [(index, entries[index]) for index in ranked]
+
+
+    def __near_matches(self, index_type, prefix, limit):
+        """
+        This function returns the (index, entry) pairs of the top entities
+        having a key starting with a prefix one edit away from prefix.
+        """
+        alphabet = index_type['alphabet']
+        variants = set()
+        for position in range(len(prefix) + 1):
+            (head, tail) = (prefix[:position], prefix[position:])
+            if tail:
+                variants.add(head + tail[1:])
+                for char in alphabet:
+                    variants.add(head + char + tail[1:])
+            if len(tail) > 1:
+                variants.add(head + tail[1] + tail[0] + tail[2:])
+            for char in alphabet:
+                variants.add(head + char + tail)
+        variants.discard(prefix)
+
+        indexes = set()
+        for variant in variants:
+            indexes.update(self.__range(index_type, variant))
+
+        entries = index_type['entries']
+        ranked = heapq.nlargest(limit, indexes, key=lambda index: entries[index][2])
+        return [(index, entries[index]) for index in ranked]
+
+
+    def __range(self, index_type, prefix):
+        keys = index_type['keys']
+        low = bisect_left(keys, prefix)
+        high = bisect_left(keys, prefix + '\uffff', low)
+        return set(index_type['indexes'][low:high])
+
+
+    def __load(self):
+        if self.types is not None:
+            return self.types
+
+        with self.lock:
+            if self.types is None:
+                if not os.path.exists(self.snapshot_path):
+                    raise MissingDataError('the autocomplete index', 'autocomplete')
+                with open(self.snapshot_path, 'rb') as infile:
+                    self.types = pickle.load(infile)
+        return self.types
@@ -0,0 +1,72 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class Cache(object):
+    """
+    A thread safe, size bounded cache. The least recently used entries are
+    evicted first once the cache is full, and entries optionally expire ttl
+    seconds after they have been stored.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, key, default=None):
+        """
+        This function returns the value stored for key, or default if the key
+        is missing or its entry has expired.
+        """
+        with self.lock:
+            if key not in self.entries:
+                return default
+
+            (value, expires) = self.entries[key]
+            if expires is not None and expires < time.time():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+
+    def set(self, key, value):
+        """
+        This function stores value for key, evicting the least recently used
+        entry if the cache is full.
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+    def pop(self, key):
+        """
+        This function removes key from the cache.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+    def clear(self):
+        """
+        This function removes every entry from the cache.
+        """
+        with self.lock:
+            self.entries.clear()
+
+
+    def __len__(self):
+        return len(self.entries)
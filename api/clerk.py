@@ -1,33 +1,55 @@
+import io
 import re
+import csv
 import os
 import yaml
+import json
+import base64
 import logging
 
 from datetime import date, datetime
-from urllib.request import unquote
-from flask.json import JSONEncoder
-from flask import jsonify, make_response
+from urllib.request import unquote, quote
+from flask import jsonify, make_response, Response
 from logging import Formatter, FileHandler
 
+from api.serializer import Serializer
+
 class Clerk(object):
     """
     This class is responsible for providing any and all utility functions
     necessary for the Controller and the main declass_api files to
     process data.
     """
+    # Version prefix of the continuation tokens used by document searches.
+    PAGE_TOKEN_VERSION = 'v1'
+
+    # Results longer than this, or produced by an iterator, are streamed in
+    # chunks of STREAM_CHUNK_SIZE rows
+    STREAM_THRESHOLD = 1000
+    STREAM_CHUNK_SIZE = 500
+
+    # Formats of the exports and their mimetypes
+    EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
 
     def __init__(self, controller):
-        self.JSON = Clerk.CustomJSONEncoder()
+        self.JSON = Serializer()
         self.controller = controller
         self.LOG_FILE = ('api.log')
 
 
-    def process(self, data, resp_code, json_encoder=jsonify, page=None, page_size=None, next_page=None, count=None):
+    def process(self, data, resp_code, json_encoder=jsonify, page=None, page_size=None, next_page=None, count=None, partial=None, count_mode=None, facets=None):
         """
         Custom respose function to prepare JSON output to user.
+
+        Large results, and results produced by iterators (at the top level
+        or as values of nested dictionaries), are encoded incrementally into a
+        streamed response, so that the whole output is never held in memory
+        as a single string. The count of an iterator is the number of rows
+        it produced.
         """
+        streamed = self.__is_streamed(data)
 
-        if count is None:
+        if count is None and not self.__is_iterator(data):
             count = len(data)
 
         output = {'count': count, 'results': data}
@@ -37,12 +59,136 @@ class Clerk(object):
             output.update({'page_size':page_size})
         if next_page:
             output.update({'next_page':next_page})
+        if partial:
+            # collections that could not be queried in time
+            output.update({'partial':partial})
+        if count_mode:
+            # count is an estimate, or only the size of the page
+            output.update({'count_mode':count_mode})
+        if facets:
+            # breakdowns of all the results of a search
+            output.update({'facets':facets})
+
+        if streamed:
+            return Response(self.__stream(output), status=resp_code, mimetype='application/json')
 
         response = make_response(json_encoder(output), resp_code)
 
         return response
 
 
+    def export(self, rows, fields, export_format):
+        """
+        This function streams rows (dictionaries) as an attachment, either
+        as NDJSON, one JSON document per line, or as CSV with a header of
+        fields, where entity lists are written as their names separated by
+        semicolons. Rows are encoded STREAM_CHUNK_SIZE at a time.
+        """
+        def ndjson_chunks(chunk):
+            return b''.join(self.JSON.encode(row) + b'\n' for row in chunk)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def csv_chunks(chunk):
+            for row in chunk:
+                writer.writerow([self.__csv_value(row.get(field)) for field in fields])
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return data.encode('utf-8')
+
+        encode_chunk = csv_chunks if export_format == 'csv' else ndjson_chunks
+
+        def generate():
+            if export_format == 'csv':
+                writer.writerow(fields)
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == Clerk.STREAM_CHUNK_SIZE:
+                    yield encode_chunk(self.format_dates(chunk))
+                    chunk = []
+            yield encode_chunk(self.format_dates(chunk))
+
+        response = Response(generate(), mimetype=Clerk.EXPORT_FORMATS[export_format])
+        response.headers['Content-Disposition'] = 'attachment; filename=documents.%s' % export_format
+        return response
+
+
+    def __csv_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, list):
+            return '; '.join(str(item['name']) if isinstance(item, dict) else str(item) for item in value)
+        return value
+
+
+    def __stream(self, output):
+        """
+        This function yields the JSON encoding of an output envelope, its
+        results first so that the count of an iterator is known once they
+        are streamed.
+        """
+        results = output.pop('results')
+        produced = [0]
+        if output['count'] is None:
+            def counted(rows):
+                for row in rows:
+                    produced[0] += 1
+                    yield row
+            results = counted(results)
+
+        yield b'{"results":'
+        for chunk in self.__stream_value(results):
+            yield chunk
+
+        if output['count'] is None:
+            output['count'] = produced[0]
+        for key, value in output.items():
+            yield b',' + self.JSON.encode(key) + b':' + self.JSON.encode(value)
+        yield b'}'
+
+
+    def __stream_value(self, value):
+        if isinstance(value, dict):
+            yield b'{'
+            for position, (key, item) in enumerate(value.items()):
+                yield (b',' if position else b'') + self.JSON.encode(str(key)) + b':'
+                for chunk in self.__stream_value(item):
+                    yield chunk
+            yield b'}'
+
+        elif self.__is_iterator(value) or isinstance(value, (list, tuple)):
+            # Rows are encoded a chunk at a time, as lists stripped of their brackets
+            separator = b'['
+            chunk = []
+            for row in value:
+                chunk.append(row)
+                if len(chunk) == Clerk.STREAM_CHUNK_SIZE:
+                    yield separator + self.JSON.encode(chunk)[1:-1]
+                    separator = b','
+                    chunk = []
+            if chunk:
+                yield separator + self.JSON.encode(chunk)[1:]
+            else:
+                yield b'[]' if separator == b'[' else b']'
+
+        else:
+            yield self.JSON.encode(value)
+
+
+    def __is_iterator(self, value):
+        return hasattr(value, '__next__')
+
+
+    def __is_streamed(self, value):
+        if isinstance(value, dict):
+            return any(self.__is_streamed(item) for item in value.values())
+        return self.__is_iterator(value) or \
+            (isinstance(value, (list, tuple)) and len(value) > Clerk.STREAM_THRESHOLD)
+
+
     def complain(self, err_code, err_message, api_errors):
         """
         Custom error response function.
@@ -95,7 +241,12 @@ class Clerk(object):
             page_valid = True
 
         # Validate correct page format
-        if page and page_type == "hash":
+        if page and page_type == "hash" and page.startswith(Clerk.PAGE_TOKEN_VERSION + '.'):
+            token = self.decode_page_token(page)
+            if token is not None:
+                page_valid = set(token['s']).union(token['o']).issubset(valid_collections)
+
+        elif page and page_type == "hash":
             offsets = page.split(':')
             iterator = iter(offsets)
             if len(offsets) == (len(valid_collections)*2):
@@ -132,13 +283,19 @@ class Clerk(object):
         Assumes a page_number of the following format:
         frus:n_1:ddrs:n_2:statedeptcables:n_3:kissinger:n_4
 
+        or a continuation token (see encode_page_token), in which case
+        collections resuming from a seek key start at index 0,
+
         or page = 1 (only first page call allowed)
         """
         collection_last_index = {}
         for collection in self.controller.get_collection_names():
             collection_last_index[collection] = 0
 
-        if page and page != "1":
+        if page and page.startswith(Clerk.PAGE_TOKEN_VERSION + '.'):
+            collection_last_index.update(self.decode_page_token(page)['o'])
+
+        elif page and page != "1":
             offsets = page.split(':')
             iterator = iter(offsets)
             for collection in iterator:
@@ -147,6 +304,134 @@ class Clerk(object):
         return collection_last_index
 
 
+    def set_page_seek(self, page):
+        """
+        This function returns the seek key, i.e. the (date, id) pair of the
+        last document seen, for every collection of a continuation token.
+        Legacy offset pages have no seek keys.
+        """
+        if page and page.startswith(Clerk.PAGE_TOKEN_VERSION + '.'):
+            return self.decode_page_token(page)['s']
+        return {}
+
+
+    def set_page_count(self, page):
+        """
+        This function returns the total count carried by a continuation
+        token, so that subsequent pages of a search do not count it again.
+        """
+        if page and page.startswith(Clerk.PAGE_TOKEN_VERSION + '.'):
+            return self.decode_page_token(page)['n']
+        return None
+
+
+    def encode_page_token(self, seek, offsets, count=None):
+        """
+        This function builds the opaque continuation token of a document
+        search from the seek key of every collection that has returned
+        documents, the offset of the remaining ones and the total count of
+        the search.
+        """
+        token = {
+            'n': count,
+            's': dict((collection, [self.__format_token_date(date_val), doc_id])
+                      for collection, (date_val, doc_id) in seek.items()),
+            'o': dict((collection, offset)
+                      for collection, offset in offsets.items() if offset)
+        }
+        payload = json.dumps(token, separators=(',', ':'), sort_keys=True)
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return Clerk.PAGE_TOKEN_VERSION + '.' + encoded.rstrip('=')
+
+
+    def decode_page_token(self, page):
+        """
+        This function decodes a continuation token. It returns None if the
+        token is malformed.
+        """
+        try:
+            encoded = page[len(Clerk.PAGE_TOKEN_VERSION) + 1:]
+            encoded = encoded + '=' * (-len(encoded) % 4)
+            token = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+
+            seek = {}
+            for collection, (date_val, doc_id) in token['s'].items():
+                seek[collection] = (self.__parse_token_date(date_val), doc_id)
+
+            offsets = {}
+            for collection, offset in token['o'].items():
+                if not isinstance(offset, int) or offset < 0:
+                    return None
+                offsets[collection] = offset
+
+            count = token.get('n')
+            if count is not None and not isinstance(count, int):
+                return None
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+        return {'s': seek, 'o': offsets, 'n': count}
+
+
+    def encode_search_token(self, pit_id, search_after, page, count):
+        """
+        This function builds the opaque continuation token of a full text
+        search from the cursor of its search backend, i.e. the point in time
+        (if any) and the sort values of the last hit returned, the number of the next page and the total count
+        of the search.
+        """
+        token = {
+            'p': pit_id,
+            'a': search_after,
+            'g': page,
+            'n': count
+        }
+        payload = json.dumps(token, separators=(',', ':'), sort_keys=True)
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return Clerk.PAGE_TOKEN_VERSION + '.' + encoded.rstrip('=')
+
+
+    def decode_search_token(self, page):
+        """
+        This function decodes a full text search continuation token. It
+        returns None if the token is malformed.
+        """
+        if not page or not page.startswith(Clerk.PAGE_TOKEN_VERSION + '.'):
+            return None
+
+        try:
+            encoded = page[len(Clerk.PAGE_TOKEN_VERSION) + 1:]
+            encoded = encoded + '=' * (-len(encoded) % 4)
+            token = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+
+            if token['p'] is not None and not isinstance(token['p'], str):
+                return None
+            if not isinstance(token['a'], list):
+                return None
+            if not isinstance(token['g'], int) or token['g'] < 1:
+                return None
+            if token['n'] is not None and not isinstance(token['n'], int):
+                return None
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+
+        return {'p': token['p'], 'a': token['a'], 'g': token['g'], 'n': token['n']}
+
+
+    def __format_token_date(self, date_val):
+        if date_val is None:
+            return None
+        if not isinstance(date_val, datetime):
+            date_val = datetime.combine(date_val, datetime.min.time())
+        return date_val.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+    def __parse_token_date(self, date_val):
+        if date_val is None:
+            return None
+        return datetime.strptime(date_val, '%Y-%m-%d %H:%M:%S.%f')
+
+
     def valid_params(self, passed_params, accepted_params, request):
         """
         This function verifies that a user has not inserted unacceptable or
@@ -367,10 +652,32 @@ class Clerk(object):
         if not has_next:
             return
         
-        url = re.sub(r'&page='+old_link, r'', unquote(url))
+        url = re.sub(r'&page='+re.escape(old_link), r'', unquote(url))
         return url + '&page=%s' % next_link
 
 
+    def build_seek_link(self, url, param, value):
+        """
+        This function builds the next_link of a page selected by a seek
+        parameter, replacing the page and seek parameters of the url.
+        """
+        url = re.sub(r'&(page|%s)=[^&]*' % re.escape(param), r'', unquote(url))
+        return url + '&%s=%s' % (param, quote(str(value)))
+
+
+    def format_dates(self, rows):
+        """
+        This function replaces the dates and datetimes of a list of rows
+        (dictionaries) by their ISO 8601 strings, as the JSON encoders would,
+        so that the encoders never fall back to Python code for them.
+        """
+        for row in rows:
+            for key, value in row.items():
+                if isinstance(value, date):
+                    row[key] = value.isoformat()
+        return rows
+
+
     def escapeString(self, text):
         return re.escape(text)
 
@@ -382,19 +689,3 @@ class Clerk(object):
             '%(asctime)s %(levelname)s: %(message)s '
             '[in %(pathname)s:%(funcName)s:%(lineno)d]'))
         return file_h
-
-
-    class CustomJSONEncoder(JSONEncoder):
-        """
-        JSON ENCODER (custom to handle both date and datetime data)
-        """
-        def default(self, obj):
-            try:
-                if isinstance(obj, date):
-                    return obj.isoformat()
-                iterable = iter(obj)
-            except TypeError:
-                pass
-            else:
-                return list(iterable)
-            return JSONEncoder.default(self, obj)
@@ -1,18 +1,37 @@
 import os
+import threading
 import yaml
 import csv
-import operator
-import elasticsearch
-import requests
+import heapq
 import json
+import logging
 
 from collections import defaultdict
-from datetime import date, datetime, timedelta
-from sqlalchemy import create_engine, and_, func, desc, asc, distinct
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, and_, or_, func, desc, asc, distinct, select, literal, union_all
 from sqlalchemy.orm import load_only, sessionmaker
-from sqlalchemy.ext.automap import automap_base
 
+from api.cache import Cache
 from api.clerk import Clerk
+from api.planner import Planner
+from api.registry import Registry
+from api.router import Router
+from api.schema import Schema, EntityIndex
+from api.viewcache import ResponseCache
+from api.topicstore import TopicStore
+from api.packed import PackedIdSet
+from api.rollup import Rollup
+from api.sampler import Sampler
+from api.autocomplete import PrefixIndex
+from api.textdrop import TextDropClient, TextDropError
+from api.similar import SimilarityIndex
+from api.search import ElasticsearchBackend, LocalSearchBackend, SearchError
+from api.errors import MissingDataError
+
+logger = logging.getLogger(__name__)
 
 
 class Controller(object):
@@ -35,17 +54,47 @@ class Controller(object):
     data_path = os.path.join(ROOT, 'data/topics')
     topic_token_path = os.path.join(data_path, 'tokens')
     topic_doc_path = os.path.join(data_path, 'docs')
+    TOPIC_COLLECTIONS = ['frus', 'ddrs', 'kissinger', 'cpdoc']
 
     HTTP_STATUS_SUCCESS = 200
     HTTP_STATUS_BAD_REQUEST = 404
+    HTTP_STATUS_UNAVAILABLE = 503
     PAGE_SIZE_DEFAULT = int(api_config['parameters']['page_size'])
+    DOC_ENTITY_FIELDS = ['countries', 'persons', 'topics']
+    QUERY_WORKERS = int(api_config['query_workers'])
+    QUERY_TIMEOUT = float(api_config['query_timeout'])
+    COUNT_CACHE_SIZE = int(api_config['count_cache_size'])
+    COUNT_CACHE_TTL = float(api_config['count_cache_ttl'])
+    POSTING_CACHE_SIZE = int(api_config['posting_cache_size'])
+    POSTING_CACHE_TTL = float(api_config['posting_cache_ttl'])
+    ENTITY_CACHE_SIZE = int(api_config['entity_cache_size'])
+    ENTITY_CHECK_INTERVAL = float(api_config['entity_check_interval'])
+    ENTITY_LISTING_TTL = float(api_config['entity_listing_ttl'])
+    ROLLUP_CACHE_SIZE = int(api_config['rollup_cache_size'])
+    ROUTING_SNAPSHOT = os.path.join(ROOT, api_config['routing_snapshot'])
+    SCHEMA_SNAPSHOT = os.path.join(ROOT, api_config['schema_snapshot'])
+    TOPIC_STORE = os.path.join(ROOT, api_config['topic_store'])
+    TOPIC_DOC_IDS = os.path.join(ROOT, api_config['topic_doc_ids'])
+    DOC_ID_SETS = os.path.join(ROOT, api_config['doc_id_sets'])
+    AUTOCOMPLETE_SNAPSHOT = os.path.join(ROOT, api_config['autocomplete_snapshot'])
+    TEXTDROP = api_config['textdrop']
+    ELASTICSEARCH = api_config['elasticsearch']
+    SEARCH_BACKEND = api_config['search_backend']
+    FULL_TEXT_FACETS = ['collection', 'year', 'classification', 'persons']
+    FACET_SIZES = api_config['facet_sizes']
+    FULLTEXT_INDEX = os.path.join(ROOT, api_config['fulltext_index'])
+    SIMILAR = api_config['similar']
+    VIZ_CACHE_SIZE = int(api_config['viz_cache_size'])
+    EXPORT_BATCH_SIZE = int(api_config['export_batch_size'])
+    VIZ_CHECK_INTERVAL = float(api_config['viz_check_interval'])
 
     def __init__(self, credentials):
         '''
         Building connections to all databases specified in the api
         configuration file api_config.yml. This function creates an engine
-        object for each database, and automatically maps the database tables
-        using SQLAlchemy's reflection Base reflection property.
+        object for each database. The database tables are automatically
+        mapped using SQLAlchemy's reflection Base reflection property when
+        a database is first used.
 
         A Session factory containing the engines and table properties is
         prepared once and made available for all future session requests.
@@ -55,16 +104,37 @@ class Controller(object):
         password = credentials['password']
         host = credentials['host']
 
-        self.Tables = defaultdict(dict)
-        self.Entities = defaultdict(dict)
         self.Topics = defaultdict(dict)
+        self.topic_lock = threading.Lock()
         self.clerk = Clerk(self)
+        self.planner = Planner(self, Controller.POSTING_CACHE_SIZE, Controller.POSTING_CACHE_TTL)
         self.supported_versions = Controller.supported_versions
-        self.es = elasticsearch.Elasticsearch()
+        if Controller.SEARCH_BACKEND == 'local':
+            self.search_backend = LocalSearchBackend(self, Controller.FULLTEXT_INDEX, Controller.FACET_SIZES)
+        else:
+            self.search_backend = ElasticsearchBackend(Controller.ELASTICSEARCH, Controller.FACET_SIZES)
+        self.executor = ThreadPoolExecutor(max_workers=Controller.QUERY_WORKERS)
+        self.count_cache = Cache(Controller.COUNT_CACHE_SIZE, Controller.COUNT_CACHE_TTL)
+        self.registry = Registry(self, Controller.ENTITY_CACHE_SIZE, Controller.ENTITY_CHECK_INTERVAL,
+                                 Controller.ENTITY_LISTING_TTL)
+        self.rollup = Rollup(self, Controller.ROLLUP_CACHE_SIZE, Controller.ENTITY_CHECK_INTERVAL)
+        self.router = Router(self, Controller.ROUTING_SNAPSHOT)
+        self.sampler = Sampler(self, Controller.DOC_ID_SETS)
+        self.autocomplete = PrefixIndex(self, Controller.AUTOCOMPLETE_SNAPSHOT)
+        self.similar = SimilarityIndex(self, os.path.join(Controller.ROOT, Controller.SIMILAR['path']),
+                                       int(Controller.SIMILAR['max_topics']),
+                                       int(Controller.SIMILAR['max_postings']))
+        self.textdrop = TextDropClient(int(Controller.TEXTDROP['pool_size']),
+                                       float(Controller.TEXTDROP['connect_timeout']),
+                                       float(Controller.TEXTDROP['read_timeout']),
+                                       int(Controller.TEXTDROP['retries']),
+                                       int(Controller.TEXTDROP['failure_threshold']),
+                                       float(Controller.TEXTDROP['reset_timeout']),
+                                       int(Controller.TEXTDROP['cache_size']),
+                                       float(Controller.TEXTDROP['cache_ttl']))
+        self.viz_cache = ResponseCache(Controller.VIZ_CACHE_SIZE, Controller.VIZ_CHECK_INTERVAL)
 
         Engines = {}
-        Bases = {}
-        Binds = {}
 
         # Create all database connections
         for database in Controller.databases_names:
@@ -75,1436 +145,279 @@ class Controller(object):
                                               '/' + str(database) +
                                               '?charset=utf8&use_unicode=1',
                                               pool_recycle=3600)
-            # Reflect the tables
-            Bases[database] = automap_base()
-            Bases[database].prepare(Engines[database], reflect=True)
-            self.Entities[database] = []
-
-            # Creating a table to store all the table names of the databases
-            for table in Bases[database].classes:
-                self.Tables[database][table.__name__] = table
-
-            # Store the list of available entities for a specific database
-            for entity in Controller.entity_names:
-                if entity in self.Tables[database].keys():
-                    self.Entities[database].append(entity)
-
-            Binds[Bases[database]] = Engines[database]
-
-        # Create Factory class for the sessions
-        self.Session = sessionmaker(binds=Binds)
-
-        self.__init_topics()
-
-    def __init_topics(self):
-        """
-        This function loads the static token and topic data files
-        that have been pre-generated by the external topics script.
-        """
-        # Load all data for topic routes
-        session = self.Session()
-
-        collections = [
-            'frus',
-            'ddrs',
-            'kissinger',
-            'cpdoc'
-        ]
-
-        for collection in collections:
-            database = self.collection_names[collection]
-            table_names = self.Tables[database].keys()
-
-            if 'topic_doc' in table_names:
-                topic_doc = self.Tables[database]['topic_doc']
-                # the set of possible doc_ids will be loaded here.
-                result = session.query(topic_doc.doc_id).distinct(topic_doc.doc_id).all()
-
-                self.Topics[database]['valid_doc_ids'] = {doc_id for (doc_id,) in result}
-
-                # possible topic_ids will be loaded here.
-                result = session.query(topic_doc.topic_id).distinct(topic_doc.topic_id)
-
-                self.Topics[database]['valid_topic_ids'] = {topic_id for (topic_id,) in result}
-
-                if collection == "cpdoc":
-                    topics = self.Tables[database]['topics']
-                    result = session.query(topics.id).filter(topics.name.isnot(None))
-
-                    self.Topics[database]['valid_topic_ids'] = {id for (id,) in result}
-                # Load in all the topic
-                top_topic_tokens = {}
-                for topic_id in self.Topics[database]['valid_topic_ids']:
-                    topic_tokens = []
-                    filename = '{}.csv'.format(topic_id)
-                    current_path = os.path.join(Controller.topic_token_path, "{}".format(collection), filename)
-                    with open(current_path, 'rU') as infile:
-                        reader = csv.reader(infile)
-                        keys = next(reader)
-                        for row in reader:
-                            topic_tokens.append(dict(zip(keys, row)))
-                    top_topic_tokens[topic_id] = topic_tokens
-
-                self.Topics[database]['top_topic_tokens'] = top_topic_tokens
-
-                # Load in all the doc data.
-                top_topic_docs = {}
-                for topic_id in self.Topics[database]['valid_topic_ids']:
-                    topic_docs = []
-                    top_topic_docs[topic_id] = topic_docs
-                    filename = '{}.csv'.format(topic_id)
-                    current_path = os.path.join(Controller.topic_doc_path, "{}".format(collection), filename)
-                    with open(current_path) as infile:
-                        reader = csv.reader(infile)
-                        keys = next(reader)
-                        for row in reader:
-                            topic_docs.append(dict(zip(keys, row)))
-                    top_topic_docs[topic_id] = topic_docs
-                self.Topics[database]['top_topic_docs'] = top_topic_docs
-
-        session.close()
-
-
-    def populate_docs_entities(self, session, db_results_flat, database, filters):
-        """
-        This function takes a list of document ids and queries the databases
-        to collect their entities (persons, topics, countries) lists.
-
-        @type  session: object
-        @param session: A session factory object configured to access all databases.
-        @type  db_results_flat: dictionary
-        @param db_results_flat: A json dictionary containing the document results to
-            return to the user.
-        @type  database: string
-        @param database: The name of the collection to query.
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   None
-        @return:  Modifies the db_results_flat object and populates entities.
-        """
-        doc_ids = []
-        doc_ids_entities = {}
-        for row in db_results_flat:
-            doc_ids.append(row['id'])
-            doc_ids_entities[row['id']] = {'countries':None, 'persons':None}
-
-        table_names = list(self.Tables[database].keys())
-
-        if doc_ids:
-            # Get countries related to doc_id
-            if 'countries' in table_names and 'country_doc' in table_names and 'countries' in filters['fields']:
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-
-                q = session.query(country_doc.doc_id, func.group_concat(countries.name))\
-                            .filter(country_doc.doc_id.in_(doc_ids))\
-                            .join(countries)\
-                            .group_by(country_doc.doc_id)
-
-                #country_list = q.all()
-                country_list = q.limit(1000)
-                for (doc_id, countries) in country_list:
-                    doc_ids_entities[doc_id]["countries"] = ", ".join([c.strip() for c in countries.split(',')])
-
-            # Get persons related to doc_id
-            if 'persons' in table_names and 'person_doc' in table_names and 'persons' in filters['fields']:
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                #q = session.query(persons.name).join(person_doc).filter(person_doc.doc_id == row.doc_id)
-                q = session.query(person_doc.doc_id, func.group_concat(persons.name))\
-                            .join(persons)\
-                            .filter(person_doc.doc_id.in_(doc_ids))\
-                            .group_by(person_doc.doc_id)
-
-                #persons_list = q.all()
-                persons_list = q.limit(1000)
-                for (doc_id, persons) in persons_list:
-                    doc_ids_entities[doc_id]["persons"] = ", ".join([p.strip() for p in persons.split(',')])
-
-            # Get topics related to doc_id
-            if 'topics' in table_names and 'topic_doc' in table_names and 'topics' in filters['fields']:
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                q = session.query(topic_doc.doc_id, func.group_concat(topics.name))\
-                            .join(topics)\
-                            .filter(topic_doc.doc_id.in_(doc_ids))\
-                            .group_by(topic_doc.doc_id)
-
-                #topics_list = q.all()
-                topics_list = q.limit(1000)
-                for (doc_id, topics) in topics_list:
-                    if topics:
-                        doc_ids_entities[doc_id]["topics"] = ", ".join([t.strip() for t in topics.split(',')])
-
-
-            for row in db_results_flat:
-                if 'countries' in filters['fields']:
-                    row["countries"] = None
-                    if "countries" in doc_ids_entities[row['id']]:
-                        row['countries'] = doc_ids_entities[row['id']]['countries']
-                if 'persons' in filters['fields']:
-                    row['persons'] = None
-                    if "persons" in doc_ids_entities[row['id']]:
-                        row['persons'] = doc_ids_entities[row['id']]['persons']
-                if 'topics' in filters['fields']:
-                    row["topics"] = None
-                    if "topics" in doc_ids_entities[row['id']]:
-                        row['topics'] = doc_ids_entities[row['id']]['topics']
-
-
-    def find_docs_by_ids(self, doc_ids, filters):
-        """
-        This function returns the document information of a list of
-        doc_ids.
-
-        @type  doc_ids: list
-        @param doc_ids: A list of document ids to query the databases for.
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-
-        docdb = self.Tables['declassification_api']['docdb']
-        # List the databases that we need to search documents in
-        db_locations = session.query(docdb.db_name).filter(docdb.doc_id.in_(doc_ids)).group_by(docdb.db_name).all()
-
-        for database in db_locations:
-            docs = self.Tables[database.db_name]['docs']
-            q = session.query(docs).filter(docs.id.in_(doc_ids))
-            # q = self.__apply_query_filters(session, q, docs, filters, collection=None)
-
-            db_results_objects = q.all()    # returns all documents
-            db_results_flat = self.__package_db_results(db_results_objects, filters)
-            self.populate_docs_entities(session, db_results_flat, database.db_name, filters)
-            result_list.extend(db_results_flat)
-
-
-        session.close()
-        response = self.clerk.process(result_list, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-
-    def find_docs_by_persons(self, p_ids, p_logic, filters):
-        """
-        This function returns the document information given a list
-        of person ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the databases for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if 'persons' in table_names and 'person_doc' in table_names and 'docs' in table_names:
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                docs = self.Tables[database]['docs']
-
-                # We want to get the document ids associated with the input person_ids
-                person_query = session.query(person_doc.doc_id)\
-                                      .filter(person_doc.person_id.in_(p_ids))
-
-                #q = session.query(docs).join(person_doc).join(persons).filter(persons.id.in_(p_ids))
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                q = session.query(docs).filter(docs.id.in_(person_query))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_country(self, c_ids, c_logic, filters):
-        """
-        This function returns the document information given a list
-        of country ids.
-
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if 'countries' in table_names and 'country_doc' in table_names and 'docs' in table_names:
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                docs = self.Tables[database]['docs']
-
-                # We want to get the document ids associated with the input c_ids
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
-
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                q = session.query(docs).filter(docs.id.in_(country_query))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_topic(self, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of topic ids.
-
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if 'topics' in table_names and 'topic_doc' in table_names and 'docs' in table_names:
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                docs = self.Tables[database]['docs']
-
-                # We want to get the document ids associated with the input c_ids
-                topic_query = session.query(topic_doc.doc_id)\
-                                       .filter(topic_doc.topic_id.in_(t_ids))
-
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(t_ids)))
-
-                q = session.query(docs).filter(docs.id.in_(topic_query))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_classification(self, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of classification ids.
-
-        @type  t_ids: list
-        @param t_ids: A list of classification ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if 'classifications' in table_names and 'classification_doc' in table_names and 'docs' in table_names:
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                docs = self.Tables[database]['docs']
-
-                # We want to get the document ids associated with the input classification_ids
-                classification_query = session.query(classification_doc.doc_id)\
-                                       .filter(classification_doc.classification_id.in_(t_ids))
-
-                if t_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(t_ids)))
-
-                q = session.query(docs).filter(docs.id.in_(classification_query))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-    def find_docs_by_person_classification(self, p_ids, p_logic, c_ids, c_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and classification ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of classification ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['persons', 'person_doc', 'classifications', 'classification_doc', 'docs']) <= set(table_names):
-            #if 'persons' in table_names and 'person_doc' in table_names and 'classifications' in table_names and 'classification_doc' in table_names and 'docs' in table_names:
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                docs = self.Tables[database]['docs']
-
-                person_query = session.query(person_doc.doc_id)\
-                                      .filter(person_doc.person_id.in_(p_ids))
-
-                classification_query = session.query(classification_doc.doc_id)\
-                                       .filter(classification_doc.classification_id.in_(c_ids))
-
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                if c_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(person_query), docs.id.in_(classification_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
 
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
+        # The tables of a database are mapped on its first use, from its
+        # schema snapshot when there is one
+        self.Tables = Schema(Engines, Controller.SCHEMA_SNAPSHOT)
 
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_classification_country(self, p_ids, p_logic, c_ids, c_logic, filters):
-        """
-        This function returns the document information given a list
-        of classification and country ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of classification ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['classifications', 'classification_doc', 'countries', 'country_doc', 'docs']) <= set(table_names):
-            #if 'classifications' in table_names and 'classification_doc' in table_names and 'countries' in table_names and 'country_doc' in table_names and 'docs' in table_names:
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                docs = self.Tables[database]['docs']
-
-                classification_query = session.query(classification_doc.doc_id)\
-                                      .filter(classification_doc.classification_id.in_(p_ids))
-
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
-
-                if p_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(classification_query), docs.id.in_(country_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-    def find_docs_by_classification_topic(self, c_ids, c_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of classification and topic ids.
-
-        @type  c_ids: list
-        @param c_ids: A list of classification ids to query the database for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['topics', 'topic_doc', 'classifications', 'classification_doc', 'docs']) <= set(table_names):
-            #if 'topics' in table_names and 'topic_doc' in table_names and 'classifications' in table_names and 'classification_doc' in table_names and 'docs' in table_names:
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                docs = self.Tables[database]['docs']
-
-                topic_query = session.query(topic_doc.doc_id)\
-                                     .filter(topic_doc.topic_id.in_(t_ids))
-
-                classification_query = session.query(classification_doc.doc_id)\
-                                       .filter(classification_doc.classification_id.in_(c_ids))
-
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
-
-                if c_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(topic_query), docs.id.in_(classification_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-    def find_docs_by_person_country(self, p_ids, p_logic, c_ids, c_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and country ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['persons', 'person_doc', 'countries', 'country_doc', 'docs']) <= set(table_names):
-            #if 'persons' in table_names and 'person_doc' in table_names and 'countries' in table_names and 'country_doc' in table_names and 'docs' in table_names:
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                docs = self.Tables[database]['docs']
-
-                person_query = session.query(person_doc.doc_id)\
-                                      .filter(person_doc.person_id.in_(p_ids))
-
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
-
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(person_query), docs.id.in_(country_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_person_topic(self, p_ids, p_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and topic ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-
-            if set(['persons', 'person_doc', 'topics', 'topic_doc', 'docs']) <= set(table_names):
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                docs = self.Tables[database]['docs']
-
-                person_query = session.query(person_doc.doc_id)\
-                                      .filter(person_doc.person_id.in_(p_ids))
-
-                topic_query = session.query(topic_doc.doc_id)\
-                                       .filter(topic_doc.topic_id.in_(t_ids))
-
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(t_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(person_query), docs.id.in_(topic_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_country_topic(self, c_ids, c_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of country and topic ids.
-
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the database for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['topics', 'topic_doc', 'countries', 'country_doc', 'docs']) <= set(table_names):
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                docs = self.Tables[database]['docs']
-
-                topic_query = session.query(topic_doc.doc_id)\
-                                     .filter(topic_doc.topic_id.in_(t_ids))
-
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
-
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
-
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(topic_query), docs.id.in_(country_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-
-    def find_docs_by_person_country_topic(self, p_ids, p_logic, c_ids, c_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and country and topic ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['topics', 'topic_doc', 'countries', 'country_doc', 'persons', 'person_doc', 'docs']) <= set(table_names):
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                docs = self.Tables[database]['docs']
-
-                topic_query = session.query(topic_doc.doc_id)\
-                                     .filter(topic_doc.topic_id.in_(t_ids))
-
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
-
-                person_query = session.query(person_doc.doc_id)\
-                                       .filter(person_doc.person_id.in_(p_ids))
-
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
-
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(topic_query), docs.id.in_(country_query), docs.id.in_(person_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-    def find_docs_by_person_classification_topic(self, p_ids, p_logic, c_ids, c_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and classification and topic ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of classification ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
-
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
-
-            table_names = self.Tables[database].keys()
-            if set(['topics', 'topic_doc', 'classifications', 'classification_doc', 'persons', 'person_doc', 'docs']) <= set(table_names):
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                docs = self.Tables[database]['docs']
-
-                topic_query = session.query(topic_doc.doc_id)\
-                                     .filter(topic_doc.topic_id.in_(t_ids))
-
-                classification_query = session.query(classification_doc.doc_id)\
-                                       .filter(classification_doc.classification_id.in_(c_ids))
-
-                person_query = session.query(person_doc.doc_id)\
-                                       .filter(person_doc.person_id.in_(p_ids))
-
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
-
-                if c_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
-
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
-
-                q = session.query(docs).filter(and_(docs.id.in_(topic_query), docs.id.in_(classification_query), docs.id.in_(person_query)))
-
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
-
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
-
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
-
-                self.populate_docs_entities(session, db_results_flat, database, filters)
-
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
-
-    def find_docs_by_classification_country_topic(self, p_ids, p_logic, c_ids, c_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of classification and country and topic ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of classification ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
-
-        @rtype:   json
-        @return:  Array of documents info.
-        """
-        session = self.Session()
-        result_list = []
-        total_count = 0
+        # The list of available entities for a specific database
+        self.Entities = EntityIndex(self.Tables, Controller.entity_names)
 
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
+        # Create Factory class for the sessions, binding the classes of every
+        # database to its engine
+        self.Session = sessionmaker(binds=self.Tables.binds())
 
-            table_names = self.Tables[database].keys()
-            if set(['topics', 'topic_doc', 'countries', 'country_doc', 'classifications', 'classification_doc', 'docs']) <= set(table_names):
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                docs = self.Tables[database]['docs']
+        self.__init_topics()
 
-                topic_query = session.query(topic_doc.doc_id)\
-                                     .filter(topic_doc.topic_id.in_(t_ids))
+    def __init_topics(self):
+        """
+        This function loads the topic data used by the topic routes, if the
+        topic store has been built. Topic tokens and docs are read from the
+        memory-mapped topic store, which is only compiled by the build
+        script (build.py topics) from the static files pre-generated by the
+        external topics script.
+        """
+        self.topic_store = None
+        if os.path.exists(Controller.TOPIC_STORE):
+            self.load_topic_store()
 
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
 
-                classification_query = session.query(classification_doc.doc_id)\
-                                       .filter(classification_doc.classification_id.in_(p_ids))
+    def load_topic_store(self):
+        """
+        This function maps the topic store and loads the topic ids of every
+        collection, unless the store is already mapped.
 
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
+        @raise MissingDataError: If the topic store has not been built.
+        """
+        if self.topic_store is not None:
+            return
 
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
+        with self.topic_lock:
+            if self.topic_store is not None:
+                return
+            if not os.path.exists(Controller.TOPIC_STORE):
+                raise MissingDataError('the topic store', 'topics')
+            topic_store = TopicStore(Controller.TOPIC_STORE)
 
-                if p_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
+            # Load all data for topic routes
+            for collection in Controller.TOPIC_COLLECTIONS:
+                if collection not in topic_store.collections:
+                    continue
 
-                q = session.query(docs).filter(and_(docs.id.in_(topic_query), docs.id.in_(country_query), docs.id.in_(classification_query)))
+                database = self.collection_names[collection]
 
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
+                # possible topic_ids are the topics of the store.
+                self.Topics[database]['valid_topic_ids'] = topic_store.topic_ids(collection)
+            self.topic_store = topic_store
 
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
 
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
+    def topic_doc_ids(self, database):
+        """
+        This function returns the set of document ids of the topic_doc table
+        of a database. The set is loaded on first use from its packed file,
+        which is only built by the build script (build.py topic_docs).
 
-                self.populate_docs_entities(session, db_results_flat, database, filters)
+        @type  database: string
+        @param database: The name of the database.
 
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
+        @rtype:   PackedIdSet
+        @return:  The ids of the documents having topics.
 
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
+        @raise MissingDataError: If the packed file has not been built.
+        """
+        doc_ids = self.Topics[database].get('valid_doc_ids')
+        if doc_ids is not None:
+            return doc_ids
 
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
+        with self.topic_lock:
+            if 'valid_doc_ids' not in self.Topics[database]:
+                path = os.path.join(Controller.TOPIC_DOC_IDS, '{}.ids'.format(database))
+                if not os.path.exists(path):
+                    raise MissingDataError('the topic document ids of {}'.format(database), 'topic_docs')
+                self.Topics[database]['valid_doc_ids'] = PackedIdSet(path)
+        return self.Topics[database]['valid_doc_ids']
 
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
+
+    def build_topic_doc_ids(self, database):
+        """
+        This function writes the packed file of the document ids of the
+        topic_doc table of a database.
+        """
+        session = self.Session()
+        topic_doc = self.Tables[database]['topic_doc']
+        result = session.query(topic_doc.doc_id).distinct().yield_per(10000)
+
+        path = os.path.join(Controller.TOPIC_DOC_IDS, '{}.ids'.format(database))
+        PackedIdSet.write(path, (doc_id for (doc_id,) in result))
         session.close()
-        return response
 
-    def find_docs_by_person_country_classification(self, p_ids, p_logic, c_ids, c_logic, t_ids, t_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and country and classification ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of classification ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  filters: dictionary
-        @param filters: A list of filters to constrain a query.
 
-        @rtype:   json
-        @return:  Array of documents info.
+    def build_topic_store(self):
+        """
+        This function compiles the static token and topic data files
+        that have been pre-generated by the external topics script into
+        the topic store file.
         """
         session = self.Session()
-        result_list = []
-        total_count = 0
+        store = {}
 
-        for collection in filters['collections']:
+        for collection in Controller.TOPIC_COLLECTIONS:
             database = self.collection_names[collection]
-
             table_names = self.Tables[database].keys()
-            if set(['classifications', 'classification_doc', 'countries', 'country_doc', 'persons', 'person_doc', 'docs']) <= set(table_names):
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                docs = self.Tables[database]['docs']
 
-                classification_query = session.query(classification_doc.doc_id)\
-                                     .filter(classification_doc.classification_id.in_(t_ids))
+            if 'topic_doc' in table_names:
+                topic_doc = self.Tables[database]['topic_doc']
 
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
+                # possible topic_ids will be loaded here.
+                result = session.query(topic_doc.topic_id).distinct(topic_doc.topic_id)
 
-                person_query = session.query(person_doc.doc_id)\
-                                       .filter(person_doc.person_id.in_(p_ids))
+                valid_topic_ids = {topic_id for (topic_id,) in result}
 
-                if t_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
+                if collection == "cpdoc":
+                    topics = self.Tables[database]['topics']
+                    result = session.query(topics.id).filter(topics.name.isnot(None))
 
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
+                    valid_topic_ids = {id for (id,) in result}
 
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
+                store[collection] = {
+                    'tokens': self.__read_topic_files(Controller.topic_token_path, collection, valid_topic_ids),
+                    'docs': self.__read_topic_files(Controller.topic_doc_path, collection, valid_topic_ids)
+                }
 
-                q = session.query(docs).filter(and_(docs.id.in_(classification_query), docs.id.in_(country_query), docs.id.in_(person_query)))
+        session.close()
+        TopicStore.write(Controller.TOPIC_STORE, store)
+
+
+    def __read_topic_files(self, path, collection, topic_ids):
+        """
+        This function reads the CSV file of every topic of a collection, and
+        returns the columns of the files and the rows of every topic.
+        """
+        columns = []
+        topic_rows = {}
+        for topic_id in topic_ids:
+            filename = '{}.csv'.format(topic_id)
+            current_path = os.path.join(path, "{}".format(collection), filename)
+            with open(current_path, newline='') as infile:
+                reader = csv.reader(infile)
+                keys = next(reader)
+                rows = list(reader)
+
+            # The rows of a collection are stored under a single header
+            if not columns:
+                columns = keys
+            if keys != columns:
+                raise ValueError('{} does not match the columns {}'.format(current_path, columns))
+            topic_rows[topic_id] = rows
+        return (columns, topic_rows)
+
+
+    def reload(self, database=None):
+        """
+        This function drops the in-memory entity data (names, posting list
+        sizes, monthly counts, search counts and topic document ids) of a
+        database, or of all databases, and the cached visualizations
+        responses. The routing map, document id sets, autocomplete and
+        similarity indexes are read again from their data files. It is meant
+        to be called once a collection has been re-ingested and its data
+        files rebuilt with build.py. The databases whose columns have changed
+        are mapped again.
+        """
+        for changed in self.Tables.reload(database):
+            self.Entities.pop(changed, None)
+        self.registry.reload(database)
+        self.router.reload()
+        self.sampler.reload()
+        self.autocomplete.reload()
+        self.similar.reload(database)
+        self.search_backend.reload()
+        self.planner.reload(database)
+        self.rollup.reload(database)
+        self.count_cache.clear()
+        self.viz_cache.clear()
+
+        with self.topic_lock:
+            # The topic store holds every collection, so it is read again
+            # whichever database is reloaded
+            self.topic_store = None
+            for topic_database in list(self.Topics.keys()):
+                self.Topics[topic_database].pop('valid_topic_ids', None)
+                if database is None or topic_database == database:
+                    self.Topics[topic_database].pop('valid_doc_ids', None)
 
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
 
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
+    def populate_docs_entities(self, session, db_results_flat, database, filters):
+        """
+        This function takes a list of document ids and queries the databases
+        to collect their entities (persons, topics, countries) lists.
 
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
+        The entity ids of all the requested entity types are fetched from the
+        entity_doc tables in a single round trip, their names are resolved
+        from the in-memory dictionaries of the Registry, and every entity is
+        returned as an {'id', 'name'} dictionary. Ids missing from a
+        dictionary make the Registry check its table for changes at once;
+        the ids still missing then are logged and left out.
 
-                self.populate_docs_entities(session, db_results_flat, database, filters)
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  db_results_flat: dictionary
+        @param db_results_flat: A json dictionary containing the document results to
+            return to the user.
+        @type  database: string
+        @param database: The name of the collection to query.
+        @type  filters: dictionary
+        @param filters: A list of filters to constrain a query.
 
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
+        @rtype:   None
+        @return:  Modifies the db_results_flat object and populates entities.
+        """
+        requested = [entity for entity in Controller.DOC_ENTITY_FIELDS if entity in filters['fields']]
+        if not db_results_flat or not requested:
+            return
 
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
+        doc_ids = [row['id'] for row in db_results_flat]
+        table_names = self.Tables[database].keys()
 
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
+        doc_ids_entities = {}
+        entity_names = {}
+        selects = []
+        for entity in requested:
+            (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+            if entity not in table_names or link_name not in table_names:
+                continue
+
+            entity_doc = self.Tables[database][link_name]
+            entity_names[entity] = self.registry.names(session, database, entity)
+            for row in db_results_flat:
+                doc_ids_entities[(entity, row['id'])] = []
+
+            selects.append(select([literal(entity).label('entity'), entity_doc.doc_id,
+                                   getattr(entity_doc, link_column)])
+                           .where(entity_doc.doc_id.in_(doc_ids)))
+
+        if selects:
+            # A single round trip for all the entity types, on the engine of
+            # the database
+            query = union_all(*selects)
+            bind = session.get_bind(mapper=self.Tables[database]['docs'])
+            rows = session.execute(query, bind=bind).fetchall()
+
+            # Entities added since the dictionaries were last checked
+            for entity in set(entity for (entity, doc_id, entity_id) in rows
+                              if entity_id not in entity_names[entity]):
+                entity_names[entity] = self.registry.names(session, database, entity, check=True)
+
+            for (entity, doc_id, entity_id) in rows:
+                if entity_id not in entity_names[entity]:
+                    logger.warning('%s %s of document %s is missing from %s.%s', entity, entity_id, doc_id,
+                                   database, entity)
+                    continue
+                entity_name = entity_names[entity][entity_id]
+                if entity_name and (entity, doc_id) in doc_ids_entities:
+                    doc_ids_entities[(entity, doc_id)].append({'id': entity_id, 'name': entity_name.strip()})
 
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
+        for row in db_results_flat:
+            for entity in requested:
+                row[entity] = doc_ids_entities.get((entity, row['id']))
+
+
+    def find_docs_by_ids(self, doc_ids, filters):
+        """
+        This function returns the document information of a list of
+        doc_ids.
 
-    def find_docs_by_person_country_topic_classification(self, p_ids, p_logic, c_ids, c_logic, t_ids, t_logic, f_ids, f_logic, filters):
-        """
-        This function returns the document information given a list
-        of person and country and topic and classification ids.
-
-        @type  p_ids: list
-        @param p_ids: A list of person ids to query the database for.
-        @type  p_logic: string
-        @param p_logic: AND / OR operator
-        @type  c_ids: list
-        @param c_ids: A list of country ids to query the databases for.
-        @type  c_logic: string
-        @param c_logic: AND / OR operator
-        @type  t_ids: list
-        @param t_ids: A list of topic ids to query the databases for.
-        @type  t_logic: string
-        @param t_logic: AND / OR operator
-        @type  f_ids: list
-        @param f_ids: A list of classification ids to query the databases for.
-        @type  f_logic: string
-        @param f_logic: AND / OR operator
+        @type  doc_ids: list
+        @param doc_ids: A list of document ids to query the databases for.
         @type  filters: dictionary
         @param filters: A list of filters to constrain a query.
 
@@ -1513,145 +426,227 @@ class Controller(object):
         """
         session = self.Session()
         result_list = []
-        total_count = 0
 
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
+        # Group the document ids by the database holding them
+        db_locations = self.router.locate(session, doc_ids)
+
+        for database, db_doc_ids in db_locations.items():
+            docs = self.Tables[database]['docs']
+            q = session.query(docs).filter(docs.id.in_(db_doc_ids))
+            # q = self.__apply_query_filters(session, q, docs, filters, collection=None)
+
+            db_results_objects = q.all()    # returns all documents
+            db_results_flat = self.__package_db_results(db_results_objects, filters)
+            self.populate_docs_entities(session, db_results_flat, database, filters)
+            result_list.extend(db_results_flat)
 
-            table_names = self.Tables[database].keys()
-            if set(['topics', 'topic_doc', 'countries', 'country_doc', 'persons', 'person_doc', 'classifications', 'classification_doc', 'docs']) <= set(table_names):
-                topics = self.Tables[database]['topics']
-                topic_doc = self.Tables[database]['topic_doc']
-                countries = self.Tables[database]['countries']
-                country_doc = self.Tables[database]['country_doc']
-                persons = self.Tables[database]['persons']
-                person_doc = self.Tables[database]['person_doc']
-                classifications = self.Tables[database]['classifications']
-                classification_doc = self.Tables[database]['classification_doc']
-                docs = self.Tables[database]['docs']
 
-                topic_query = session.query(topic_doc.doc_id)\
-                                     .filter(topic_doc.topic_id.in_(t_ids))
+        session.close()
+        self.clerk.format_dates(result_list)
+        response = self.clerk.process(result_list, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode)
+        response.mimetype = 'application/json'
+        response.headers['Content-Type'] = 'application/json'
+        return response
 
-                country_query = session.query(country_doc.doc_id)\
-                                       .filter(country_doc.country_id.in_(c_ids))
 
-                person_query = session.query(person_doc.doc_id)\
-                                       .filter(person_doc.person_id.in_(p_ids))
+    def find_docs(self, entity_filters, filters):
+        """
+        This function returns the document information given any
+        combination of entity filters and a date range.
 
-                classification_query = session.query(classification_doc.doc_id)\
-                                       .filter(classification_doc.classification_id.in_(f_ids))
+        @type  entity_filters: list
+        @param entity_filters: A list of (entity, ids, logic) tuples, where
+            entity is one of persons, countries, topics, classifications and
+            logic is the AND / OR operator.
+        @type  filters: dictionary
+        @param filters: A list of filters to constrain a query.
 
-                if t_logic == 'AND':
-                    topic_query = topic_query.group_by(topic_doc.doc_id)\
-                                               .having(func.count('*') == len(set(t_ids)))
+        @rtype:   json
+        @return:  Array of documents info.
+        """
+        collection_results = []
+        total_count = 0
+        partial = []
+
+        # We must have the date and collection attached for sorting documents
+        for field in ('date', 'collection'):
+            if field not in filters['fields']:
+                filters['fields'].append(field)
+
+        # The total count is computed once per search: subsequent pages carry
+        # it in their continuation token, and searches with the same filters
+        # share it through the count cache.
+        count_mode = filters['count_mode']
+        count_signature = self.__count_signature(entity_filters, filters)
+        cached_count = filters['page_count']
+        if cached_count is None and count_mode != 'none':
+            cached_count = self.count_cache.get(count_signature)
+        if cached_count is not None:
+            count_mode = 'none'
+
+        # Query the collections concurrently, each worker using its own session
+        futures = [(collection, self.executor.submit(self.__find_collection_docs, collection, entity_filters, filters, count_mode))
+                   for collection in filters['collections']]
+        wait([future for (collection, future) in futures], timeout=Controller.QUERY_TIMEOUT)
+
+        for (collection, future) in futures:
+            # Collections that timed out or failed are reported to the user
+            if not future.done() or future.exception() is not None:
+                future.cancel()
+                partial.append(collection)
+                continue
+
+            if future.result() is None:
+                continue
+
+            (db_results_flat, count) = future.result()
+            total_count = total_count + (count or 0)
+            collection_results.append((collection, db_results_flat))
+
+        if cached_count is not None:
+            total_count = cached_count
+        elif count_mode == 'none':
+            total_count = None
+        elif not partial:
+            self.count_cache.set(count_signature, total_count)
+
+        (results_combined, collection_next_index, collection_last_row, has_next) = self.__merge_collections_results(collection_results, filters['page_size'], filters['page_start_index'].copy())
+
+        # Collections resume after the last document they returned, the others
+        # keep their previous seek key or offset.
+        collection_next_seek = filters['page_seek'].copy()
+        for collection, row in collection_last_row.items():
+            collection_next_seek[collection] = (row['date'], row['id'])
+            collection_next_index[collection] = 0
+
+        # Dates are only serialized once the seek keys have been taken
+        self.clerk.format_dates(results_combined)
+
+        # The count of a search missing some collections is not carried by
+        # its next page, which counts again
+        token_count = total_count if cached_count is not None or not partial else None
 
-                if c_logic == 'AND':
-                    country_query = country_query.group_by(country_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(c_ids)))
+        # build link
+        current_page = filters['page'] or ''
+        next_page_token = self.clerk.encode_page_token(collection_next_seek, collection_next_index, token_count)
+        next_page = self.clerk.build_link(filters['page_url'], current_page, next_page_token, has_next)
 
-                if p_logic == 'AND':
-                    person_query = person_query.group_by(person_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(p_ids)))
+        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
+            page=current_page, page_size=filters['page_size'], next_page=next_page,count=total_count,
+            partial=partial, count_mode=(None if filters['count_mode'] == 'exact' else filters['count_mode']))
+        response.mimetype = 'application/json'
+        response.headers['Content-Type'] = 'application/json'
+        return response
 
-                if f_logic == 'AND':
-                    classification_query = classification_query.group_by(classification_doc.doc_id)\
-                                                 .having(func.count('*') == len(set(f_ids)))
 
-                q = session.query(docs).filter(and_(docs.id.in_(topic_query), docs.id.in_(country_query), docs.id.in_(person_query), docs.id.in_(classification_query)))
+    def __find_collection_docs(self, collection, entity_filters, filters, count_mode):
+        """
+        Private function run by the query workers. It fetches a single page of
+        documents of a collection and populates their entities.
 
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
-                db_results_objects = q.all()    # executes query and returns all documents
+        @rtype:   tuple
+        @return:  A (documents, total_count) pair with the documents ordered
+            by date, or None if the collection cannot be queried with the
+            given filters. The total count is exact, estimated or None
+            depending on count_mode (exact, estimate, none).
+        """
+        session = self.Session()
+        try:
+            database = self.collection_names[collection]
 
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
+            q = self.planner.plan(session, database, entity_filters)
+            if q is None:
+                return None
 
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
+            # Queries still running once find_docs stops waiting for them are
+            # interrupted by MySQL, as cancelling a running future does not
+            # stop its query. The hint is kept by the count query.
+            q = q.prefix_with('/*+ MAX_EXECUTION_TIME({}) */'.format(int(Controller.QUERY_TIMEOUT * 1000)))
 
-                self.populate_docs_entities(session, db_results_flat, database, filters)
+            docs = self.Tables[database]['docs']
+            (q, count) = self.__apply_query_filters(session, q, docs, filters, collection, count=(count_mode == 'exact'))
+            if count_mode == 'estimate':
+                count = self.planner.estimate_count(session, database, entity_filters)
+            db_results_objects = q.all()    # returns a single page of documents
 
-                for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
+            db_results_flat = self.__package_db_results(db_results_objects, filters)
 
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
+            self.populate_docs_entities(session, db_results_flat, database, filters)
 
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
+            return (db_results_flat, count)
+        finally:
+            session.close()
 
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
 
-    def find_docs_by_date(self, filters):
+    def export_docs(self, entity_filters, filters, export_format):
         """
-        This function returns the document information filtered
-        by a date range.
+        This function streams every document matching any combination of
+        entity filters and a date range, across collections.
+
+        Every collection is read by a single query through a server-side
+        cursor (see __export_collection_docs), and the collections are
+        merged by date like the pages of find_docs.
 
+        @type  entity_filters: list
+        @param entity_filters: A list of (entity, ids, logic) tuples.
         @type  filters: dictionary
         @param filters: A list of filters to constrain a query.
+        @type  export_format: string
+        @param export_format: The format of the export, ndjson or csv.
 
-        @rtype:   json
-        @return:  Array of documents info.
+        @rtype:   response
+        @return:  A streamed response of all the documents.
         """
-        session = self.Session()
-
-        result_list = []
-        total_count = 0
+        # We must have the date and collection attached for sorting documents
+        for field in ('date', 'collection'):
+            if field not in filters['fields']:
+                filters['fields'].append(field)
 
-        for collection in filters['collections']:
-            database = self.collection_names[collection]
+        def export_rows():
+            streams = [self.__date_ordered_stream(collection,
+                                                  self.__export_collection_docs(collection, entity_filters, filters),
+                                                  rank)
+                       for rank, collection in enumerate(filters['collections'])]
+            for (date_val, rank, position, collection, row) in heapq.merge(*streams):
+                yield row
 
-            table_names = list(self.Tables[database].keys())
-            if 'docs' in table_names:
-                docs = self.Tables[database]['docs']
+        fields = ['id'] + [field for field in filters['fields'] if field != 'id']
+        return self.clerk.export(export_rows(), fields, export_format)
 
-                q = session.query(docs)
-                # q = self.__apply_query_filters(session, q, docs, filters, collection)
 
-                db_results_objects = q.all()    # returns all documents
+    def __export_collection_docs(self, collection, entity_filters, filters):
+        """
+        Private generator yielding every document of a collection matching
+        the filters, ordered by date. The documents are streamed from the
+        database EXPORT_BATCH_SIZE at a time (yield_per), and the entities of
+        every batch are fetched on a second session, the connection of the
+        first one being busy until the cursor is exhausted.
+        """
+        session = self.Session()
+        entity_session = self.Session()
+        try:
+            database = self.collection_names[collection]
 
-                if len(db_results_objects) > 0:
-                    count = int(db_results_objects[0][0])
-                    total_count = total_count + count
+            q = self.planner.plan(session, database, entity_filters)
+            if q is None:
+                return
 
-                db_results_flat = self.__package_db_results(db_results_objects, filters)
+            docs = self.Tables[database]['docs']
+            (q, count) = self.__apply_query_filters(session, q, docs, filters, None, count=False, paged=False)
 
-                self.populate_docs_entities(session, db_results_flat, database, filters)
+            db_results_objects = iter(q.yield_per(Controller.EXPORT_BATCH_SIZE))
+            while True:
+                batch = list(islice(db_results_objects, Controller.EXPORT_BATCH_SIZE))
+                if not batch:
+                    break
 
+                db_results_flat = self.__package_db_results(batch, filters)
+                self.populate_docs_entities(entity_session, db_results_flat, database, filters)
                 for row in db_results_flat:
-                    date_val = row['date']
-                    if not date_val:
-                        date_val = datetime(1200, 1, 1, 0, 0)
-                    if isinstance(date_val, date):
-                        # convert to datetime object if it's just date
-                        date_val = datetime.combine(date_val, datetime.min.time())
-                    result_list.append((row, collection, date_val))
-
-        (results_combined, collection_next_index, has_next) = self.__merge_collections_results(result_list, filters['page_size'], filters['page_start_index'].copy())
-
-        # build link
-        collapsed_start_index = ":".join([":".join([key, str(value)]) for key, value in filters['page_start_index'].items()])
-        collapsed_next_index = ":".join([":".join([key, str(value)]) for key, value in collection_next_index.items()])
-        next_page = self.clerk.build_link(filters['page_url'], collapsed_start_index, collapsed_next_index, has_next)
-
-        response = self.clerk.process(results_combined, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=collapsed_start_index, page_size=Controller.PAGE_SIZE_DEFAULT, next_page=next_page,count=total_count)
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        session.close()
-        return response
+                    yield row
+        finally:
+            session.close()
+            entity_session.close()
 
 
     def get_overview_data(self, entity, limit, geo_ids, filters, request_url):
@@ -1668,34 +663,14 @@ class Controller(object):
         database = self.collection_names[collection]
         table_names = self.Tables[database].keys()
 
-        entity_doc = ""
-        if entity == "countries":
-            entity_doc = "country_doc"
-        if entity == "persons":
-            entity_doc = "person_doc"
-        if entity == "topics":
-            entity_doc = "topic_doc"
-        if entity == "classifications":
-            entity_doc = "classification_doc"
+        (entity_doc, link_column) = Planner.ENTITY_LINKS[entity]
 
         if entity in table_names and entity_doc in table_names and "docs" in table_names:
-            entity = self.Tables[database][entity]
-            entity_doc = self.Tables[database][entity_doc]
-            docs = self.Tables[database]['docs']
-
             # Two types of calls: 1. Filter given geo_ids and data range, 2. Filter with dates only
-            q = session.query(entity.id, entity.name, func.count('*').label('total_docs'))\
-                .join(entity_doc).filter(and_(entity_doc.date >= start_date, entity_doc.date <= end_date))\
-                .filter(entity.name != "Null").group_by(entity.id).order_by(desc('total_docs')).limit(limit)
+            if geo_ids and "country_doc" not in table_names:
+                geo_ids = None
 
-            #if geo_ids:
-            #    if "country_doc" in table_names:
-            #        country_doc = self.Tables[database]['country_doc']
-            #        q = session.query(entity.id, entity.name, func.count('*').label('total_docs'))\
-            #            .join(entity_doc).filter(and_(entity_doc.date >= start_date, entity_doc.date <= end_date, country_doc.country_id.in_(geo_ids)))\
-            #            .filter(entity.name != "Null").group_by(entity.id).order_by(desc('total_docs')).limit(limit)
-
-            result = q.all()
+            result = self.rollup.top(session, database, entity, start_date, end_date, limit, geo_ids)
 
             for (entity_id, entity_name, doc_count) in result:
                 result_list.append({'id':entity_id, 'name':entity_name, 'total_docs':doc_count})
@@ -1764,6 +739,12 @@ class Controller(object):
                                      ])
 
         database = self.collection_names[collection]
+        try:
+            self.load_topic_store()
+        except MissingDataError as error:
+            return self.clerk.complain(Controller.HTTP_STATUS_UNAVAILABLE, "MissingDataError",
+                                       [{"error": str(error)}])
+
         if 'valid_topic_ids' not in self.Topics[database]:
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "CollectionError",[{"error": "Collection does not contain topic info"}])
 
@@ -1772,8 +753,8 @@ class Controller(object):
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "TopicIdError",[{"error": "Please enter a valid topid_id"}])
 
         session = self.Session()
-        result_count = len(self.Topics[database]['top_topic_tokens'][topic_id])
-        tokens = self.Topics[database]['top_topic_tokens'][topic_id][:limit]
+        result_count = self.topic_store.count(collection, 'tokens', topic_id)
+        tokens = self.topic_store.rows(collection, 'tokens', topic_id, limit)
 
         topics = self.Tables[database]['topics']
         topic_name = session.query(topics.name).filter(topics.id == topic_id).filter(topics.name != "Null").first()
@@ -1850,6 +831,12 @@ class Controller(object):
                                      ])
 
         database = self.collection_names[collection]
+        try:
+            self.load_topic_store()
+        except MissingDataError as error:
+            return self.clerk.complain(Controller.HTTP_STATUS_UNAVAILABLE, "MissingDataError",
+                                       [{"error": str(error)}])
+
         if 'valid_topic_ids' not in self.Topics[database]:
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "CollectionError",[{"error": "Collection does not contain topic doc"}])
 
@@ -1858,8 +845,8 @@ class Controller(object):
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "TopicDocError",[{"error": "Please enter a valid topid_id"}])
 
         session = self.Session()
-        result_count = len(self.Topics[database]['top_topic_docs'][topic_id])
-        docs = self.Topics[database]['top_topic_docs'][topic_id][:limit]
+        result_count = self.topic_store.count(collection, 'docs', topic_id)
+        docs = self.topic_store.rows(collection, 'docs', topic_id, limit)
 
         topics = self.Tables[database]['topics']
         topic_name = session.query(topics.name).filter(topics.id == topic_id).filter(topics.name != "Null").first()
@@ -1890,16 +877,26 @@ class Controller(object):
         result_list = []
         session = self.Session()
 
-        docdb = self.Tables['declassification_api']['docdb']
-
         # Get the database that we need to search document in
-        (database,) = session.query(docdb.db_name).filter(docdb.doc_id == doc_id).first()
+        db_locations = self.router.locate(session, [doc_id])
+        if not db_locations:
+            session.close()
+            return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "TopicDocError",[{"error": "Please enter a valid doc_id"}])
+        (database,) = db_locations.keys()
 
-        if 'valid_topic_ids' not in self.Topics[database]:
-            return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "CollectionError",[{"error": "Collection does not contain topic doc"}])
+        try:
+            self.load_topic_store()
+            if 'valid_topic_ids' not in self.Topics[database]:
+                session.close()
+                return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "CollectionError",[{"error": "Collection does not contain topic doc"}])
+            topic_doc_ids = self.topic_doc_ids(database)
+        except MissingDataError as error:
+            session.close()
+            return self.clerk.complain(Controller.HTTP_STATUS_UNAVAILABLE, "MissingDataError",
+                                       [{"error": str(error)}])
 
         # Make sure doc_id is valid.
-        if doc_id not in self.Topics[database]['valid_doc_ids']:
+        if doc_id not in topic_doc_ids:
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "TopicDocError",[{"error": "Please enter a valid topid_id"}])
 
         topic_doc = self.Tables[database]['topic_doc']
@@ -1918,6 +915,54 @@ class Controller(object):
         session.close()
         return response
 
+    def get_similar_docs(self, doc_id, limit):
+        """
+        This function is used by the documents_similar() API route. It
+        returns the documents of the collection of doc_id whose topics are
+        the most similar to those of doc_id.
+        """
+        session = self.Session()
+
+        # Get the database that we need to search document in
+        db_locations = self.router.locate(session, [doc_id])
+        if not db_locations:
+            session.close()
+            return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "SimilarDocError",[{"error": "Please enter a valid doc_id"}])
+        (database,) = db_locations.keys()
+
+        if 'topic_doc' not in self.Tables[database] or 'docs' not in self.Tables[database]:
+            session.close()
+            return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "CollectionError",[{"error": "Collection does not contain topic doc"}])
+
+        try:
+            similar = self.similar.similar(session, database, doc_id, limit)
+        except MissingDataError as error:
+            session.close()
+            return self.clerk.complain(Controller.HTTP_STATUS_UNAVAILABLE, "MissingDataError",
+                                       [{"error": str(error)}])
+        if similar is None:
+            session.close()
+            return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "SimilarDocError",[{"error": "Document has no topics"}])
+
+        filters = {'fields': ['collection', 'date', 'title', 'subject', 'id']}
+        scores = dict(similar)
+        docs = self.Tables[database]['docs']
+        available_fields = set(docs.__table__.columns.keys()).intersection(filters['fields'])
+        q = session.query(docs).filter(docs.id.in_(list(scores.keys()))).options(load_only(*available_fields))
+
+        result_list = self.__package_db_results(q.all(), filters)
+        for row in result_list:
+            row['score'] = scores[row['id']]
+        result_list.sort(key=lambda row: row['score'], reverse=True)
+        self.clerk.format_dates(result_list)
+
+        response = self.clerk.process({"doc_id": doc_id, "similar": result_list}, Controller.HTTP_STATUS_SUCCESS,
+                                      self.clerk.JSON.encode, count=len(result_list))
+        response.mimetype = 'application/json'
+        response.headers['Content-Type'] = 'application/json'
+        session.close()
+        return response
+
     def get_tag_docs(self, collection_name, doc_id):
         """
         This function returns a list of tags for a doc
@@ -1991,9 +1036,13 @@ class Controller(object):
             return list(self.collection_names.keys())
 
 
-    def get_entity_info(self, entity, collection, page, page_size, request_url):
+    def get_entity_info(self, entity, collection, page, page_size, request_url, after=None):
         """
         This function is used by the declass_entity_info() API route.
+
+        Entities are listed by id from a cached listing. A page is either
+        selected by its number, or by the id of the last entity of the
+        previous page (after), which is the form of the next_page links.
         """
         if page < 0 or page_size < 1:
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "Invalid API parameters",
@@ -2025,29 +1074,25 @@ class Controller(object):
                                      ])
 
 
-        # 4th, query the database and return results pertaining to the collection and entity
+        # 4th, read the entity listing of the collection and return the requested page
         session = self.Session()
-        offset = page * page_size
-        query_results = []
-
-        if entity == "persons":
-            persons = self.Tables[database_name][entity]
-            person_doc =  self.Tables[database_name]['person_doc']
-
-            query_results = session.query(persons.id, persons.name, func.count(persons.id)).join(person_doc).group_by(person_doc.person_id)[  offset : (offset + page_size + 1) ]
-
-        if entity == "countries":
-            countries = self.Tables[database_name][entity]
-            country_doc =  self.Tables[database_name]['country_doc']
-
-            query_results = session.query(countries.id, countries.name, func.count()).join(country_doc).group_by(country_doc.country_id)[  offset : (offset + page_size + 1) ]
-
-        if entity == "topics":
-            topics = self.Tables[database_name][entity]
-            topic_doc =  self.Tables[database_name]['topic_doc']
+        (entity_ids, listing) = self.registry.listing(session, database_name, entity)
+        session.close()
 
-            query_results = session.query(topics.id, topics.title, func.count()).join(topic_doc).group_by(topic_doc.topic_id)[  offset : (offset + page_size + 1) ]
+        if after is not None:
+            # Seek past the last entity of the previous page
+            if entity_ids and isinstance(entity_ids[0], int):
+                if not after.isdigit():
+                    return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "Invalid API parameters",
+                                            [{'KeyError':
+                                              'Plese enter a valid after value'}
+                                             ])
+                after = int(after)
+            offset = bisect_right(entity_ids, after)
+        else:
+            offset = page * page_size
 
+        query_results = listing[offset : (offset + page_size + 1)]
 
         has_next = False
         if len(query_results) > page_size:
@@ -2055,15 +1100,14 @@ class Controller(object):
 
         results = [{'id': r_id, 'name': r_name, 'count': r_count} for r_id, r_name, r_count in query_results]
 
-
-        session.close()
-
         fetched_data = {"results": results[:page_size], "has_next": has_next}
 
-        next_page = self.clerk.build_link(request_url, str(page), str((page+1)), fetched_data['has_next'])
+        next_page = None
+        if has_next:
+            next_page = self.clerk.build_seek_link(request_url, 'after', results[page_size - 1]['id'])
 
         response = self.clerk.process(fetched_data['results'], Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-                                       page=page, page_size=page_size, next_page=next_page)
+                                       page=None if after is not None else page, page_size=page_size, next_page=next_page)
         response.mimetype = 'application/json'
         response.headers['Content-Type'] = 'application/json'
 
@@ -2073,7 +1117,8 @@ class Controller(object):
     def get_viz_docs(self, table):
         """
         This function is provides access to the visualizations database and returns
-        all table rows.
+        all table rows. The serialized response is cached until the table
+        changes.
 
         @type  table: string
         @param table: The name of a table in the visualizations database.
@@ -2085,26 +1130,30 @@ class Controller(object):
         doc_type = self.Tables['visualizations'][table]
 
         session = self.Session()
-        query_results = session.query(doc_type).all()
 
-        data = []
-        for row in query_results:
-            if row:
-                fields = row.__table__.columns.keys()
-                row_results = dict( (col, getattr(row, col)) for col in fields )
-                data.append(row_results)
+        def render():
+            query_results = session.query(doc_type).all()
+
+            data = []
+            for row in query_results:
+                if row:
+                    fields = row.__table__.columns.keys()
+                    row_results = dict( (col, getattr(row, col)) for col in fields )
+                    data.append(row_results)
 
+            return self.clerk.process(data, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode, page=0, page_size=len(data)).get_data()
+
+        cached = self.viz_cache.fetch(session, ('viz_docs', table), [('visualizations', table)], doc_type, render)
         session.close()
 
-        response = self.clerk.process(data, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode, page=0, page_size=len(data))
-        response.mimetype = 'application/json'
-        response.headers['Content-Type'] = 'application/json'
-        return response
+        return self.__cached_response(*cached)
 
     def get_viz_overview(self, databases, tables, limit):
         """
         This function provides access to the visualizations overview and returns
-        all table rows.
+        all table rows. The serialized response is cached until one of the
+        tables changes, except without limit, where the rows are streamed
+        from the databases instead.
 
         @type  table: string
         @param table: The name of a table in the visualizations database.
@@ -2113,49 +1162,89 @@ class Controller(object):
         @return:  Table content.
         """
 
-        response_data = {}
+        sources = []
         for database in databases:
             # HACK: The database name has changed to declassification_cables from
             # declassification_statedeptcables. This preserves backwards
             # compatibility with old code.
             if database == 'statedeptcables':
                 database = 'cables'
-            response_data[database] = {}
             database_name = "declassification_{0}".format(database)
             for table in tables:
+                sources.append((database, database_name, table))
 
-                doc_type = self.Tables[database_name][table]
-                session = self.Session()
+        session = self.Session()
 
-                if table == "top_persons" or table == "top_countries" or table == "top_topics" or table == "top_classifications":
-                    query_results = session.query(doc_type).order_by(desc('doc_count')).limit(limit+20)
-                else:
-                    query_results = session.query(doc_type).order_by(desc('doc_count'))
+        if limit is None:
+            response_data = {}
+            for (database, database_name, table) in sources:
+                response_data.setdefault(database, {})
+                response_data[database][table] = self.__viz_rows(session, self.Tables[database_name][table],
+                                                                 table, limit)
+
+            response = self.clerk.process(response_data, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
+                                          page=0)
+            response.mimetype = 'application/json'
+            response.headers['Content-Type'] = 'application/json'
+            response.call_on_close(session.close)
+            return response
+
+        def render():
+            response_data = {}
+            data = []
+            for (database, database_name, table) in sources:
+                response_data.setdefault(database, {})
+                data = list(self.__viz_rows(session, self.Tables[database_name][table], table, limit))
+                response_data[database][table] = data
 
-                data = []
-                for row in query_results:
-                    if row:
-                        fields = row.__table__.columns.keys()
-                        row_results = dict( (col, getattr(row, col)) for col in fields )
-                        data.append(row_results)
+            return self.clerk.process(response_data, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode, page=0, page_size=len(data)).get_data()
 
-                if table == 'top_topics':
-                    data = [datum for datum in data if datum['title'] is not None]
+        key = ('viz_overview', tuple(databases), tuple(tables), limit)
+        mapper = self.Tables[sources[0][1]][sources[0][2]]
+        cached = self.viz_cache.fetch(session, key, [(database_name, table) for (database, database_name, table) in sources], mapper, render)
+        session.close()
 
-                if table == "top_persons" or table == "top_countries" or table == "top_topics" or table == "top_classifications":
-                    data = data[:limit]
+        return self.__cached_response(*cached)
 
-                session.close()
+    def __viz_rows(self, session, doc_type, table, limit):
+        """
+        This function yields the rows of an overview table, the most
+        frequent first. Untitled topics are skipped, and the top tables are
+        cut to limit rows unless limit is None.
+        """
+        top_table = table in ("top_persons", "top_countries", "top_topics", "top_classifications")
+        query_results = session.query(doc_type).order_by(desc('doc_count'))
+        if top_table and limit is not None:
+            query_results = query_results.limit(limit+20)
+        else:
+            query_results = query_results.yield_per(1000)
 
-                # HACK to return curect number of topics.
-                #if table == 'top_topics':
-                #    data = [datum for datum in data if datum['title'] is not None]
+        returned = 0
+        for row in query_results:
+            if not row:
+                continue
+            if top_table and limit is not None and returned == limit:
+                break
 
-                response_data[database][table] = data
+            fields = row.__table__.columns.keys()
+            row_results = dict( (col, getattr(row, col)) for col in fields )
+            if table == 'top_topics' and row_results['title'] is None:
+                continue
 
-        response = self.clerk.process(response_data, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode, page=0, page_size=len(data))
+            returned += 1
+            yield row_results
+
+    def __cached_response(self, body, etag, last_modified):
+        """
+        This function builds a response from a cached response body. The
+        route answers conditional requests with it through
+        response.make_conditional(request).
+        """
+        response = self.clerk.make_response(body, Controller.HTTP_STATUS_SUCCESS)
         response.mimetype = 'application/json'
         response.headers['Content-Type'] = 'application/json'
+        response.set_etag(etag)
+        response.last_modified = last_modified
         return response
 
     def get_classification_topics(self, collection):
@@ -2310,23 +1399,32 @@ class Controller(object):
         else:
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "Unsupported Collection",[{"error": "Please enter a collection with classifications"}])
 
-    def get_random_doc_ids(self, limit):
+    def get_random_doc_ids(self, limit, collections=None, seed=None):
         """
         This function is used by the random_doc_ids() API route.
+
+        @type  limit: number
+        @param limit: The number of document ids to return.
+        @type  collections: list
+        @param collections: The collections to sample from (optional).
+        @type  seed: number
+        @param seed: The seed of the random generator (optional).
         """
-        docdb = self.Tables['declassification_api']['docdb']
+        databases = None
+        if collections:
+            databases = [self.collection_names[collection] for collection in collections]
 
-        session = self.Session()
-        query_results = session.query(docdb).order_by(func.rand())[0:limit]
+        try:
+            query_results = self.sampler.sample(limit, databases, seed)
+        except MissingDataError as error:
+            return self.clerk.complain(Controller.HTTP_STATUS_UNAVAILABLE, "MissingDataError",
+                                       [{"error": str(error)}])
 
         data = []
-        for row in query_results:
-            row_results = {"id" : row.doc_id}
+        for doc_id in query_results:
+            row_results = {"id" : doc_id}
             data.append(row_results)
 
-
-        session.close()
-
         response = self.clerk.process(data, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode, page=0, page_size=len(data))
         response.mimetype = 'application/json'
         response.headers['Content-Type'] = 'application/json'
@@ -2340,39 +1438,26 @@ class Controller(object):
         return self.api_config['merriam_text_drop'][0]
 
 
-    def get_entity_autocomplete(self, word_start, entity_type):
+    def get_entity_autocomplete(self, word_start, entity_type, limit=10):
         """
         This function is used by the declass_entity_autocomplete() API route.
+        Entity names are completed from the in-memory prefix index.
         """
 
-        if entity_type == 'persons':
-            entity_table = self.Tables['declassification_api']['persons_autocomplete']
-        elif entity_type == 'countries':
-            entity_table = self.Tables['declassification_api']['geo_autocomplete']
-        elif entity_type == 'topics':
-            entity_table = self.Tables['declassification_api']['topics_autocomplete']
-        elif entity_type == 'classifications':
-            entity_table = self.Tables['declassification_api']['classifications_autocomplete']
-        elif entity_type is None:
-            entity_table = self.Tables['declassification_api']['all_entities_autocomplete'] # note that classifications are not in all_entities autocomplete
-        else:
+        if entity_type not in ('persons', 'countries', 'topics', 'classifications', None):
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "Invalid API parameters",
                                     [{'KeyError': 'entity %s is not valid;' % entity_type}])
 
 
         session = self.Session()
-        # the maximum number of letters supported is 6
-        word_start = word_start[0:6]
-        query_results = session.query(entity_table).filter(entity_table.query == word_start).first()
-
-        data = None
-        if not query_results:
-            data = json.dumps({"query": word_start , "response": []})
-        else:
-            data = query_results.response
-
-
-        session.close()
+        try:
+            results = self.autocomplete.complete(session, word_start, entity_type, limit)
+        except MissingDataError as error:
+            return self.clerk.complain(Controller.HTTP_STATUS_UNAVAILABLE, "MissingDataError",
+                                       [{"error": str(error)}])
+        finally:
+            session.close()
+        data = json.dumps({"query": word_start, "response": results})
 
         response = self.clerk.make_response(data, Controller.HTTP_STATUS_SUCCESS)
         response.mimetype = 'application/json'
@@ -2384,45 +1469,39 @@ class Controller(object):
     def full_text_search(self, search_text, filters):
         """
         This function is used by the declass_full_text_search() API route.
+        The search runs on the configured search backend. Every page links
+        to the next one with a continuation token holding the cursor
+        returned by the backend, so that deep pages are as fast as the first.
+        The facets requested are computed by the same search.
         """
-        result = []
-
-        start_date = filters['start_date']
-        end_date = filters['end_date']
-        page = int(filters['page'])
         page_size = int(filters['page_size'])
         page_url = filters['page_url']
-        collections = filters['collections']
-
-        collections_text = " OR ".join(collections)
-        # search_text = self.clerk.escapeString(search_text)
-        full_text_query = 'date:["' + start_date + '" TO "' + end_date + '"] AND ' + search_text + ' AND collection:(' + collections_text + ')'
-        matches = self.es.search(index='declass', fields='subject,title,id,collection,date', q=full_text_query, size=(page_size+1), from_=((page-1)*page_size))
 
-        #matches = self.es.search(index='declass', fields='subject,title,id,collection,date', q=search_text)
-        #matches = self.es.search(index='declass', fields='subject,title,id,collection,date', q=search_text, size=page_size, from_=((page-1)*page_size))
-        hits = matches['hits']['hits']
-        total_count = matches['hits']['total']
+        token = self.clerk.decode_search_token(filters['page'])
+        page = token['g'] if token else int(filters['page'])
+        cursor = (token['p'], token['a']) if token else None
 
-        has_next = False
-        if hits:
-            if len(hits) > page_size:
-                has_next = True
-
-            for hit in hits:
-                h_score = hit['_score']
-                h_id = hit['_id']
-                h_title = hit['fields']['title'][0]
-                h_subject = hit['fields']['subject'][0]
-                h_collection = hit['fields']['collection'][0]
-                h_date = hit['fields']['date'][0]
+        session = self.Session()
+        try:
+            (result, total_count, next_cursor, facets) = self.search_backend.search(
+                session, search_text, filters['start_date'], filters['end_date'],
+                filters['collections'], page, page_size, cursor, filters.get('facets'))
+        except SearchError as error:
+            return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "Invalid API parameters",
+                                    [{'SearchError': '%s;' % error}])
+        finally:
+            session.close()
 
-                result.append({'id':h_id, 'title':h_title, 'subject':h_subject, 'collection':h_collection, 'date':h_date})
+        if token:
+            total_count = token['n']
 
-        next_page = self.clerk.build_link(page_url, str(page), str((page+1)), has_next)
+        next_token = None
+        if next_cursor:
+            next_token = self.clerk.encode_search_token(next_cursor[0], next_cursor[1], page + 1, total_count)
+        next_page = self.clerk.build_link(page_url, filters['page'], next_token, next_cursor is not None)
 
         response = self.clerk.process(result, Controller.HTTP_STATUS_SUCCESS, self.clerk.JSON.encode,
-            page=page, page_size=page_size, next_page=next_page,count=total_count)
+            page=page, page_size=page_size, next_page=next_page,count=total_count, facets=facets)
 
 
         response.mimetype = 'application/json'
@@ -2430,28 +1509,30 @@ class Controller(object):
         return response
 
 
-    def text_drop_search(self, url, text, limit):
+    def build_fulltext_index(self):
         """
-        This function is used by the declass_text_drop() API route.
+        This function builds the local full text index from the docs tables
+        of every collection, whichever search backend is configured, so that
+        it can be built before switching to it.
         """
-        params = {
-            'limit': limit,
-            'text': text
-        }
+        session = self.Session()
+        try:
+            LocalSearchBackend(self, Controller.FULLTEXT_INDEX, Controller.FACET_SIZES).build(session)
+        finally:
+            session.close()
 
-        headers = {'content-type': 'application/json'}
-        resp = requests.post(url, data=json.dumps(params), headers=headers)
 
-        if resp.status_code != 200:
+    def text_drop_search(self, url, text, limit):
+        """
+        This function is used by the declass_text_drop() API route.
+        """
+        try:
+            doc_ids = self.textdrop.search(url, text, limit)
+        except TextDropError:
             return self.clerk.complain(Controller.HTTP_STATUS_BAD_REQUEST, "API Error",
                                     [{'TextDropError':
                                       'There was an error in processing your request'}
                                      ])
-        data = json.loads(resp.text)
-
-        doc_ids = []
-        for result in data['results']:
-            doc_ids.append(result['doc_id'])
 
         filters = {}
         filters['start_date'] = None
@@ -2462,7 +1543,19 @@ class Controller(object):
         return self.find_docs_by_ids(doc_ids, filters)
 
 
-    def __apply_query_filters(self, session, query, table, filters, collection):
+    def __count_signature(self, entity_filters, filters):
+        """
+        Private function returning the key of a search in the count cache. It
+        is built from every filter that changes the count of a search, and
+        none of those that only change its pages.
+        """
+        entities = tuple(sorted((entity, tuple(sorted(set(ids))), logic)
+                                for (entity, ids, logic) in entity_filters))
+        return (filters['count_mode'], tuple(sorted(filters['collections'])), entities,
+                filters['start_date'], filters['end_date'], filters['exact_date'])
+
+
+    def __apply_query_filters(self, session, query, table, filters, collection, count=True, paged=True):
         """
         Private function to apply user defined constraints to query call.
 
@@ -2476,22 +1569,30 @@ class Controller(object):
         @param filters: A list of filters to constrain a query.
         @type  collection: string
         @param collection: The name of the database to query
-
-        @rtype:   object
-        @return:  A session query combined of two subqueries. The first subquery
-            performs a total count operation, while the other fetches data.
+        @type  count: boolean
+        @param count: Whether to count the matching documents.
+        @type  paged: boolean
+        @param paged: Whether to fetch a single page or all the documents.
+
+        @rtype:   tuple
+        @return:  A (query, total_count) pair. The query is ordered by date
+            and fetches a single page (page_size + 1 rows, the extra row
+            signalling a next page), starting after the collection's seek key
+            or at its page index, or all the documents if paged is False.
+            The total count of matching documents is run as a separate query,
+            it is None if count is False.
         """
         # List of user defined query filters
         start_date = filters['start_date']
         end_date =     filters['end_date']
         exact_date = filters['exact_date']
         fields = filters['fields']
-        fields.append('date') # We must have the date and collection attached for sorting documents
-        fields.append('collection')
-        page_size = filters['page_size']
+        page_size = filters.get('page_size')
         row_record = 0
+        seek = None
         if collection:
-        	row_record = filters['page_start_index'][collection]
+            row_record = filters['page_start_index'][collection]
+            seek = filters['page_seek'].get(collection)
 
         if start_date and end_date:
             query = query.filter(and_(table.date >= start_date, table.date <= end_date))
@@ -2501,23 +1602,38 @@ class Controller(object):
             tomorrow_date = today_date + timedelta(days=1)
             query = query.filter(and_(table.date >= today_date, table.date < tomorrow_date))
 
+        # Separate query for the count variable, run over the id column only
+        total_count = None
+        if count:
+            total_count = query.with_entities(func.count(table.id)).scalar() or 0
+
+        # Resume right after the (date, id) of the last document seen. NULL
+        # dates come first in the ascending date order.
+        if seek:
+            (last_date, last_id) = seek
+            if last_date is None:
+                query = query.filter(or_(table.date.isnot(None),
+                                         and_(table.date.is_(None), table.id > last_id)))
+            else:
+                query = query.filter(and_(table.date >= last_date,
+                                          or_(table.date > last_date, table.id > last_id)))
+
         # Refining the columns that we are searching for
         available_table_columns = set(table.__table__.columns.keys())    # Get fields from docs table
         original_filter = fields
         fields = set.intersection(available_table_columns, original_filter)
 
-        # Subquery for count variable
-        query_total_count = query.options( load_only('id') ).subquery().count().label('count')
-
         if fields:
             query = query.options( load_only( *fields ) )
 
-        query_with_limit = query.order_by(asc(table.date))\
-                                .offset(row_record).limit(page_size +1).subquery()
-
-        query_combined = session.query(query_total_count, query_with_limit)
+        # The id breaks ties between documents sharing a date so that
+        # consecutive pages neither repeat nor skip rows.
+        query = query.order_by(asc(table.date), asc(table.id))
+        if not paged:
+            return (query, total_count)
+        query_with_limit = query.offset(row_record).limit(page_size +1)
 
-        return query_combined
+        return (query_with_limit, total_count)
 
 
     def __package_db_results(self, results, filters):
@@ -2550,24 +1666,45 @@ class Controller(object):
         return db_results_flat
 
 
-    def __merge_collections_results(self, unsorted_list, page_size, page_start_index):
+    def __merge_collections_results(self, collection_results, page_size, page_start_index):
         """
         Private function responsible for combining the document results from
-        various collections and sorting them by date.
+        various collections by date. Every collection's results are already
+        ordered by date, so they are merged with a heap and the merge stops
+        as soon as a page (and the first row of the next one) is filled.
+
+        Returns the page, the next index of every collection, the last row
+        taken from every collection and whether there is a next page.
         """
-        # Sort list
-        result_list = sorted(unsorted_list, key=operator.itemgetter(2))
+        streams = [self.__date_ordered_stream(collection, rows, rank)
+                   for rank, (collection, rows) in enumerate(collection_results)]
 
-        cutoff = page_size
         results_combined = []
         collection_last_index = page_start_index
+        collection_last_row = {}
         has_next = False
-        for (row, collection, date) in result_list:
+        for (date_val, rank, position, collection, row) in heapq.merge(*streams):
+            if len(results_combined) == page_size:
+                has_next = True
+                break
             results_combined.append(row)
             collection_last_index[collection] = collection_last_index[collection] + 1
-            cutoff = cutoff - 1
-            if cutoff == 0:
-                if len(results_combined) < len(result_list):
-                    has_next = True
-                break
-        return (results_combined, collection_last_index, has_next)
+            collection_last_row[collection] = row
+        return (results_combined, collection_last_index, collection_last_row, has_next)
+
+
+    def __date_ordered_stream(self, collection, rows, rank):
+        """
+        Private generator yielding the date ordered rows of a collection as
+        comparable (date, rank, position, collection, row) tuples. The rank of
+        the collection and the position of the row break ties between equal
+        dates, so the rows themselves are never compared.
+        """
+        for position, row in enumerate(rows):
+            date_val = row['date']
+            if not date_val:
+                date_val = datetime(1200, 1, 1, 0, 0)
+            if not isinstance(date_val, datetime):
+                # convert to datetime object if it's just date
+                date_val = datetime.combine(date_val, datetime.min.time())
+            yield (date_val, rank, position, collection, row)
@@ -0,0 +1,9 @@
+class MissingDataError(Exception):
+    """
+    Raised when a data file that only the build script writes is missing.
+    The message names the build.py command writing it.
+    """
+
+    def __init__(self, what, command):
+        super(MissingDataError, self).__init__(
+            '{} has not been built, run: python build.py {}'.format(what, command))
@@ -15,7 +15,9 @@ def parse_args():
     parser.add_argument('-p', '--port', default=5001,
                     help='Port number for API server; default 5001')
 
-    return parser.parse_args()
+    # Scripts importing the api (ex. build.py) parse their own arguments
+    (args, unknown) = parser.parse_known_args()
+    return args
 
 def shutdown_server():
     func = request.environ.get('werkzeug.server.shutdown')
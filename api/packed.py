@@ -0,0 +1,102 @@
+import os
+import mmap
+import struct
+
+from array import array
+
+
+class PackedIdSet(object):
+    """
+    This class is a read-only set of document ids stored in a file as a
+    sorted, packed array of UTF-8 strings:
+
+        magic | number of ids | offsets | strings
+
+    The file is memory-mapped, so the ids are shared by all the worker
+    processes and only the pages touched by a lookup are read. Membership is
+    tested with a binary search over the offsets, which also gives every id
+    a dense position.
+    """
+    MAGIC = b'DIDSET01'
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:len(PackedIdSet.MAGIC)] != PackedIdSet.MAGIC:
+            raise ValueError('{} is not a packed id set'.format(path))
+
+        start = len(PackedIdSet.MAGIC)
+        (self.size,) = struct.unpack_from('<Q', self.map, start)
+        start += 8
+        end = start + (self.size + 1) * 8
+        self.offsets = memoryview(self.map)[start:end].cast('Q')
+        self.strings = end
+
+
+    def __len__(self):
+        return self.size
+
+
+    def __contains__(self, doc_id):
+        return self.index(doc_id) >= 0
+
+
+    def index(self, doc_id):
+        """
+        This function returns the position of doc_id in the sorted ids, or
+        -1 if doc_id is not in the set.
+        """
+        key = doc_id.encode('utf-8')
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) // 2
+            value = self.__value(middle)
+            if value < key:
+                low = middle + 1
+            elif value > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+
+    def __getitem__(self, position):
+        return self.__value(position).decode('utf-8')
+
+
+    def __value(self, position):
+        return self.map[self.strings + self.offsets[position]:self.strings + self.offsets[position + 1]]
+
+
+    @staticmethod
+    def write(path, doc_ids):
+        """
+        This function writes a packed id set file.
+
+        @type  path: string
+        @param path: The path of the file to write.
+        @type  doc_ids: iterable
+        @param doc_ids: The document ids, in any order and possibly repeated.
+        """
+        values = sorted(set(doc_id.encode('utf-8') for doc_id in doc_ids))
+
+        offsets = array('Q', [0])
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(PackedIdSet.MAGIC)
+            outfile.write(struct.pack('<Q', len(values)))
+            outfile.write(offsets.tobytes())
+            for value in values:
+                outfile.write(value)
+
+        # Workers opening the set never see a partially written file
+        os.replace(temp_path, path)
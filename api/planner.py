@@ -0,0 +1,172 @@
+import operator
+
+from sqlalchemy import distinct, func, text
+
+from api.cache import Cache
+
+
+class Planner(object):
+    """
+    This class builds the document queries for any combination of entity
+    filters (persons, countries, topics, classifications) joined by AND / OR.
+
+    For every collection, the entity predicates are ordered by their
+    estimated selectivity, i.e. the size of their posting lists in the
+    entity_doc tables. The most selective predicate drives the join with the
+    docs table while the remaining ones are applied as semi-joins.
+    """
+    # Request parameter, logic parameter and entity name of every entity
+    # that can be used to filter documents.
+    ENTITY_PARAMS = [
+        ('person_ids', 'person_logic', 'persons'),
+        ('geo_ids', 'geo_logic', 'countries'),
+        ('topic_ids', 'topic_logic', 'topics'),
+        ('classification_ids', 'classification_logic', 'classifications')
+    ]
+
+    # The entity_doc table and column linking an entity to its documents.
+    ENTITY_LINKS = {
+        'persons': ('person_doc', 'person_id'),
+        'countries': ('country_doc', 'country_id'),
+        'topics': ('topic_doc', 'topic_id'),
+        'classifications': ('classification_doc', 'classification_id')
+    }
+
+    def __init__(self, controller, maxsize, ttl):
+        self.controller = controller
+        self.posting_sizes = Cache(maxsize, ttl)
+
+
+    def entity_filters(self, entities, passed_params):
+        """
+        This function converts the entities validated by the Clerk into a
+        list of (entity, ids, logic) filters.
+        """
+        entity_filters = []
+        for (param, logic, entity) in Planner.ENTITY_PARAMS:
+            if param in passed_params:
+                entity_filters.append((entity, entities[param], entities[logic]))
+        return entity_filters
+
+
+    def plan(self, session, database, entity_filters):
+        """
+        This function returns a query of the docs table of a database
+        constrained by the entity filters.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  database: string
+        @param database: The name of the database to query.
+        @type  entity_filters: list
+        @param entity_filters: A list of (entity, ids, logic) tuples.
+
+        @rtype:   object
+        @return:  A SQLAlchemy-ORM query, or None if the database does not
+            hold the tables needed by the filters.
+        """
+        tables = self.controller.Tables[database]
+        if 'docs' not in tables:
+            return None
+
+        for (entity, ids, logic) in entity_filters:
+            (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+            if entity not in tables or link_name not in tables:
+                return None
+
+        docs = tables['docs']
+        predicates = []
+        for (entity, ids, logic) in entity_filters:
+            (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+            link = tables[link_name]
+            column = getattr(link, link_column)
+            ids = set(int(i) for i in ids)
+
+            # We want to get the document ids associated with the input ids,
+            # counting every id once however many links it has to a document
+            predicate = session.query(link.doc_id).filter(column.in_(ids))
+            if logic == 'AND':
+                predicate = predicate.group_by(link.doc_id)\
+                                     .having(func.count(distinct(column)) == len(ids))
+            else:
+                predicate = predicate.distinct()
+
+            estimate = self.estimate(session, database, entity, column, ids, logic)
+            predicates.append((estimate, predicate))
+
+        predicates.sort(key=operator.itemgetter(0))
+
+        query = session.query(docs)
+        if predicates:
+            # The smallest posting list drives the join
+            driver = predicates[0][1].subquery()
+            query = query.join(driver, docs.id == driver.c.doc_id)
+            for (estimate, predicate) in predicates[1:]:
+                query = query.filter(docs.id.in_(predicate))
+
+        return query
+
+
+    def reload(self, database=None):
+        """
+        This function drops the posting list sizes. They are only estimates,
+        so the sizes of every database are dropped with the ones of a
+        reloaded database.
+        """
+        self.posting_sizes.clear()
+
+
+    def estimate(self, session, database, entity, column, ids, logic):
+        """
+        This function estimates the number of documents matching an entity
+        filter from the posting list sizes of its ids. Posting list sizes are
+        cached, until they expire or are evicted by the sizes of other ids.
+        """
+        sizes = {}
+        missing = []
+        for i in set(int(i) for i in ids):
+            size = self.posting_sizes.get((database, entity, i))
+            if size is None:
+                missing.append(i)
+            else:
+                sizes[i] = size
+
+        if missing:
+            counts = dict((int(entity_id), count) for (entity_id, count) in
+                          session.query(column, func.count('*'))
+                                 .filter(column.in_(missing))
+                                 .group_by(column))
+            for i in missing:
+                sizes[i] = counts.get(i, 0)
+                self.posting_sizes.set((database, entity, i), sizes[i])
+
+        sizes = list(sizes.values())
+        if not sizes:
+            return 0
+        if logic == 'AND':
+            return min(sizes)
+        return sum(sizes)
+
+
+    def estimate_count(self, session, database, entity_filters):
+        """
+        This function estimates the number of documents of a database
+        matching the entity filters without running the search. It is the
+        size of the most selective filter, or the number of rows MySQL keeps
+        for the docs table when there are no entity filters. Date filters are
+        not taken into account.
+        """
+        tables = self.controller.Tables[database]
+        estimates = []
+        for (entity, ids, logic) in entity_filters:
+            (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+            column = getattr(tables[link_name], link_column)
+            estimates.append(self.estimate(session, database, entity, column, ids, logic))
+
+        if estimates:
+            return min(estimates)
+
+        table_rows = session.execute(text("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                                          "WHERE TABLE_SCHEMA = :database AND TABLE_NAME = 'docs'"),
+                                     {'database': database}, mapper=tables['docs']).scalar()
+        return int(table_rows or 0)
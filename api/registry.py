@@ -0,0 +1,121 @@
+import time
+
+from sqlalchemy import func
+
+from api.cache import Cache
+from api.planner import Planner
+
+
+class Registry(object):
+    """
+    This class keeps the entity (persons, countries, topics,
+    classifications) id to name dictionaries of every database in memory, so
+    that documents and overviews can resolve entity names without joining
+    the entity tables.
+
+    The number of dictionaries held is bounded, the least recently used ones
+    being dropped first. Every dictionary carries a version (the row count
+    and largest id of its table) which is checked against the database at
+    most once every check_interval seconds, and the dictionary is reloaded
+    when its table has changed.
+
+    It also keeps the (id, name, document count) listings of the entities
+    of every database, sorted by id, for listing_ttl seconds.
+    """
+
+    def __init__(self, controller, maxsize, check_interval, listing_ttl):
+        self.controller = controller
+        self.check_interval = check_interval
+        self.dictionaries = Cache(maxsize)
+        self.listings = Cache(maxsize, listing_ttl)
+
+
+    def names(self, session, database, entity, check=False):
+        """
+        This function returns the id to name dictionary of an entity table.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  database: string
+        @param database: The name of the database holding the entity table.
+        @type  entity: string
+        @param entity: The name of the entity table (ex. persons).
+        @type  check: boolean
+        @param check: Whether to check the table for changes now, rather
+            than once every check_interval seconds (optional).
+
+        @rtype:   dictionary
+        @return:  The names of the entities keyed by their ids.
+        """
+        entities = self.controller.Tables[database][entity]
+        cached = self.dictionaries.get((database, entity))
+
+        if cached is not None:
+            (version, checked, names) = cached
+            if not check and time.time() - checked < self.check_interval:
+                return names
+            current_version = self.__version(session, entities)
+            if current_version == version:
+                self.dictionaries.set((database, entity), (version, time.time(), names))
+                return names
+
+        version = self.__version(session, entities)
+        names = dict(session.query(entities.id, entities.name))
+        self.dictionaries.set((database, entity), (version, time.time(), names))
+        return names
+
+
+    def listing(self, session, database, entity):
+        """
+        This function returns the entities of a database with the number of
+        documents mentioning them, sorted by entity id.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  database: string
+        @param database: The name of the database holding the entity table.
+        @type  entity: string
+        @param entity: The name of the entity table (ex. persons).
+
+        @rtype:   tuple
+        @return:  The sorted list of entity ids, and the list of their
+            (id, name, count) tuples in the same order.
+        """
+        cached = self.listings.get((database, entity))
+        if cached is not None:
+            return cached
+
+        entities = self.controller.Tables[database][entity]
+        (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+        entity_doc = self.controller.Tables[database][link_name]
+        column = getattr(entity_doc, link_column)
+
+        # Topics are listed by title
+        name = entities.title if 'title' in entities.__table__.columns else entities.name
+
+        rows = session.query(entities.id, name, func.count()).join(entity_doc, entities.id == column)\
+                      .group_by(column).all()
+        rows.sort(key=lambda row: row[0])
+
+        cached = ([row[0] for row in rows], [tuple(row) for row in rows])
+        self.listings.set((database, entity), cached)
+        return cached
+
+
+    def reload(self, database=None):
+        """
+        This function drops the dictionaries and listings of a database, or
+        of all databases, so that they are reloaded on their next use.
+        """
+        if database is None:
+            self.dictionaries.clear()
+            self.listings.clear()
+            return
+
+        for entity in self.controller.entity_names:
+            self.dictionaries.pop((database, entity))
+            self.listings.pop((database, entity))
+
+
+    def __version(self, session, entities):
+        return tuple(session.query(func.count(entities.id), func.max(entities.id)).one())
@@ -0,0 +1,218 @@
+import time
+import heapq
+import threading
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from sqlalchemy import func
+
+from api.cache import Cache
+from api.planner import Planner
+from api.viewcache import table_versions
+
+
+class Rollup(object):
+    """
+    This class answers the overview queries (the entities mentioned by the
+    most documents of a collection between two dates) from per-entity,
+    per-month document counts kept in memory.
+
+    The counts of an entity are stored as its months and the cumulative
+    count up to each month, so the count of any range of whole months is
+    the difference of two cumulative counts. The days of the window that do
+    not cover a whole month are counted with SQL on the date index of the
+    entity_doc table.
+
+    The number of rollups held is bounded, the least recently used ones
+    being dropped first. Every rollup carries the version of its entity_doc
+    table (see ResponseCache), checked at most once every check_interval
+    seconds, and is rebuilt when the table has changed. A rollup is built by
+    one request at a time, the others waiting for it.
+    """
+
+    def __init__(self, controller, maxsize, check_interval):
+        self.controller = controller
+        self.check_interval = check_interval
+        self.rollups = Cache(maxsize)
+        self.locks = {}
+        self.lock = threading.Lock()
+
+
+    def top(self, session, database, entity, start_date, end_date, limit, geo_ids=None):
+        """
+        This function returns the entities mentioned by the most documents
+        between two dates.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  database: string
+        @param database: The name of the database.
+        @type  entity: string
+        @param entity: The name of the entity table (ex. persons).
+        @type  start_date: string
+        @param start_date: The first date of the window (YYYY-MM-DD), or None.
+        @type  end_date: string
+        @param end_date: The last date of the window (YYYY-MM-DD), or None.
+        @type  limit: number
+        @param limit: The number of entities returned.
+        @type  geo_ids: list
+        @param geo_ids: Country ids (optional). Only the documents mentioning
+            one of the countries are counted.
+
+        @rtype:   list
+        @return:  The (id, name, count) tuples of the top entities.
+        """
+        start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+        end = datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+
+        if geo_ids:
+            counts = self.__count(session, database, entity, start, end, geo_ids)
+        else:
+            counts = self.__window_counts(session, database, entity, start, end)
+
+        names = self.controller.registry.names(session, database, entity)
+        ranked = ((entity_id, names.get(entity_id), count) for (entity_id, count) in counts.items()
+                  if count and self.__valid_name(names.get(entity_id)))
+        return heapq.nlargest(limit, ranked, key=lambda item: item[2])
+
+
+    def reload(self, database=None):
+        """
+        This function drops the rollups of a database, or of all databases,
+        so that they are rebuilt on their next use.
+        """
+        if database is None:
+            self.rollups.clear()
+            return
+
+        for entity in Planner.ENTITY_LINKS:
+            self.rollups.pop((database, entity))
+
+
+    def __window_counts(self, session, database, entity, start, end):
+        """
+        This function counts the documents of every entity in the window,
+        summing the whole months from the rollup and counting the remaining
+        days with SQL.
+        """
+        # The whole months of the window: the first one starts on or after
+        # start, the month after the last one starts on or before end.
+        first_month = None if start is None else self.__month(start) + (0 if start.day == 1 and start.time() == datetime.min.time() else 1)
+        last_month = None if end is None else self.__month(end) - 1
+
+        if first_month is not None and last_month is not None and first_month > last_month:
+            return self.__count(session, database, entity, start, end)
+
+        rollup = self.__rollup(session, database, entity)
+        counts = {}
+        for entity_id, (months, cumulative) in rollup.items():
+            low = 0 if first_month is None else bisect_left(months, first_month)
+            high = len(months) if last_month is None else bisect_right(months, last_month)
+            if high > low:
+                counts[entity_id] = cumulative[high - 1] - (cumulative[low - 1] if low else 0)
+
+        if first_month is not None and start < self.__month_start(first_month):
+            self.__add(counts, self.__count(session, database, entity, start, self.__month_start(first_month), inclusive=False))
+        if last_month is not None:
+            self.__add(counts, self.__count(session, database, entity, self.__month_start(last_month + 1), end))
+
+        return counts
+
+
+    def __count(self, session, database, entity, start, end, geo_ids=None, inclusive=True):
+        """
+        This function counts the documents of every entity between two dates
+        with SQL, optionally only the documents mentioning one of geo_ids.
+        """
+        tables = self.controller.Tables[database]
+        (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+        entity_doc = tables[link_name]
+        column = getattr(entity_doc, link_column)
+
+        # Documents without a date are in no window, as in the rollups
+        q = session.query(column, func.count('*')).filter(entity_doc.date.isnot(None)).group_by(column)
+        if start is not None:
+            q = q.filter(entity_doc.date >= start)
+        if end is not None:
+            q = q.filter(entity_doc.date <= end if inclusive else entity_doc.date < end)
+
+        if geo_ids:
+            # The documents of the country posting lists, instead of a join
+            # of the whole entity_doc and country_doc tables
+            country_doc = tables['country_doc']
+            q = q.filter(entity_doc.doc_id.in_(session.query(country_doc.doc_id)
+                                                      .filter(country_doc.country_id.in_(geo_ids))))
+
+        return dict(q)
+
+
+    def __rollup(self, session, database, entity):
+        """
+        This function returns the months and cumulative document counts of
+        every entity, building them with a single scan of the entity_doc
+        table on first use and whenever the table has changed.
+        """
+        key = (database, entity)
+        cached = self.rollups.get(key)
+        if cached is not None and time.time() - cached[1] < self.check_interval:
+            return cached[2]
+
+        (link_name, link_column) = Planner.ENTITY_LINKS[entity]
+        entity_doc = self.controller.Tables[database][link_name]
+
+        with self.__lock(key):
+            # Another request may have checked or built the rollup meanwhile
+            cached = self.rollups.get(key)
+            if cached is not None and time.time() - cached[1] < self.check_interval:
+                return cached[2]
+
+            version = table_versions(session, [(database, link_name)], entity_doc)
+            if cached is not None and cached[0] == version:
+                self.rollups.set(key, (version, time.time(), cached[2]))
+                return cached[2]
+
+            column = getattr(entity_doc, link_column)
+            year = func.year(entity_doc.date)
+            month = func.month(entity_doc.date)
+
+            q = session.query(column, year, month, func.count('*'))\
+                       .filter(entity_doc.date.isnot(None))\
+                       .group_by(column, year, month)\
+                       .order_by(column, year, month)
+
+            rollup = {}
+            for (entity_id, doc_year, doc_month, count) in q.yield_per(10000):
+                if entity_id not in rollup:
+                    rollup[entity_id] = (array('i'), array('q'))
+                (months, cumulative) = rollup[entity_id]
+                months.append(doc_year * 12 + doc_month - 1)
+                cumulative.append((cumulative[-1] if cumulative else 0) + count)
+
+            self.rollups.set(key, (version, time.time(), rollup))
+        return rollup
+
+
+    def __lock(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+
+    def __add(self, counts, more_counts):
+        for entity_id, count in more_counts.items():
+            counts[entity_id] = counts.get(entity_id, 0) + count
+
+
+    def __valid_name(self, name):
+        return name is not None and name.lower() != 'null'
+
+
+    def __month(self, date):
+        return date.year * 12 + date.month - 1
+
+
+    def __month_start(self, month):
+        return datetime(month // 12, month % 12 + 1, 1)
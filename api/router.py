@@ -0,0 +1,112 @@
+import os
+import re
+import json
+
+from collections import defaultdict
+
+
+class Router(object):
+    """
+    This class finds the database holding a document from the document id
+    alone, without querying the declassification_api.docdb table.
+
+    Document ids of a collection share a recognizable prefix (ex. frus in
+    frus1945-50Inteld105, or STATE after the year in 1974STATE085546). The
+    routing map keeps, for every prefix found in docdb, the database holding
+    its documents. Prefixes shared by several databases, and prefixes
+    unknown to the map, fall back to a docdb lookup.
+
+    The routing map is built from docdb by the build script (build.py
+    routing) and saved to a snapshot file, read at startup. Without the
+    snapshot every document id falls back to a docdb lookup.
+    """
+    ID_PREFIX = re.compile(r'(\d*)([A-Za-z]*)')
+
+    def __init__(self, controller, snapshot_path):
+        self.controller = controller
+        self.snapshot_path = snapshot_path
+        self.rules = self.__read()
+
+
+    def prefix(self, doc_id):
+        """
+        This function returns the routing prefix of a document id: its
+        leading letters, marked with a # when they follow leading digits.
+        """
+        (digits, letters) = Router.ID_PREFIX.match(doc_id).groups()
+        return ('#' if digits else '') + letters.lower()
+
+
+    def locate(self, session, doc_ids):
+        """
+        This function groups document ids by the database holding them.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  doc_ids: list
+        @param doc_ids: A list of document ids.
+
+        @rtype:   dictionary
+        @return:  The list of document ids of every database.
+        """
+        rules = self.rules
+        locations = defaultdict(list)
+        unresolved = []
+        for doc_id in doc_ids:
+            database = rules.get(self.prefix(doc_id))
+            if database:
+                locations[database].append(doc_id)
+            else:
+                unresolved.append(doc_id)
+
+        if unresolved:
+            docdb = self.controller.Tables['declassification_api']['docdb']
+            for (doc_id, database) in session.query(docdb.doc_id, docdb.db_name)\
+                                             .filter(docdb.doc_id.in_(unresolved)):
+                locations[database].append(doc_id)
+
+        return dict(locations)
+
+
+    def build(self, session):
+        """
+        This function builds the routing map from docdb, streaming its rows,
+        and saves it to the snapshot file.
+        """
+        docdb = self.controller.Tables['declassification_api']['docdb']
+        prefix_databases = defaultdict(set)
+        for (doc_id, database) in session.query(docdb.doc_id, docdb.db_name).yield_per(10000):
+            prefix_databases[self.prefix(doc_id)].add(database)
+
+        rules = {}
+        ambiguous = []
+        for prefix, databases in prefix_databases.items():
+            if len(databases) == 1:
+                rules[prefix] = databases.pop()
+            else:
+                ambiguous.append(prefix)
+
+        snapshot_dir = os.path.dirname(self.snapshot_path)
+        if snapshot_dir and not os.path.exists(snapshot_dir):
+            os.makedirs(snapshot_dir)
+        temp_path = '{}.tmp'.format(self.snapshot_path)
+        with open(temp_path, 'w') as outfile:
+            json.dump({'rules': rules, 'ambiguous': sorted(ambiguous)}, outfile, indent=4, sort_keys=True)
+        os.replace(temp_path, self.snapshot_path)
+
+        self.rules = rules
+
+
+    def reload(self):
+        """
+        This function reads the snapshot file again, once the build script
+        has rewritten it.
+        """
+        self.rules = self.__read()
+
+
+    def __read(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with open(self.snapshot_path) as infile:
+            return json.load(infile)['rules']
@@ -0,0 +1,117 @@
+import os
+import random
+import threading
+
+from bisect import bisect_right
+
+from api.errors import MissingDataError
+from api.packed import PackedIdSet
+
+
+class Sampler(object):
+    """
+    This class draws uniform random samples of document ids without
+    sorting the docdb table.
+
+    The document ids of every database are kept in a packed, memory-mapped
+    set (see PackedIdSet), so every document has a dense position. A sample
+    is a set of random positions over the databases requested, each mapped
+    to its database and document id.
+
+    The sets are built from docdb by the build script (build.py doc_ids),
+    never while answering a request, and saved to one file per database,
+    next to a marker file written once all the sets are saved.
+    """
+    COMPLETE = 'complete'
+
+    def __init__(self, controller, path):
+        self.controller = controller
+        self.path = path
+        self.doc_ids = None
+        self.lock = threading.Lock()
+
+
+    def sample(self, limit, databases=None, seed=None):
+        """
+        This function returns random document ids.
+
+        @type  limit: number
+        @param limit: The number of document ids returned.
+        @type  databases: list
+        @param databases: The databases to sample from (optional, all
+            databases by default).
+        @type  seed: number
+        @param seed: The seed of the random generator (optional), for
+            reproducible samples.
+
+        @rtype:   list
+        @return:  Distinct document ids, in random order.
+
+        @raise MissingDataError: If the sets have not been built.
+        """
+        doc_ids = self.__load()
+        if databases is None:
+            databases = sorted(doc_ids.keys())
+
+        sets = [doc_ids[database] for database in databases if database in doc_ids]
+        ends = []
+        total = 0
+        for id_set in sets:
+            total += len(id_set)
+            ends.append(total)
+
+        generator = random.Random(seed)
+        positions = generator.sample(range(total), min(max(limit, 0), total))
+
+        sample = []
+        for position in positions:
+            index = bisect_right(ends, position)
+            start = ends[index - 1] if index else 0
+            sample.append(sets[index][position - start])
+        return sample
+
+
+    def build(self, session):
+        """
+        This function writes the packed document id set of every database
+        listed in docdb.
+        """
+        docdb = self.controller.Tables['declassification_api']['docdb']
+        databases = [database for (database,) in session.query(docdb.db_name).distinct()]
+
+        for database in databases:
+            result = session.query(docdb.doc_id).filter(docdb.db_name == database).yield_per(10000)
+            PackedIdSet.write(os.path.join(self.path, '{}.ids'.format(database)),
+                              (doc_id for (doc_id,) in result))
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, Sampler.COMPLETE), 'w') as outfile:
+            outfile.write('\n'.join(databases))
+
+
+    def reload(self):
+        """
+        This function drops the document id sets, so that the files
+        rewritten by the build script are mapped on their next use.
+        """
+        with self.lock:
+            self.doc_ids = None
+
+
+    def __load(self):
+        if self.doc_ids is not None:
+            return self.doc_ids
+
+        with self.lock:
+            if self.doc_ids is None:
+                complete = os.path.join(self.path, Sampler.COMPLETE)
+                if not os.path.exists(complete):
+                    raise MissingDataError('the document id sets', 'doc_ids')
+
+                doc_ids = {}
+                with open(complete) as infile:
+                    for database in infile.read().split():
+                        doc_ids[database] = PackedIdSet(os.path.join(self.path, '{}.ids'.format(database)))
+                self.doc_ids = doc_ids
+        return self.doc_ids
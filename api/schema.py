@@ -0,0 +1,166 @@
+import os
+import pickle
+import threading
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.ext.automap import automap_base
+
+
+class Schema(dict):
+    """
+    This class maps every database name to its tables, i.e. a dictionary of
+    the SQLAlchemy-ORM classes automatically mapped from the database, keyed
+    by table name.
+
+    A database is mapped on its first use rather than when the Controller
+    is built. Its reflected metadata is saved to a snapshot file together
+    with a fingerprint of its columns, and later mappings load the snapshot
+    without querying the database. The fingerprint is only compared with the
+    database on reload, which maps the database again if it has changed.
+
+    The classes of every database derive from a class of their own, bound
+    to the engine of the database in the binds of the sessions.
+    """
+    # Fingerprint of the tables and columns of a database
+    FINGERPRINT = text("SELECT COUNT(*), "
+                       "SUM(CRC32(CONCAT_WS(':', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, COLUMN_KEY))) "
+                       "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = :database")
+
+    def __init__(self, engines, snapshot_path):
+        super(Schema, self).__init__()
+        self.engines = engines
+        self.snapshot_path = snapshot_path
+        self.bases = dict((database, type(str(database), (object,), {})) for database in engines)
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+
+
+    def binds(self):
+        """
+        This function returns the engine of the classes of every database,
+        as the binds of a sessionmaker.
+        """
+        return dict((self.bases[database], engine) for database, engine in self.engines.items())
+
+
+    def reload(self, database=None):
+        """
+        This function compares the fingerprint of a database, or of every
+        database, with the one of its snapshot, and reflects and maps the
+        database again when its columns have changed.
+
+        @rtype:   list
+        @return:  The databases mapped again.
+        """
+        changed = []
+        for name in sorted(self.engines):
+            if database is not None and name != database:
+                continue
+            with self.lock:
+                mapped = dict.__contains__(self, name)
+                if not mapped and not os.path.exists(self.__path(name)):
+                    continue
+
+                fingerprint = self.__fingerprint(name)
+                if name not in self.fingerprints:
+                    self.__read(name)
+                if self.fingerprints.get(name) == fingerprint:
+                    continue
+
+                metadata = self.__reflect(name, fingerprint)
+                if mapped:
+                    dict.__setitem__(self, name, self.__map(name, metadata))
+                changed.append(name)
+        return changed
+
+
+    def __missing__(self, database):
+        if database not in self.engines:
+            return {}
+
+        with self.lock:
+            if dict.__contains__(self, database):
+                return dict.__getitem__(self, database)
+
+            metadata = self.__read(database)
+            if metadata is None:
+                metadata = self.__reflect(database, self.__fingerprint(database))
+
+            tables = self.__map(database, metadata)
+            dict.__setitem__(self, database, tables)
+            return tables
+
+
+    def __map(self, database, metadata):
+        base = automap_base(metadata=metadata, cls=self.bases[database])
+        base.prepare()
+
+        tables = {}
+        for table in base.classes:
+            tables[table.__name__] = table
+        return tables
+
+
+    def __read(self, database):
+        """
+        This function returns the metadata of a database saved in its
+        snapshot file, or None if there is no snapshot.
+        """
+        path = self.__path(database)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as infile:
+            (fingerprint, metadata) = pickle.load(infile)
+        self.fingerprints[database] = fingerprint
+        return metadata
+
+
+    def __reflect(self, database, fingerprint):
+        """
+        This function reflects the metadata of a database and saves it to
+        its snapshot file.
+        """
+        metadata = MetaData()
+        metadata.reflect(self.engines[database])
+
+        if not os.path.exists(self.snapshot_path):
+            os.makedirs(self.snapshot_path)
+        path = self.__path(database)
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as outfile:
+            pickle.dump((fingerprint, metadata), outfile)
+        os.replace(temp_path, path)
+
+        self.fingerprints[database] = fingerprint
+        return metadata
+
+
+    def __fingerprint(self, database):
+        return tuple(str(value) for value in
+                     self.engines[database].execute(Schema.FINGERPRINT, database=database).first())
+
+
+    def __path(self, database):
+        return os.path.join(self.snapshot_path, '{}.pickle'.format(database))
+
+
+class EntityIndex(dict):
+    """
+    This class maps every database name to the list of entities (persons,
+    countries, topics, classifications) it holds. The list is built from
+    the tables of the database on its first use.
+    """
+
+    def __init__(self, tables, entity_names):
+        super(EntityIndex, self).__init__()
+        self.tables = tables
+        self.entity_names = entity_names
+
+
+    def __missing__(self, database):
+        table_names = self.tables[database].keys()
+        entities = [entity for entity in self.entity_names if entity in table_names]
+        if table_names:
+            self[database] = entities
+        return entities
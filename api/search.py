@@ -0,0 +1,481 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    import elasticsearch
+except ImportError:
+    elasticsearch = None
+
+
+class SearchError(Exception):
+    """
+    Raised when a full text search cannot be answered.
+    """
+    pass
+
+
+class ElasticsearchBackend(object):
+    """
+    This class runs the full text searches on the Elasticsearch cluster.
+
+    A search is paged over a point in time, so that its pages are consistent
+    with each other. The first page opens the point in time, and the next
+    ones resume after the sort values of the last hit of the previous page
+    (search_after), so that deep pages are as fast as the first.
+
+    Facets are computed by aggregations of the same search.
+
+    A point in time is closed as soon as its search has no next page. The
+    ones still open, for the searches whose last page was never requested,
+    expire after keep_alive or are closed on reload.
+    """
+    FIELDS = ['subject', 'title', 'id', 'collection', 'date']
+    TIME_UNITS = {'d': 86400, 'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+    def __init__(self, config, facet_sizes):
+        if elasticsearch is None:
+            raise SearchError('the elasticsearch package is required by the elasticsearch search backend')
+        self.index = config['index']
+        self.keep_alive = config['pit_keep_alive']
+        self.facet_fields = config['facet_fields']
+        self.facet_sizes = facet_sizes
+        # Expiry times of the points in time opened by this process
+        self.open_pits = {}
+        self.lock = threading.Lock()
+        self.es = elasticsearch.Elasticsearch(config['hosts'],
+                                              maxsize=int(config['maxsize']),
+                                              timeout=float(config['timeout']),
+                                              max_retries=int(config['max_retries']),
+                                              retry_on_timeout=bool(config['retry_on_timeout']))
+
+
+    def search(self, session, search_text, start_date, end_date, collections, page, page_size, cursor=None,
+               facets=None):
+        """
+        This function returns a page of the documents matching search_text.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  search_text: string
+        @param search_text: A query string.
+        @type  start_date: string
+        @param start_date: The earliest date of the documents (optional).
+        @type  end_date: string
+        @param end_date: The latest date of the documents (optional).
+        @type  collections: list
+        @param collections: The collections searched.
+        @type  page: number
+        @param page: The number of the page, used when there is no cursor.
+        @type  page_size: number
+        @param page_size: The number of documents of a page.
+        @type  cursor: tuple
+        @param cursor: The (point in time id, sort values) pair returned
+            with the previous page (optional).
+        @type  facets: list
+        @param facets: The facets to compute over all the matching documents
+            (optional): collection, year, classification, persons.
+
+        @rtype:   tuple
+        @return:  The documents of the page, the total count of the search
+            (None when resuming from a cursor), the cursor of the next page
+            (None on the last page) and the (key, count) values of every
+            facet requested (None when no facet is requested).
+        """
+        body = {
+            'query': self.__query(search_text, start_date, end_date, collections),
+            '_source': ElasticsearchBackend.FIELDS,
+            'size': page_size + 1,
+            # Hits of equal score are ordered by the implicit _shard_doc tiebreaker
+            'sort': [{'_score': 'desc'}]
+        }
+        if facets:
+            body['aggs'] = dict((facet, self.__aggregation(facet)) for facet in facets)
+
+        pit_id = None
+        try:
+            if cursor:
+                (pit_id, body['search_after']) = cursor
+                body['track_total_hits'] = False
+            else:
+                pit_id = self.__open_point_in_time()
+                body['from'] = (page - 1) * page_size
+                body['track_total_hits'] = True
+            body['pit'] = {'id': pit_id, 'keep_alive': self.keep_alive}
+
+            matches = self.es.search(body=body)
+        except elasticsearch.NotFoundError:
+            self.__close_point_in_time(pit_id)
+            raise SearchError('page has expired, please restart the search')
+        except elasticsearch.TransportError as error:
+            self.__close_point_in_time(pit_id)
+            raise SearchError(str(error))
+
+        hits = matches['hits']['hits']
+        total_count = None
+        if not cursor:
+            total = matches['hits']['total']
+            total_count = total['value'] if isinstance(total, dict) else total
+
+        results = []
+        for hit in hits[:page_size]:
+            source = hit['_source']
+            results.append({'id': hit['_id'], 'title': source.get('title'), 'subject': source.get('subject'),
+                            'collection': source.get('collection'), 'date': source.get('date')})
+
+        next_cursor = None
+        if len(hits) > page_size:
+            next_pit_id = matches.get('pit_id', pit_id)
+            next_cursor = (next_pit_id, hits[page_size - 1]['sort'])
+            self.__track_point_in_time(pit_id, next_pit_id)
+        else:
+            self.__close_point_in_time(pit_id)
+
+        facet_values = None
+        if facets:
+            facet_values = {}
+            for facet in facets:
+                buckets = matches.get('aggregations', {}).get(facet, {}).get('buckets', [])
+                facet_values[facet] = [{'key': bucket.get('key_as_string', bucket['key']),
+                                        'count': bucket['doc_count']} for bucket in buckets]
+        return (results, total_count, next_cursor, facet_values)
+
+
+    def reload(self):
+        """
+        This function closes the points in time still open. The index is
+        maintained outside of the API, so there is nothing else to drop.
+        """
+        with self.lock:
+            pit_ids = list(self.open_pits)
+        for pit_id in pit_ids:
+            self.__close_point_in_time(pit_id)
+
+
+    def __query(self, search_text, start_date, end_date, collections):
+        """
+        This function builds the query of a search. The dates and
+        collections only filter the hits, so they do not weigh on the scores.
+        """
+        query_filter = [{'query_string': {'query': 'collection:(' + ' OR '.join(collections) + ')'}}]
+
+        dates = {}
+        if start_date:
+            dates['gte'] = start_date
+        if end_date:
+            dates['lte'] = end_date
+        if dates:
+            query_filter.append({'range': {'date': dates}})
+
+        return {'bool': {'must': {'query_string': {'query': search_text}},
+                         'filter': query_filter}}
+
+
+    def __aggregation(self, facet):
+        """
+        This function builds the aggregation of a facet: a yearly histogram
+        of the dates, or the most frequent terms of a field.
+        """
+        field = self.facet_fields[facet]
+        if facet == 'year':
+            return {'date_histogram': {'field': field, 'calendar_interval': 'year',
+                                       'format': 'yyyy', 'min_doc_count': 1}}
+        return {'terms': {'field': field, 'size': int(self.facet_sizes[facet])}}
+
+
+    def __open_point_in_time(self):
+        """
+        This function opens a point in time on the index. The client in use
+        predates the point in time API, so the request is sent through its
+        transport.
+        """
+        result = self.es.transport.perform_request('POST', '/{}/_pit'.format(self.index),
+                                                   params={'keep_alive': self.keep_alive})
+        self.__track_point_in_time(None, result['id'])
+        return result['id']
+
+
+    def __close_point_in_time(self, pit_id):
+        """
+        This function closes a point in time. A point in time that has
+        already expired is ignored.
+        """
+        if pit_id is None:
+            return
+        with self.lock:
+            self.open_pits.pop(pit_id, None)
+        try:
+            self.es.transport.perform_request('DELETE', '/_pit', body={'id': pit_id})
+        except elasticsearch.TransportError:
+            # Expired, or closed by another worker; it is released either way
+            pass
+
+
+    def __track_point_in_time(self, pit_id, next_pit_id):
+        """
+        This function records the expiry of a point in time that a search
+        keeps open, and forgets the ones that have expired since.
+        """
+        now = time.time()
+        with self.lock:
+            self.open_pits.pop(pit_id, None)
+            self.open_pits[next_pit_id] = now + self.__seconds(self.keep_alive)
+            for (open_pit_id, expiry) in list(self.open_pits.items()):
+                if expiry < now:
+                    del self.open_pits[open_pit_id]
+
+
+    @staticmethod
+    def __seconds(duration):
+        """
+        This function converts an Elasticsearch duration (ex. 5m) to seconds.
+        """
+        (value, unit) = re.match(r'(\d+)([a-z]*)', duration).groups()
+        return int(value) * ElasticsearchBackend.TIME_UNITS.get(unit or 's', 1)
+
+
+class LocalSearchBackend(object):
+    """
+    This class runs the full text searches on an SQLite FTS5 index of the
+    docs tables of every collection, for deployments without Elasticsearch.
+
+    Documents are ranked by BM25 over their title, subject and body. Pages
+    after the first resume after the (rank, rowid) pair of the last document
+    of the previous page, so that deep pages are as fast as the first.
+
+    Search texts use the Elasticsearch query string syntax of the /text/
+    route, of which words, quoted phrases, field prefixes (title:, subject:,
+    body:), AND, OR, NOT and the - and + prefixes are kept.
+
+    Facets are grouped counts of the matching documents. The index does not
+    hold the persons of the documents, so it has no persons facet.
+
+    The index is only written by the build script (build.py fulltext),
+    never while answering a request.
+    """
+    COLUMNS = ['title', 'subject', 'body']
+    OPERATORS = ('AND', 'OR', 'NOT')
+    TERM = re.compile(r'([-+]?)(?:(\w+):)?("[^"]*"|\S+)')
+
+    # Expressions grouped by the facets, and the order of their values
+    FACETS = {
+        'collection': ('collection', 'count(*) DESC'),
+        'year': ('substr(date, 1, 4)', '1'),
+        'classification': ('classification', 'count(*) DESC')
+    }
+
+    def __init__(self, controller, path, facet_sizes):
+        self.controller = controller
+        self.path = path
+        self.facet_sizes = facet_sizes
+
+
+    def search(self, session, search_text, start_date, end_date, collections, page, page_size, cursor=None,
+               facets=None):
+        """
+        This function returns a page of the documents matching search_text.
+        It takes the parameters and returns the values of
+        ElasticsearchBackend.search, its cursor being a (None, [rank, rowid])
+        pair.
+        """
+        self.__ensure()
+
+        match = LocalSearchBackend.to_match(search_text)
+        facet_values = dict((facet, []) for facet in facets) if facets else None
+        if not match or not collections:
+            return ([], 0 if not cursor else None, None, facet_values)
+
+        conditions = ['fulltext MATCH ?', 'collection IN ({})'.format(','.join('?' * len(collections)))]
+        params = [match] + list(collections)
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
+        where = ' AND '.join(conditions)
+        where_params = list(params)
+
+        connection = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True)
+        try:
+            total_count = None
+            if not cursor:
+                (total_count,) = connection.execute('SELECT count(*) FROM fulltext WHERE ' + where,
+                                                    params).fetchone()
+
+            query = 'SELECT rowid, rank, doc_id, title, subject, collection, date FROM fulltext WHERE ' + where
+            if cursor:
+                (rank, rowid) = LocalSearchBackend.__cursor_values(cursor)
+                query += ' AND (rank > ? OR (rank = ? AND rowid > ?))'
+                params += [rank, rank, rowid]
+            query += ' ORDER BY rank, rowid LIMIT ? OFFSET ?'
+            params += [page_size + 1, 0 if cursor else (page - 1) * page_size]
+
+            rows = connection.execute(query, params).fetchall()
+
+            for facet in (facets or []):
+                if facet in LocalSearchBackend.FACETS:
+                    facet_values[facet] = self.__facet(connection, facet, where, where_params)
+        except sqlite3.OperationalError as error:
+            raise SearchError(str(error))
+        finally:
+            connection.close()
+
+        results = []
+        for (rowid, rank, doc_id, title, subject, collection, date) in rows[:page_size]:
+            results.append({'id': doc_id, 'title': title, 'subject': subject,
+                            'collection': collection, 'date': date})
+
+        next_cursor = None
+        if len(rows) > page_size:
+            (rowid, rank) = rows[page_size - 1][:2]
+            next_cursor = (None, [rank, rowid])
+        return (results, total_count, next_cursor, facet_values)
+
+
+    def build(self, session):
+        """
+        This function writes the index from the docs table of every
+        collection.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        temp_path = '{}.tmp'.format(self.path)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        connection = sqlite3.connect(temp_path)
+        try:
+            connection.execute('CREATE VIRTUAL TABLE fulltext USING fts5(title, subject, body, '
+                               'doc_id UNINDEXED, collection UNINDEXED, date UNINDEXED, '
+                               "classification UNINDEXED, tokenize='porter unicode61')")
+
+            for collection, database in sorted(self.controller.collection_names.items()):
+                if 'docs' not in self.controller.Tables[database]:
+                    continue
+                docs = self.controller.Tables[database]['docs']
+                available = docs.__table__.columns.keys()
+                columns = [getattr(docs, column) for column in ['id', 'date'] + LocalSearchBackend.COLUMNS
+                           if column in available]
+                names = [column.key for column in columns]
+                # The classification column of the cables database is named class
+                for name in ('classification', 'class'):
+                    if name in available:
+                        columns.append(getattr(docs, name))
+                        names.append('classification')
+                        break
+
+                rows = []
+                for row in session.query(*columns).yield_per(10000):
+                    values = dict(zip(names, row))
+                    date = values.get('date')
+                    rows.append((values.get('title'), values.get('subject'), values.get('body'),
+                                 values['id'], collection, str(date)[:10] if date else None,
+                                 values.get('classification')))
+                    if len(rows) == 10000:
+                        connection.executemany('INSERT INTO fulltext VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                        rows = []
+                connection.executemany('INSERT INTO fulltext VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+                connection.commit()
+
+            connection.execute("INSERT INTO fulltext(fulltext) VALUES ('optimize')")
+            connection.commit()
+        finally:
+            connection.close()
+
+        # Workers opening the index never see a partially written file
+        os.replace(temp_path, self.path)
+
+
+    def reload(self):
+        """
+        Every search opens the index file, so a rebuilt index is searched as
+        soon as it is written, and there is nothing to drop.
+        """
+        pass
+
+
+    @staticmethod
+    def to_match(search_text):
+        """
+        This function translates a query string to an FTS5 match expression.
+        Every word and phrase is quoted, so that punctuation cannot break the
+        expression.
+
+        FTS5 only has a binary NOT, so AND NOT, NOT and the - prefix become
+        NOT between two terms, and the negations it cannot express (a
+        leading NOT, OR NOT) raise a SearchError, as do operators following
+        each other. Operators at either end of the text are dropped.
+        """
+        tokens = []
+        for (prefix, field, term) in LocalSearchBackend.TERM.findall(search_text or ''):
+            if not prefix and not field and term in LocalSearchBackend.OPERATORS:
+                tokens.append(term)
+                continue
+
+            words = re.findall(r'\w+', term)
+            if not words:
+                continue
+            quoted = '"{}"'.format(' '.join(words))
+            if field in LocalSearchBackend.COLUMNS:
+                quoted = '{} : {}'.format(field, quoted)
+            if prefix == '-':
+                tokens.append('NOT')
+            tokens.append(quoted)
+
+        terms = []
+        operator = None
+        for token in tokens:
+            if token not in LocalSearchBackend.OPERATORS:
+                if operator:
+                    terms.append(operator)
+                terms.append(token)
+                operator = None
+            elif token == 'NOT' and not terms:
+                raise SearchError('NOT needs a term before it, ex. cuba NOT soviet')
+            elif token == 'NOT' and operator in (None, 'AND'):
+                operator = 'NOT'
+            elif operator:
+                raise SearchError('{} cannot follow {}'.format(token, operator))
+            elif terms:
+                operator = token
+        return ' '.join(terms)
+
+
+    @staticmethod
+    def __cursor_values(cursor):
+        """
+        This function returns the (rank, rowid) pair of a cursor decoded from
+        a continuation token, rejecting the ones that were not returned by
+        search.
+        """
+        values = cursor[1]
+        if not isinstance(values, list) or len(values) != 2:
+            raise SearchError('invalid page token, please restart the search')
+        (rank, rowid) = values
+        if isinstance(rank, bool) or not isinstance(rank, (int, float)) \
+                or isinstance(rowid, bool) or not isinstance(rowid, int):
+            raise SearchError('invalid page token, please restart the search')
+        return (rank, rowid)
+
+
+    def __facet(self, connection, facet, where, params):
+        """
+        This function counts the matching documents of every value of a
+        facet.
+        """
+        (expression, order) = LocalSearchBackend.FACETS[facet]
+        query = 'SELECT {0}, count(*) FROM fulltext WHERE {1} AND {0} IS NOT NULL GROUP BY 1 ORDER BY {2}'.format(
+            expression, where, order)
+        if facet != 'year':
+            query += ' LIMIT {}'.format(int(self.facet_sizes[facet]))
+        return [{'key': key, 'count': count} for (key, count) in connection.execute(query, params)]
+
+
+    def __ensure(self):
+        if not os.path.exists(self.path):
+            raise SearchError('the full text index has not been built, run: python build.py fulltext')
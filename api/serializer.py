@@ -0,0 +1,69 @@
+import json
+
+from datetime import date
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class Serializer(object):
+    """
+    This class encodes the API responses to JSON bytes with the fastest
+    encoder installed: orjson, then ujson, then the json module.
+
+    All encoders produce the same values: dates and datetimes as ISO 8601
+    strings, decimals as strings (as Flask encoded them) and other iterables
+    as lists. Rows whose dates are already strings (see Clerk.format_dates)
+    never fall back to Python code while being encoded.
+    """
+    ENCODERS = ['orjson', 'ujson', 'json']
+
+    def __init__(self, name=None):
+        available = [encoder for encoder in Serializer.ENCODERS if encoder == 'json' or globals()[encoder]]
+        if name is not None and name not in available:
+            raise ValueError('JSON encoder {} is not available'.format(name))
+        self.name = name or available[0]
+
+        if self.name == 'orjson':
+            self.encode = self.__encode_orjson
+        elif self.name == 'ujson':
+            self.encode = self.__encode_ujson
+        else:
+            self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=Serializer.default)
+            self.encode = self.__encode_json
+
+
+    @staticmethod
+    def default(obj):
+        """
+        This function converts the values the encoders do not support.
+        """
+        if isinstance(obj, date):
+            return obj.isoformat()
+        if isinstance(obj, Decimal):
+            return str(obj)
+        try:
+            iterable = iter(obj)
+        except TypeError:
+            raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+        return list(iterable)
+
+
+    def __encode_orjson(self, obj):
+        return orjson.dumps(obj, default=Serializer.default, option=orjson.OPT_NON_STR_KEYS)
+
+
+    def __encode_ujson(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False, default=Serializer.default).encode('utf-8')
+
+
+    def __encode_json(self, obj):
+        return self.encoder.encode(obj).encode('utf-8')
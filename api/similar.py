@@ -0,0 +1,208 @@
+import os
+import json
+import math
+import mmap
+import heapq
+import struct
+import threading
+
+from array import array
+
+from api.errors import MissingDataError
+from api.packed import PackedIdSet
+
+
+class SimilarityIndex(object):
+    """
+    This class finds the documents of a collection whose topic vectors (the
+    topic_score of every topic of a document in topic_doc) are the closest
+    to the vector of a given document, by cosine similarity.
+
+    Every database has two files: the sorted ids of its documents (see
+    PackedIdSet), whose positions number the documents, and the vectors:
+
+        magic | header length | header (JSON) | doc pointers | doc topics |
+        doc weights | topic pointers | topic docs | topic weights
+
+    The document vectors are L2-normalized and stored as sparse rows. The
+    inverted list of every topic holds its documents sorted by decreasing
+    weight. A search accumulates the scores of the max_postings heaviest
+    documents of each of the max_topics heaviest topics of the document, so
+    its cost does not depend on the size of the collection.
+
+    Both files are memory-mapped. They are only built from topic_doc by the
+    build script (build.py similar), never while answering a request.
+    """
+    MAGIC = b'DSIMIL01'
+
+    def __init__(self, controller, path, max_topics, max_postings):
+        self.controller = controller
+        self.path = path
+        self.max_topics = max_topics
+        self.max_postings = max_postings
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+
+    def similar(self, session, database, doc_id, limit):
+        """
+        This function returns the documents most similar to a document.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  database: string
+        @param database: The name of the database holding the document.
+        @type  doc_id: string
+        @param doc_id: The id of the document.
+        @type  limit: number
+        @param limit: The number of documents to return.
+
+        @rtype:   list
+        @return:  The (doc_id, score) pairs of the similar documents, the
+            most similar first, or None if the document has no topics.
+
+        @raise MissingDataError: If the index of the database has not been
+            built.
+        """
+        (doc_ids, vectors) = self.__load(database)
+        position = doc_ids.index(doc_id)
+        if position < 0:
+            return None
+
+        doc_pointers = vectors['doc_pointers']
+        start = doc_pointers[position]
+        end = doc_pointers[position + 1]
+        query = heapq.nlargest(self.max_topics, zip(vectors['doc_weights'][start:end],
+                                                     vectors['doc_topics'][start:end]))
+
+        topic_pointers = vectors['topic_pointers']
+        topic_docs = vectors['topic_docs']
+        topic_weights = vectors['topic_weights']
+        scores = {}
+        for (weight, topic) in query:
+            start = topic_pointers[topic]
+            end = min(topic_pointers[topic + 1], start + self.max_postings)
+            for (other, other_weight) in zip(topic_docs[start:end], topic_weights[start:end]):
+                scores[other] = scores.get(other, 0.0) + weight * other_weight
+
+        scores.pop(position, None)
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(doc_ids[other], round(score, 6)) for (other, score) in ranked]
+
+
+    def build(self, session, database):
+        """
+        This function writes the document ids and vectors files of a
+        database from its topic_doc table.
+        """
+        topic_doc = self.controller.Tables[database]['topic_doc']
+        vectors = {}
+        for (doc_id, topic_id, topic_score) in session.query(topic_doc.doc_id, topic_doc.topic_id,
+                                                             topic_doc.topic_score).yield_per(10000):
+            if topic_score:
+                vectors.setdefault(doc_id, {})[topic_id] = float(topic_score)
+
+        ids_path = os.path.join(self.path, '{}.ids'.format(database))
+        PackedIdSet.write(ids_path, vectors.keys())
+        doc_ids = PackedIdSet(ids_path)
+
+        topic_numbers = dict((topic_id, number) for number, topic_id in
+                             enumerate(sorted(set(topic_id for vector in vectors.values() for topic_id in vector))))
+
+        doc_pointers = array('I', [0])
+        doc_topics = array('I')
+        doc_weights = array('f')
+        postings = [[] for topic in topic_numbers]
+        for position in range(len(doc_ids)):
+            vector = vectors[doc_ids[position]]
+            norm = math.sqrt(sum(score * score for score in vector.values()))
+            for topic_id, score in sorted(vector.items()):
+                topic = topic_numbers[topic_id]
+                doc_topics.append(topic)
+                doc_weights.append(score / norm)
+                postings[topic].append((score / norm, position))
+            doc_pointers.append(len(doc_topics))
+
+        topic_pointers = array('I', [0])
+        topic_docs = array('I')
+        topic_weights = array('f')
+        for topic_postings in postings:
+            topic_postings.sort(reverse=True)
+            for (weight, position) in topic_postings:
+                topic_docs.append(position)
+                topic_weights.append(weight)
+            topic_pointers.append(len(topic_docs))
+
+        sections = [('doc_pointers', doc_pointers), ('doc_topics', doc_topics), ('doc_weights', doc_weights),
+                    ('topic_pointers', topic_pointers), ('topic_docs', topic_docs), ('topic_weights', topic_weights)]
+        self.__write(os.path.join(self.path, '{}.vec'.format(database)), sections)
+
+
+    def reload(self, database=None):
+        """
+        This function drops the index of a database, or of all databases,
+        so that the files rewritten by the build script are mapped on their
+        next use.
+        """
+        with self.lock:
+            for indexed in list(self.indexes.keys()):
+                if database is None or indexed == database:
+                    del self.indexes[indexed]
+
+
+    def __write(self, path, sections):
+        header = {}
+        position = 0
+        for (name, values) in sections:
+            header[name] = [values.typecode, position, position + len(values) * values.itemsize]
+            position += len(values) * values.itemsize
+        encoded_header = json.dumps(header).encode('utf-8')
+
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(SimilarityIndex.MAGIC)
+            outfile.write(struct.pack('<I', len(encoded_header)))
+            outfile.write(encoded_header)
+            # Sections start on an 8 bytes boundary
+            outfile.write(b'\0' * (-outfile.tell() % 8))
+            for (name, values) in sections:
+                outfile.write(values.tobytes())
+
+        # Workers opening the index never see a partially written file
+        os.replace(temp_path, path)
+
+
+    def __read(self, path):
+        with open(path, 'rb') as infile:
+            vector_map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if vector_map[:len(SimilarityIndex.MAGIC)] != SimilarityIndex.MAGIC:
+            raise ValueError('{} is not a similarity index'.format(path))
+
+        start = len(SimilarityIndex.MAGIC)
+        (header_length,) = struct.unpack_from('<I', vector_map, start)
+        start += 4
+        header = json.loads(vector_map[start:start + header_length].decode('utf-8'))
+        start += header_length
+        start += -start % 8
+
+        view = memoryview(vector_map)
+        vectors = {}
+        for name, (typecode, section_start, section_end) in header.items():
+            vectors[name] = view[start + section_start:start + section_end].cast(typecode)
+        return vectors
+
+
+    def __load(self, database):
+        index = self.indexes.get(database)
+        if index is not None:
+            return index
+
+        with self.lock:
+            if database not in self.indexes:
+                vectors_path = os.path.join(self.path, '{}.vec'.format(database))
+                if not os.path.exists(vectors_path):
+                    raise MissingDataError('the similarity index of {}'.format(database), 'similar')
+                doc_ids = PackedIdSet(os.path.join(self.path, '{}.ids'.format(database)))
+                self.indexes[database] = (doc_ids, self.__read(vectors_path))
+        return self.indexes[database]
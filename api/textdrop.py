@@ -0,0 +1,124 @@
+import json
+import time
+import hashlib
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from api.cache import Cache
+
+
+class TextDropError(Exception):
+    """
+    Raised when the TextDrop service cannot answer a search.
+    """
+    pass
+
+
+class TextDropClient(object):
+    """
+    This class sends the searches of the textdrop route to the Merriam
+    TextDrop service.
+
+    Requests share a keep-alive session with a bounded connection pool, and
+    are bounded by connect and read timeouts. Connection errors and gateway
+    errors are retried a few times.
+
+    After failure_threshold consecutive failed searches the circuit opens:
+    searches fail immediately for reset_timeout seconds, then a single
+    search is let through to probe the service.
+
+    Results are cached, keyed by a hash of the text and the limit.
+    """
+
+    def __init__(self, pool_size, connect_timeout, read_timeout, retries,
+                 failure_threshold, reset_timeout, cache_size, cache_ttl):
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+        self.results = Cache(cache_size, cache_ttl)
+
+        retry = Retry(total=retries, connect=retries, read=0, backoff_factor=0.2,
+                      status_forcelist=[502, 503, 504], allowed_methods=frozenset(['POST']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+
+    def search(self, url, text, limit):
+        """
+        This function returns the ids of the documents similar to text.
+
+        @type  url: string
+        @param url: The TextDrop service url.
+        @type  text: string
+        @param text: A piece of text to find similar documents for.
+        @type  limit: number
+        @param limit: The number of documents to return.
+
+        @rtype:   list
+        @return:  The ids of the similar documents.
+        """
+        key = hashlib.sha1('{}\0{}'.format(limit, text).encode('utf-8')).hexdigest()
+        doc_ids = self.results.get(key)
+        if doc_ids is not None:
+            return doc_ids
+
+        self.__allow()
+
+        params = {
+            'limit': limit,
+            'text': text
+        }
+        headers = {'content-type': 'application/json'}
+
+        try:
+            resp = self.session.post(url, data=json.dumps(params), headers=headers, timeout=self.timeout)
+            if resp.status_code != 200:
+                raise TextDropError('TextDrop answered with status {}'.format(resp.status_code))
+            data = resp.json()
+            doc_ids = [result['doc_id'] for result in data['results']]
+        except (requests.RequestException, ValueError, KeyError, TypeError, TextDropError) as error:
+            self.__failed()
+            if isinstance(error, TextDropError):
+                raise
+            raise TextDropError(str(error))
+
+        self.__succeeded()
+        self.results.set(key, doc_ids)
+        return doc_ids
+
+
+    def __allow(self):
+        """
+        This function fails fast while the circuit is open, and lets a
+        single probing search through once reset_timeout has passed.
+        """
+        with self.lock:
+            if self.opened is None:
+                return
+            if time.time() - self.opened < self.reset_timeout:
+                raise TextDropError('TextDrop is unavailable')
+            # Half open: keep failing fast until the probe completes
+            self.opened = time.time()
+
+
+    def __failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened = time.time()
+
+
+    def __succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
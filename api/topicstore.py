@@ -0,0 +1,178 @@
+import os
+import json
+import mmap
+import struct
+
+from array import array
+
+
+class TopicStore(object):
+    """
+    This class reads the topic token and topic doc data of the collections
+    from a single binary file, memory-mapped read-only so that all the
+    worker processes share its pages.
+
+    The file holds a string table and offset arrays:
+
+        magic | header length | header (JSON) | cells | string offsets | strings
+
+    Every row of a topic is a fixed number of cells (one per column of its
+    CSV file), and every cell is the index of a string in the string table,
+    or MISSING when the CSV row was shorter than its header. The header maps
+    every collection, kind ('tokens' or 'docs') and topic id to its columns,
+    its first cell and its number of rows. Rows are only decoded when they
+    are returned.
+    """
+    MAGIC = b'DTOPICS1'
+    MISSING = 0xFFFFFFFF
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:len(TopicStore.MAGIC)] != TopicStore.MAGIC:
+            raise ValueError('{} is not a topic store'.format(path))
+
+        start = len(TopicStore.MAGIC)
+        (header_length,) = struct.unpack_from('<I', self.map, start)
+        start += 4
+        header = json.loads(self.map[start:start + header_length].decode('utf-8'))
+
+        view = memoryview(self.map)
+        self.cells = view[header['cells'][0]:header['cells'][1]].cast('I')
+        self.offsets = view[header['offsets'][0]:header['offsets'][1]].cast('I')
+        self.strings = header['strings']
+
+        self.collections = {}
+        for collection, kinds in header['collections'].items():
+            self.collections[collection] = {}
+            for kind, (columns, topics) in kinds.items():
+                topics = dict((int(topic_id), tuple(span)) for topic_id, span in topics.items())
+                self.collections[collection][kind] = (columns, topics)
+
+
+    def topic_ids(self, collection):
+        """
+        This function returns the set of topic ids of a collection.
+        """
+        if collection not in self.collections:
+            return set()
+        (columns, topics) = self.collections[collection]['tokens']
+        return set(topics.keys())
+
+
+    def count(self, collection, kind, topic_id):
+        """
+        This function returns the number of rows of a topic.
+        """
+        (columns, topics) = self.collections[collection][kind]
+        return topics[topic_id][1]
+
+
+    def rows(self, collection, kind, topic_id, limit=None):
+        """
+        This function returns the first rows of a topic.
+
+        @type  collection: string
+        @param collection: The name of the collection.
+        @type  kind: string
+        @param kind: The kind of data, 'tokens' or 'docs'.
+        @type  topic_id: number
+        @param topic_id: The id of the topic.
+        @type  limit: number
+        @param limit: The maximum number of rows returned.
+
+        @rtype:   list
+        @return:  The rows as dictionaries keyed by column name.
+        """
+        (columns, topics) = self.collections[collection][kind]
+        (first_cell, row_count) = topics[topic_id]
+        if limit is not None:
+            row_count = min(row_count, max(limit, 0))
+
+        rows = []
+        width = len(columns)
+        for row_index in range(row_count):
+            row = {}
+            cell = first_cell + row_index * width
+            for column in columns:
+                string_index = self.cells[cell]
+                if string_index != TopicStore.MISSING:
+                    row[column] = self.__string(string_index)
+                cell += 1
+            rows.append(row)
+        return rows
+
+
+    def __string(self, string_index):
+        start = self.strings + self.offsets[string_index]
+        end = self.strings + self.offsets[string_index + 1]
+        return self.map[start:end].decode('utf-8')
+
+
+    @staticmethod
+    def write(path, collections):
+        """
+        This function writes a topic store file.
+
+        @type  path: string
+        @param path: The path of the file to write.
+        @type  collections: dictionary
+        @param collections: For every collection and kind, a (columns,
+            topics) tuple where topics maps every topic id to its list of
+            rows, each row being a list of strings.
+        """
+        string_indexes = {}
+        offsets = array('I', [0])
+        strings = bytearray()
+        cells = array('I')
+        header_collections = {}
+
+        for collection, kinds in collections.items():
+            header_collections[collection] = {}
+            for kind, (columns, topics) in kinds.items():
+                spans = {}
+                for topic_id, rows in topics.items():
+                    spans[str(topic_id)] = [len(cells), len(rows)]
+                    for row in rows:
+                        for position in range(len(columns)):
+                            if position >= len(row):
+                                cells.append(TopicStore.MISSING)
+                                continue
+                            value = row[position]
+                            if value not in string_indexes:
+                                string_indexes[value] = len(offsets) - 1
+                                strings.extend(value.encode('utf-8'))
+                                offsets.append(len(strings))
+                            cells.append(string_indexes[value])
+                header_collections[collection][kind] = [list(columns), spans]
+
+        # The offsets of the sections only depend on the header length, so
+        # the header is encoded once with placeholder offsets to measure it.
+        header = {'collections': header_collections, 'cells': [0, 0], 'offsets': [0, 0], 'strings': 0}
+        placeholder = len(json.dumps(header).encode('utf-8')) + 64
+        cells_start = TopicStore.__align(len(TopicStore.MAGIC) + 4 + placeholder)
+        offsets_start = cells_start + len(cells) * cells.itemsize
+        strings_start = offsets_start + len(offsets) * offsets.itemsize
+        header.update({'cells': [cells_start, offsets_start],
+                       'offsets': [offsets_start, strings_start],
+                       'strings': strings_start})
+        encoded_header = json.dumps(header).encode('utf-8').ljust(placeholder)
+
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as outfile:
+            outfile.write(TopicStore.MAGIC)
+            outfile.write(struct.pack('<I', placeholder))
+            outfile.write(encoded_header)
+            outfile.write(b'\0' * (cells_start - outfile.tell()))
+            outfile.write(cells.tobytes())
+            outfile.write(offsets.tobytes())
+            outfile.write(bytes(strings))
+
+        # Workers opening the store never see a partially written file
+        os.replace(temp_path, path)
+
+
+    @staticmethod
+    def __align(position):
+        return (position + 7) // 8 * 8
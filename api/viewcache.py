@@ -0,0 +1,96 @@
+import time
+import hashlib
+
+from datetime import datetime
+from sqlalchemy import text
+
+from api.cache import Cache
+
+
+class ResponseCache(object):
+    """
+    This class keeps serialized responses of the routes reading batch
+    generated tables (ex. the visualizations tables) in memory, together
+    with their ETag and Last-Modified values.
+
+    Every response carries the version of the tables it was built from (the
+    UPDATE_TIME and TABLE_ROWS kept by MySQL in information_schema.TABLES).
+    The version is checked against the database at most once every
+    check_interval seconds, and the response is rebuilt when a table has
+    changed.
+    """
+
+    def __init__(self, maxsize, check_interval):
+        self.check_interval = check_interval
+        self.entries = Cache(maxsize)
+
+
+    def fetch(self, session, key, sources, mapper, render):
+        """
+        This function returns the cached response body of key, rendering it
+        when it is missing or its tables have changed.
+
+        @type  session: object
+        @param session: A session factory object configured to access all databases.
+        @type  key: tuple
+        @param key: The route and parameters identifying the response.
+        @type  sources: list
+        @param sources: The (database, table) pairs the response is built from.
+        @type  mapper: object
+        @param mapper: A mapped table class used to pick the database engine.
+        @type  render: function
+        @param render: A function returning the response body as bytes.
+
+        @rtype:   tuple
+        @return:  The response body, its ETag and its Last-Modified date.
+        """
+        cached = self.entries.get(key)
+
+        if cached is not None:
+            (version, checked, body, etag, last_modified) = cached
+            if time.time() - checked < self.check_interval:
+                return (body, etag, last_modified)
+            if self.__version(session, sources, mapper) == version:
+                self.entries.set(key, (version, time.time(), body, etag, last_modified))
+                return (body, etag, last_modified)
+
+        version = self.__version(session, sources, mapper)
+        body = render()
+        etag = hashlib.md5(body).hexdigest()
+
+        # Tables whose update time is unknown to MySQL are dated by the response
+        update_times = [update_time for (update_time, table_rows) in version if update_time is not None]
+        if len(update_times) == len(version):
+            last_modified = datetime.utcfromtimestamp(int(max(update_times)))
+        else:
+            last_modified = datetime.utcnow().replace(microsecond=0)
+
+        self.entries.set(key, (version, time.time(), body, etag, last_modified))
+        return (body, etag, last_modified)
+
+
+    def clear(self):
+        """
+        This function drops every cached response.
+        """
+        self.entries.clear()
+
+
+    def __version(self, session, sources, mapper):
+        return table_versions(session, sources, mapper)
+
+
+def table_versions(session, sources, mapper):
+    """
+    This function returns the version of tables: the UPDATE_TIME and
+    TABLE_ROWS kept by MySQL in information_schema.TABLES for every
+    (database, table) pair of sources. UPDATE_TIME is in the time zone of
+    the server, so it is read as a Unix timestamp.
+    """
+    version = []
+    for (database, table) in sources:
+        row = session.execute(text("SELECT UNIX_TIMESTAMP(UPDATE_TIME), TABLE_ROWS FROM information_schema.TABLES "
+                                   "WHERE TABLE_SCHEMA = :database AND TABLE_NAME = :table"),
+                              {'database': database, 'table': table}, mapper=mapper).first()
+        version.append(tuple(row) if row else (None, None))
+    return tuple(version)
@@ -64,6 +64,7 @@ def declass_entity_info(version):
     /<version>/entity_info/?collection=<colleciton_name>
     /<version>/entity_info/?collection=<colleciton_name>&entity=<entity_name>
     /<version>/entity_info/?collection=<colleciton_name>&entity=<entity_name>&page_size=<number>&page=<number>
+    /<version>/entity_info/?collection=<colleciton_name>&entity=<entity_name>&page_size=<number>&after=<entity_id>
 
     @type  collection: string
     @param colleciton: The name of a collection. (ex. frus)
@@ -74,11 +75,14 @@ def declass_entity_info(version):
     @param page_size: The number of results to be returned for a query.
     @type  page: number
     @param page: This parameter displays a specific results page.
+    @type  after: string
+    @param after: The id of the last entity of the previous page. The
+        next_page links use it instead of page.
 
     @rtype:   json
     @return:  Array of entity records for a particular collections in database.
     """
-    accepted_params = {'entity', 'collection', 'page', 'page_size'}
+    accepted_params = {'entity', 'collection', 'page', 'page_size', 'after'}
     probe_request(version, request, accepted_params)
 
     # Loading the header request fields
@@ -96,7 +100,7 @@ def declass_entity_info(version):
                                      controller.PAGE_SIZE_DEFAULT))
 
     return controller.get_entity_info(entity, collection, page, page_size,
-                                      request.url)
+                                      request.url, request.args.get('after'))
 
 
 @app.route('/<version>/overview/')
@@ -189,7 +193,7 @@ def declass_viz_doc_cnts(version):
     """
     probe_request(version, request)
 
-    return controller.get_viz_docs('doc_cnts')
+    return controller.get_viz_docs('doc_cnts').make_conditional(request)
 
 
 @app.route('/<version>/visualizations/doc_collection/')
@@ -201,7 +205,7 @@ def declass_viz_doc_collect(version):
     """
     probe_request(version, request)
 
-    return controller.get_viz_docs('doc_collection')
+    return controller.get_viz_docs('doc_collection').make_conditional(request)
 
 
 @app.route('/<version>/visualizations/doc_cnts_year/')
@@ -213,7 +217,7 @@ def declass_viz_doc_counts_year(version):
     """
     probe_request(version, request)
 
-    return controller.get_viz_docs('doc_cnts_year')
+    return controller.get_viz_docs('doc_cnts_year').make_conditional(request)
 
 
 @app.route('/<version>/visualizations/overview/')
@@ -255,7 +259,7 @@ def declass_viz_overview(version):
             return clerk.complain(404, "Invalid API parameters",
                                        "limit must be a positive integer.")
 
-    return controller.get_viz_overview(databases, tables, limit)
+    return controller.get_viz_overview(databases, tables, limit).make_conditional(request)
 
 
 @app.route('/<version>/visualizations/<collection_name>/\
@@ -302,23 +306,40 @@ def random_doc_ids(version):
     Can be invoked by:
     /v0.4/random
     /v0.4/random/?limit=<number>
+    /v0.4/random/?limit=<number>&collections=<c1,c2>&seed=<number>
 
     @type  limit: number (optional, default 10)
     @param limit: The number of records to be returned for the query.
+    @type  collections: string (optional)
+    @param collections: Comma separated collections to sample from.
+    @type  seed: number (optional)
+    @param seed: The seed of the random generator, the same seed returns
+        the same documents.
 
     @rtype:   json
     @return:  Array of document ids.
     """
     print(request)
-    accepted_params = {'limit'}
+    accepted_params = {'limit', 'collections', 'seed'}
     probe_request(version, request, accepted_params)
 
     limit = request.args.get('limit')
     if limit and not limit.isdigit():
         complain('InvalidValues')
 
+    seed = request.args.get('seed')
+    if seed and not seed.isdigit():
+        complain('InvalidValues')
+
+    collections = None
+    if request.args.get('collections'):
+        collections = request.args.get('collections').lower().split(',')
+        if not set(collections).issubset(set(controller.get_collection_names())):
+            complain('InvalidValues')
+
     limit = request.args.get('limit', 10, int)
-    return controller.get_random_doc_ids(limit)
+    seed = request.args.get('seed', None, int)
+    return controller.get_random_doc_ids(limit, collections, seed)
 
 
 @app.route('/<version>/documents/<doc_ids>/')
@@ -369,19 +390,29 @@ def declass_text_drop(version):
 @cross_origin()
 def documents_similar(version, doc_id):
     """
-    This end-point searches for documents that are similar to
-    a given doc_id. It is powered by Merriam.
-    Status: Not implemented yet.
+    This end-point searches for documents of the same collection that are
+    similar to a given doc_id, comparing their topic scores.
+
+    Can be invoked by:
+    /v0.4/documents/<doc_id>/similar/
+    /v0.4/documents/<doc_id>/similar/?limit=<number>
+
+    @type  limit: number (optional, default 10)
+    @param limit: The number of records to be returned for the query.
 
     @rtype:   json
-    @return:  Array of documents info related to doc_id.
+    @return:  Array of documents info related to doc_id, with their
+        similarity score.
     """
-    probe_request(version, request)
+    accepted_params = {'limit'}
+    probe_request(version, request, accepted_params)
+
+    limit = request.args.get('limit')
+    if limit and not limit.isdigit():
+        complain('InvalidValues')
 
-    return "Not implemented yet"
-    # merriam_link = controller.get_merriam_link()
-    # return redirect('%s/%s/?%s' % (merriam_link, doc_id,
-    #    request.query_string), code=303)
+    limit = request.args.get('limit', 10, int)
+    return controller.get_similar_docs(doc_id, limit)
 
 
 @app.route('/<version>/entities/autocomplete/')
@@ -398,19 +429,29 @@ def declass_entity_autocomplete(version):
     @param type: A valid collection entity (persons, countries, topics).
 
     @type  autocomplete_text: string
-    @param search: An autocomplete query.
+    @param search: An autocomplete query, of any length. Names one typo
+        away from the query complete the results.
+
+    @type  limit: number (optional, default 10, at most 100)
+    @param limit: The number of entities to be returned.
 
     @rtype:   json
-    @return:  Array of documents info starting with <word_start>.
+    @return:  Array of entities (name, type, document count and id in every
+        collection) whose name, or a word of it, starts with <word_start>.
     """
-    accepted_params = {'type', 'autocomplete_text'}
+    accepted_params = {'type', 'autocomplete_text', 'limit'}
     word_start = request.args.get('autocomplete_text')
 
     probe_request(version, request, accepted_params)
 
     entity_type = request.args.get('type')
 
-    return controller.get_entity_autocomplete(word_start, entity_type)
+    limit = request.args.get('limit')
+    if limit and not limit.isdigit():
+        complain('InvalidValues')
+
+    limit = min(request.args.get('limit', 10, int), 100)
+    return controller.get_entity_autocomplete(word_start, entity_type, limit)
 
 
 @app.route('/<version>/')
@@ -445,7 +486,11 @@ def api(version):
     @param page_size: The number of results to be returned for a query.
     @type  page: string
     @param page: This parameter displays a specific results page.
-        It is a hashed pagination variable.
+        It is the continuation token returned in next_page (legacy
+        collection:offset pages are still accepted).
+    @type  count_mode: string
+    @param count_mode: How the total count is computed: exact (default),
+        estimate or none.
 
     @rtype:   json
     @return:  Array of documents info.
@@ -459,65 +504,22 @@ def api(version):
     if not clerk.is_valid_pagination(request, page_type="hash"):
         complain("Pagination")
 
-    # Load the list of accepted paramaters and fields
+    # Load the list of accepted paramaters
     accepted_params = controller.get_config_parameters()
-    accepted_fields = controller.get_config_fields()
 
-    # ------------------------------------------------------------------- #
-    # Analyze user input to validate requested parameters and fields
-    # ------------------------------------------------------------------- #
+    (passed_params, filters, entities) = parse_document_filters(request, accepted_params)
 
-    passed_params = [] if (not list(request.args.items())) \
-        else [i[0].lower() for i in list(request.args.items())]
-    passed_fields = [] if (not request.args.get('fields')) \
-        else request.args.get('fields').lower().split(',')
-    filters = {}
-    filters['start_date'] = request.args.get('start_date',  None)
-    filters['end_date'] = request.args.get('end_date', None)
-    filters['exact_date'] = request.args.get('date', None)
-    filters['page'] = request.args.get('page')
     filters['page_size'] = int(request.args.get('page_size',
                                                 controller.PAGE_SIZE_DEFAULT))
     filters['page_start_index'] = clerk.set_page_start_index(filters['page'])
+    filters['page_seek'] = clerk.set_page_seek(filters['page'])
+    filters['page_count'] = clerk.set_page_count(filters['page'])
+    filters['count_mode'] = request.args.get('count_mode',
+                                             accepted_params['count_mode'])
     filters['page_url'] = request.url
 
-    filters['collections'] = [] if (not request.args.get('collections')) \
-        else request.args.get('collections').lower().split(',')
-    if not filters['collections']:
-        filters['collections'] = controller.get_collection_names()
-    filters['fields'] = accepted_fields
-    if passed_fields:
-        filters['fields'] = passed_fields
-
-    # Check if user entered an invalid parameter
-    if not clerk.valid_params(passed_params, accepted_params, request):
-        complain("Parameters", accepted_params)
-
-    # Check if user entered an invalid field
-    if not clerk.valid_fields(passed_fields, accepted_fields):
-        complain("Fields", accepted_fields)
-
-    # Check if user entered an invalid entity
-    entities = clerk.valid_entities(passed_params, request)
-    if not entities:
-        complain("Entities", accepted_params)
-
-    # Assign any Entities
-    person_ids = entities['person_ids']
-    person_logic = entities['person_logic']
-
-    geo_ids = entities['geo_ids']
-    geo_logic = entities['geo_logic']
-
-    topic_ids = entities['topic_ids']
-    topic_logic = entities['topic_logic']
-
-    classification_ids = entities['classification_ids']
-    classification_logic = entities['classification_logic']
-
-    # Check if user entered an invalid filter
-    if not clerk.valid_filters(filters):
-        complain("Filters", accepted_fields)
+    if filters['count_mode'] not in ('exact', 'estimate', 'none'):
+        complain('InvalidValues')
 
     # ---------------------------------------------------------------------- #
     # Perform a search operation depending on specified parameters
@@ -537,95 +539,51 @@ def api(version):
 
         return controller.find_docs_by_ids(doc_ids, filters)
 
-    # 2: Search documents by classification, persons, countries, and topics
-    if "person_ids" in passed_params and "geo_ids" in passed_params and \
-       "topic_ids" in passed_params and "classification_ids" in passed_params:
-        return controller.find_docs_by_person_country_topic_classification(
-          person_ids, person_logic, geo_ids, geo_logic, topic_ids, topic_logic,
-          classification_ids, classification_logic, filters)
-
-    # 3: Search documents by persons, countries, and topics entities combined
-    if "person_ids" in passed_params and "geo_ids" in passed_params and \
-       "topic_ids" in passed_params:
-        return controller.find_docs_by_person_country_topic(
-          person_ids, person_logic, geo_ids, geo_logic, topic_ids, topic_logic,
-          filters)
-
-    # 4: Search documents by classification, topics, and persons
-    if "person_ids" in passed_params and \
-       "classification_ids" in passed_params and "topic_ids" in passed_params:
-        return controller.find_docs_by_person_classification_topic(
-          person_ids, person_logic, classification_ids, classification_logic,
-          topic_ids, topic_logic, filters)
-
-    # 5: Search documents by classification, topics, and countries
-    if "classification_ids" in passed_params and \
-       "geo_ids" in passed_params and "topic_ids" in passed_params:
-        return controller.find_docs_by_classification_country_topic(
-          classification_ids, classification_logic, geo_ids, geo_logic,
-          topic_ids, topic_logic, filters)
-
-    # 6: Search documents by classification, persons, and countries
-    if "person_ids" in passed_params and "geo_ids" in passed_params and \
-       "classification_ids" in passed_params:
-        return controller.find_docs_by_person_country_classification(
-          person_ids, person_logic, geo_ids, geo_logic,
-          classification_ids, classification_logic, filters)
-
-    # 7: Search documents by persons and countries combined
-    if "person_ids" in passed_params and "geo_ids" in passed_params:
-        return controller.find_docs_by_person_country(
-          person_ids, person_logic, geo_ids, geo_logic, filters)
-
-    # 8: Search documents by persons and topics combined
-    if "person_ids" in passed_params and "topic_ids" in passed_params:
-        return controller.find_docs_by_person_topic(
-          person_ids, person_logic, topic_ids, topic_logic, filters)
-
-    # 9: Search documents by countries and topics combined
-    if "geo_ids" in passed_params and "topic_ids" in passed_params:
-        return controller.find_docs_by_country_topic(
-          geo_ids, geo_logic, topic_ids, topic_logic, filters)
-
-    # 10: Search documents by classification and persons
-    if "person_ids" in passed_params and "classification_ids" in passed_params:
-        return controller.find_docs_by_person_classification(
-          person_ids, person_logic, classification_ids, classification_logic,
-          filters)
-
-    # 11: Search documents by classification and countries
-    if "geo_ids" in passed_params and "classification_ids" in passed_params:
-        return controller.find_docs_by_classification_country(
-          classification_ids, classification_logic, geo_ids, geo_logic,
-          filters)
-
-    # 12: Search documents by classification and topics
-    if "classification_ids" in passed_params and "topic_ids" in passed_params:
-        return controller.find_docs_by_classification_topic(
-          classification_ids, classification_logic, topic_ids, topic_logic,
-          filters)
-
-    # 13: Search documents by persons only
-    if "person_ids" in passed_params:
-        return controller.find_docs_by_persons(
-          person_ids, person_logic, filters)
-
-    # 14: Search documents by countries only
-    if "geo_ids" in passed_params:
-        return controller.find_docs_by_country(geo_ids, geo_logic, filters)
-
-    # 15: Search documents by topics only
-    if "topic_ids" in passed_params:
-        return controller.find_docs_by_topic(topic_ids, topic_logic, filters)
-
-    # 16: Search documents by classification only
-    if "classification_ids" in passed_params:
-        return controller.find_docs_by_classification(
-          classification_ids, classification_logic, filters)
-
-    # 17: Search all documents by date or date range
-    if filters['exact_date'] or filters['start_date']:
-        return controller.find_docs_by_date(filters)
+    # 2: Search documents by any combination of persons, countries, topics,
+    # classifications and a date or date range
+    entity_filters = controller.planner.entity_filters(entities, passed_params)
+    if entity_filters or filters['exact_date'] or filters['start_date']:
+        return controller.find_docs(entity_filters, filters)
+
+    complain("Parameters", accepted_params)
+
+
+@app.route('/<version>/export/')
+@cross_origin()
+def declass_export(version):
+    """
+    This end-point exports every document matching a search, in a single
+    response, instead of one page at a time. It accepts the filters of the
+    core end-point, except the document ids and the pagination.
+
+    /<version>/export/?topic_ids=<id>&fields=<f1,f2>&format=csv
+
+    @type  format: string (optional, default ndjson)
+    @param format: The format of the export: ndjson (one JSON document per
+        line) or csv.
+
+    @rtype:   ndjson or csv
+    @return:  All the documents, ordered by date.
+    """
+    if not clerk.is_valid_version(version):
+        complain("Version")
+
+    if clerk.is_missing_param_key_val(request):
+        complain("Partial")
+
+    accepted_params = set(controller.get_config_parameters().keys()) \
+        - {'page', 'page_size', 'id', 'ids', 'count_mode'}
+    accepted_params.add('format')
+
+    (passed_params, filters, entities) = parse_document_filters(request, accepted_params)
+
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in clerk.EXPORT_FORMATS:
+        complain('InvalidValues')
+
+    entity_filters = controller.planner.entity_filters(entities, passed_params)
+    if entity_filters or filters['exact_date'] or filters['start_date']:
+        return controller.export_docs(entity_filters, filters, export_format)
 
     complain("Parameters", accepted_params)
 
@@ -766,15 +724,19 @@ def declass_full_text_search(version):
     @param collecitons: The name(s) of a collection. (ex. frus)
     @type  page_size: number
     @param page_size: The number of results to be returned for a query.
-    @type  page: number
-    @param page: This parameter displays a specific results page.
+    @type  page: string
+    @param page: This parameter displays a specific results page, either
+        its number or the continuation token of the next_page link.
+    @type  facets: string
+    @param facets: The breakdowns of the matching documents to return
+        with the results: collection, year, classification, persons.
 
     @rtype:   json
     @return:  Array of documents info.
     """
 
     accepted_params = {'search', 'page_size', 'page', 'start_date', 'end_date',
-                       'collections'}
+                       'collections', 'facets'}
     passed_params = [] if (not list(request.args.items())) \
         else [i[0].lower() for i in list(request.args.items())]
 
@@ -792,6 +754,8 @@ def declass_full_text_search(version):
         else request.args.get('collections').lower().split(',')
     if not filters['collections']:
         filters['collections'] = controller.get_collection_names()
+    filters['facets'] = [] if (not request.args.get('facets')) \
+        else request.args.get('facets').lower().split(',')
 
     if not clerk.is_valid_version(version):
         complain("Version")
@@ -805,10 +769,14 @@ def declass_full_text_search(version):
     if not clerk.valid_filters(filters):
         complain("Filters", accepted_params)
 
+    if not set(filters['facets']).issubset(controller.FULL_TEXT_FACETS):
+        complain("Fields", controller.FULL_TEXT_FACETS)
+
     if not search_text:
         complain("Parameters", accepted_params)
 
-    if filters['page'] and not filters['page'].isdigit():
+    if filters['page'] and not filters['page'].isdigit() \
+            and clerk.decode_search_token(filters['page']) is None:
         complain('InvalidValues')
 
     if filters['page_size'] and not filters['page_size'].isdigit():
@@ -874,6 +842,60 @@ def probe_request(version, request, accepted_params=None):
         complain("Pagination")
 
 
+def parse_document_filters(request, accepted_params):
+    """
+    This function reads and validates the parameters shared by the document
+    search end-points: dates, collections, fields and entity ids.
+
+    @type  request: string
+    @param request: The url header invoked by the user
+    @type  accepted_params: list
+    @param accepted_params: A list of parameters that the end-point accepts.
+
+    @rtype:   tuple
+    @return:  The passed parameters, the filters and the entities of the
+        request. Returns an error message if the request is invalid.
+    """
+    accepted_fields = controller.get_config_fields()
+
+    passed_params = [] if (not list(request.args.items())) \
+        else [i[0].lower() for i in list(request.args.items())]
+    passed_fields = [] if (not request.args.get('fields')) \
+        else request.args.get('fields').lower().split(',')
+    filters = {}
+    filters['start_date'] = request.args.get('start_date',  None)
+    filters['end_date'] = request.args.get('end_date', None)
+    filters['exact_date'] = request.args.get('date', None)
+    filters['page'] = request.args.get('page')
+
+    filters['collections'] = [] if (not request.args.get('collections')) \
+        else request.args.get('collections').lower().split(',')
+    if not filters['collections']:
+        filters['collections'] = controller.get_collection_names()
+    filters['fields'] = list(accepted_fields)
+    if passed_fields:
+        filters['fields'] = passed_fields
+
+    # Check if user entered an invalid parameter
+    if not clerk.valid_params(passed_params, accepted_params, request):
+        complain("Parameters", accepted_params)
+
+    # Check if user entered an invalid field
+    if not clerk.valid_fields(passed_fields, accepted_fields):
+        complain("Fields", accepted_fields)
+
+    # Check if user entered an invalid entity
+    entities = clerk.valid_entities(passed_params, request)
+    if not entities:
+        complain("Entities", accepted_params)
+
+    # Check if user entered an invalid filter
+    if not clerk.valid_filters(filters):
+        complain("Filters", accepted_fields)
+
+    return (passed_params, filters, entities)
+
+
 def complain(message, parameters=None):
     """
     This function returns an error message to the user.
@@ -0,0 +1,74 @@
+"""
+Builds the data files the API reads at startup instead of querying the
+databases or parsing static files.
+
+    python build.py topics topic_docs routing doc_ids autocomplete similar fulltext
+"""
+import argparse
+
+
+def build_topics(controller):
+    controller.build_topic_store()
+
+
+def build_topic_docs(controller):
+    for collection in controller.TOPIC_COLLECTIONS:
+        database = controller.collection_names[collection]
+        if 'topic_doc' in controller.Tables[database]:
+            controller.build_topic_doc_ids(database)
+
+
+def build_routing(controller):
+    session = controller.Session()
+    controller.router.build(session)
+    session.close()
+
+
+def build_doc_ids(controller):
+    session = controller.Session()
+    controller.sampler.build(session)
+    session.close()
+
+
+def build_autocomplete(controller):
+    session = controller.Session()
+    controller.autocomplete.build(session)
+    session.close()
+
+
+def build_similar(controller):
+    session = controller.Session()
+    for collection in controller.TOPIC_COLLECTIONS:
+        database = controller.collection_names[collection]
+        if 'topic_doc' in controller.Tables[database]:
+            controller.similar.build(session, database)
+    session.close()
+
+
+def build_fulltext(controller):
+    controller.build_fulltext_index()
+
+
+COMMANDS = {
+    'topics': build_topics,
+    'topic_docs': build_topic_docs,
+    'routing': build_routing,
+    'doc_ids': build_doc_ids,
+    'autocomplete': build_autocomplete,
+    'similar': build_similar,
+    'fulltext': build_fulltext
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('commands', nargs='+', choices=sorted(COMMANDS.keys()),
+                        help='data files to build')
+    build_args = parser.parse_args()
+
+    from api import controller
+
+    for command in build_args.commands:
+        COMMANDS[command](controller)
@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# Importing the api package prompts for the database credentials and connects
+# to the databases, so the unit tests import its modules from a bare package.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+if 'api' not in sys.modules:
+    package = types.ModuleType('api')
+    package.__path__ = [os.path.join(ROOT, 'api')]
+    sys.modules['api'] = package
+
+# Scripts run by hand, not tests
+collect_ignore = ['test.py', 'test']
@@ -0,0 +1,91 @@
+import argparse
+import importlib.util
+import json
+import os
+import random
+import timeit
+from datetime import date, datetime
+
+
+def load_serializer():
+    # Loaded from its file: importing the api package connects to the databases
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api', 'serializer.py')
+    spec = importlib.util.spec_from_file_location('serializer', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Serializer
+
+
+class LegacyEncoder(json.JSONEncoder):
+    # The encoder used before api/serializer.py
+    def default(self, obj):
+        try:
+            if isinstance(obj, date):
+                return obj.isoformat()
+            iterable = iter(obj)
+        except TypeError:
+            pass
+        else:
+            return list(iterable)
+        return json.JSONEncoder.default(self, obj)
+
+
+def make_page(page_size, generator):
+    page = []
+    for number in range(page_size):
+        page.append({
+            'id': 'frus1964-68v{0:02d}d{1}'.format(generator.randint(1, 34), number),
+            'collection': generator.choice(['frus', 'ddrs', 'kissinger', 'statedeptcables']),
+            'date': datetime(generator.randint(1945, 1980), generator.randint(1, 12), generator.randint(1, 28),
+                             generator.randint(0, 23), generator.randint(0, 59)),
+            'title': 'Telegram From the Embassy in Saigon to the Department of State',
+            'subject': 'Political situation',
+            'classification': generator.choice(['secret', 'confidential', 'unclassified']),
+            'countries': [{'id': generator.randint(1, 250), 'name': 'Vietnam'}],
+            'persons': [{'id': generator.randint(1, 50000), 'name': 'Lodge, Henry Cabot'}],
+            'topics': [{'id': generator.randint(1, 100), 'name': 'military operations'}]
+        })
+    return {'count': page_size * 20, 'page': 1, 'page_size': page_size, 'results': page}
+
+
+def format_dates(output):
+    # Same conversion as Clerk.format_dates
+    for row in output['results']:
+        for key, value in row.items():
+            if isinstance(value, date):
+                row[key] = value.isoformat()
+    return output
+
+
+def run_benchmark(page_sizes, seconds):
+    Serializer = load_serializer()
+    encoders = [('legacy', lambda obj: LegacyEncoder().encode(obj).encode('utf-8'))]
+    for name in Serializer.ENCODERS:
+        try:
+            encoders.append((name, Serializer(name).encode))
+        except ValueError:
+            print('{0} is not installed, skipped'.format(name))
+
+    print('{0:>10s} {1:>8s} {2:>10s} {3:>12s} {4:>10s} {5:>10s}'.format(
+          'page_size', 'encoder', 'dates', 'pages/s', 'docs/s', 'MB/s'))
+    for page_size in page_sizes:
+        native = make_page(page_size, random.Random(page_size))
+        formatted = format_dates(make_page(page_size, random.Random(page_size)))
+        for (name, encode) in encoders:
+            for (dates, output) in (('native', native), ('formatted', formatted)):
+                size = len(encode(output))
+                # Repeat enough times to run for about the requested duration
+                number = max(1, int(seconds / max(timeit.timeit(lambda: encode(output), number=1), 1e-6)))
+                elapsed = min(timeit.repeat(lambda: encode(output), number=number, repeat=3)) / number
+                print('{0:10d} {1:>8s} {2:>10s} {3:12.1f} {4:10.0f} {5:10.1f}'.format(
+                      page_size, name, dates, 1 / elapsed, page_size / elapsed, size / elapsed / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='measures the JSON encoding throughput of document pages')
+    parser.add_argument('page_sizes', type=int, nargs='*', default=[10, 100, 1000, 10000],
+                        help='number of documents per page')
+    parser.add_argument('--seconds', type=float, default=0.2,
+                        help='approximate duration of each measure')
+    args = parser.parse_args()
+    run_benchmark(args.page_sizes, args.seconds)
@@ -0,0 +1,81 @@
+import pytest
+
+from api.autocomplete import PrefixIndex
+from api.errors import MissingDataError
+
+
+class FakeRegistry(object):
+
+    def __init__(self, listings):
+        self.listings = listings
+
+    def listing(self, session, database, entity_type):
+        listing = self.listings[(database, entity_type)]
+        return (dict((entity_id, name) for (entity_id, name, count) in listing), listing)
+
+
+class FakeController(object):
+
+    def __init__(self, listings):
+        self.entity_names = ['persons', 'countries']
+        self.collection_names = {'frus': 'frus', 'ddrs': 'ddrs'}
+        self.Entities = {'frus': ['persons', 'countries'], 'ddrs': ['persons']}
+        self.registry = FakeRegistry(listings)
+
+
+def test_missing_index_is_not_built_on_request(tmp_path):
+    index = PrefixIndex(FakeController({}), str(tmp_path / 'autocomplete.pickle'))
+
+    with pytest.raises(MissingDataError) as error:
+        index.complete(None, 'ken')
+    assert 'build.py autocomplete' in str(error.value)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.fixture
+def index(tmp_path):
+    controller = FakeController({
+        ('frus', 'persons'): [(1, 'Kennedy, John F.', 120), (2, 'Khrushchev, Nikita', 80),
+                              (3, 'Kennan, George F.', 15), (4, 'NULL', 500), (5, None, 500)],
+        ('ddrs', 'persons'): [(11, 'Kennedy, John F.', 30), (12, 'Castro, Fidel', 60)],
+        ('frus', 'countries'): [(1, 'Cuba', 200), (2, 'Côte d\'Ivoire', 5)],
+    })
+    path = str(tmp_path / 'autocomplete.pickle')
+    PrefixIndex(controller, path).build(None)
+    return PrefixIndex(controller, path)
+
+
+def names(results):
+    return [result['name'] for result in results]
+
+
+def test_entities_are_ranked_by_document_count(index):
+    results = index.complete(None, 'k', 'persons')
+
+    assert names(results) == ['Kennedy, John F.', 'Khrushchev, Nikita', 'Kennan, George F.']
+    assert results[0] == {'name': 'Kennedy, John F.', 'type': 'persons', 'count': 150,
+                          'ids': {'frus': 1, 'ddrs': 11}}
+
+
+def test_every_word_and_the_whole_name_are_completed(index):
+    assert names(index.complete(None, 'fidel')) == ['Castro, Fidel']
+    assert names(index.complete(None, 'castro, fi')) == ['Castro, Fidel']
+    assert names(index.complete(None, 'kenn', limit=1)) == ['Kennedy, John F.']
+
+
+def test_accents_and_case_are_ignored(index):
+    assert names(index.complete(None, 'COTE', 'countries')) == ['Côte d\'Ivoire']
+    assert names(index.complete(None, 'côte', 'countries')) == ['Côte d\'Ivoire']
+
+
+def test_near_matches_complete_the_results(index):
+    assert names(index.complete(None, 'khruschev')) == ['Khrushchev, Nikita']
+    assert names(index.complete(None, 'kenendy')) == ['Kennedy, John F.']
+
+
+def test_types_and_empty_text(index):
+    assert names(index.complete(None, 'c')) == ['Cuba', 'Castro, Fidel', 'Côte d\'Ivoire']
+    assert names(index.complete(None, 'c', 'countries', limit=1)) == ['Cuba']
+    assert index.complete(None, 'null') == []
+    assert index.complete(None, '') == []
+    assert index.complete(None, None) == []
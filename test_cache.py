@@ -0,0 +1,50 @@
+import api.cache
+from api.cache import Cache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = Cache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    cache.set('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_entries_expire(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(api.cache, 'time', clock)
+    cache = Cache(10, ttl=60)
+    cache.set('a', 1)
+
+    clock.now += 59
+    assert cache.get('a') == 1
+    clock.now += 2
+    assert cache.get('a', 'expired') == 'expired'
+    assert len(cache) == 0
+
+
+def test_falsy_values_pop_and_clear():
+    cache = Cache(10)
+    cache.set('zero', 0)
+    cache.set('empty', {})
+    assert cache.get('zero', 'missing') == 0
+    assert cache.get('empty', 'missing') == {}
+
+    cache.pop('zero')
+    cache.pop('unknown')
+    assert cache.get('zero', 'missing') == 'missing'
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,190 @@
+import base64
+import json
+from datetime import date, datetime
+
+import pytest
+from flask import Flask
+
+from api.clerk import Clerk
+
+
+@pytest.fixture
+def clerk():
+    return Clerk(None)
+
+
+def test_page_token_round_trip(clerk):
+    seek = {'frus': (datetime(1962, 10, 16, 9, 30, 0, 250), 'frus1961-63v11d1'),
+            'ddrs': (date(1962, 10, 22), 'CK3100001'),
+            'cables': (None, '1974STATE085546')}
+    token = clerk.encode_page_token(seek, {'kissinger': 50, 'cpdoc': 0}, 1234)
+
+    assert token.startswith('v1.') and '=' not in token
+    assert clerk.decode_page_token(token) == {
+        's': {'frus': (datetime(1962, 10, 16, 9, 30, 0, 250), 'frus1961-63v11d1'),
+              'ddrs': (datetime(1962, 10, 22), 'CK3100001'),
+              'cables': (None, '1974STATE085546')},
+        'o': {'kissinger': 50},
+        'n': 1234}
+    assert clerk.set_page_seek(token) == clerk.decode_page_token(token)['s']
+    assert clerk.set_page_count(token) == 1234
+
+
+def test_page_token_without_count(clerk):
+    token = clerk.encode_page_token({}, {'frus': 25})
+
+    assert clerk.decode_page_token(token) == {'s': {}, 'o': {'frus': 25}, 'n': None}
+    assert clerk.set_page_seek('2') == {}
+    assert clerk.set_page_count('2') is None
+
+
+def encode(payload):
+    return 'v1.' + base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+@pytest.mark.parametrize('page', [
+    'v1.',
+    'v1.not base64!',
+    encode('not json'),
+    encode('{"s":{},"o":{"frus":-1},"n":null}'),
+    encode('{"s":{},"o":{"frus":"25"},"n":null}'),
+    encode('{"s":{},"o":{},"n":"10"}'),
+    encode('{"s":{"frus":["1962-10-16","frus1"]},"o":{},"n":null}'),
+    encode('{"s":{"frus":"frus1"},"o":{},"n":null}'),
+    encode('[]'),
+])
+def test_malformed_page_tokens_are_rejected(clerk, page):
+    assert clerk.decode_page_token(page) is None
+
+
+def test_search_token_round_trip(clerk):
+    token = clerk.encode_search_token('pit-id==', [12.5, 'frus1961-63v11d1'], 3, 987)
+
+    assert token.startswith('v1.') and '=' not in token
+    assert clerk.decode_search_token(token) == {'p': 'pit-id==', 'a': [12.5, 'frus1961-63v11d1'], 'g': 3, 'n': 987}
+    assert clerk.decode_search_token(clerk.encode_search_token(None, [0.5, 42], 2, None))['p'] is None
+
+
+@pytest.mark.parametrize('page', [
+    None,
+    '',
+    '2',
+    'v2.' + encode('{"p":null,"a":[],"g":2,"n":null}')[3:],
+    encode('{"p":1,"a":[],"g":2,"n":null}'),
+    encode('{"p":null,"a":"1","g":2,"n":null}'),
+    encode('{"p":null,"a":[],"g":0,"n":null}'),
+    encode('{"p":null,"a":[],"g":"2","n":null}'),
+    encode('{"p":null,"a":[],"g":2,"n":1.5}'),
+    encode('{"p":null,"a":[],"g":2}'),
+    encode('not json'),
+])
+def test_malformed_search_tokens_are_rejected(clerk, page):
+    assert clerk.decode_search_token(page) is None
+
+
+@pytest.fixture
+def app_context():
+    with Flask(__name__).app_context():
+        yield
+
+
+def rows(count):
+    return [{'id': 'frus{}'.format(number), 'date': datetime(1962, 10, 16), 'score': number}
+            for number in range(count)]
+
+
+def test_small_results_are_not_streamed(clerk, app_context):
+    response = clerk.process(rows(Clerk.STREAM_THRESHOLD), 200, clerk.JSON.encode, page=1, page_size=10)
+
+    assert not response.is_streamed
+    output = json.loads(response.get_data())
+    assert output['count'] == Clerk.STREAM_THRESHOLD
+    assert output['results'][0] == {'id': 'frus0', 'date': '1962-10-16T00:00:00', 'score': 0}
+
+
+def test_large_results_are_streamed(clerk, app_context):
+    data = rows(Clerk.STREAM_THRESHOLD + 1)
+    response = clerk.process(data, 200, clerk.JSON.encode, page=1, page_size=10, next_page='/next')
+
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    chunks = list(response.response)
+    assert len(chunks) > Clerk.STREAM_THRESHOLD // Clerk.STREAM_CHUNK_SIZE
+    output = json.loads(b''.join(chunks))
+    assert output['count'] == Clerk.STREAM_THRESHOLD + 1
+    assert output['page'] == 1 and output['page_size'] == 10 and output['next_page'] == '/next'
+    assert [row['id'] for row in output['results']] == [row['id'] for row in data]
+    assert output['results'][-1]['date'] == '1962-10-16T00:00:00'
+
+
+@pytest.mark.parametrize('count', [0, 1, Clerk.STREAM_CHUNK_SIZE, Clerk.STREAM_CHUNK_SIZE * 2 + 1])
+def test_iterators_are_streamed_and_counted(clerk, app_context, count):
+    response = clerk.process(iter(rows(count)), 200, clerk.JSON.encode)
+
+    assert response.is_streamed
+    output = json.loads(b''.join(response.response))
+    assert output['count'] == count
+    assert [row['id'] for row in output['results']] == [row['id'] for row in rows(count)]
+
+
+def test_nested_iterators_are_streamed(clerk, app_context):
+    data = {'frus': iter(rows(3)), 'ddrs': [], 'total': 3}
+    response = clerk.process(data, 200, clerk.JSON.encode, count=3)
+
+    assert response.is_streamed
+    output = json.loads(b''.join(response.response))
+    assert output['count'] == 3
+    assert len(output['results']['frus']) == 3
+    assert output['results']['ddrs'] == [] and output['results']['total'] == 3
+
+
+def export_rows(count):
+    return [{'id': 'frus{}'.format(number), 'date': datetime(1962, 10, 16, 9, 30), 'title': 'Cuba, "missiles"',
+             'persons': [{'id': 1, 'name': 'Kennedy'}, {'id': 2, 'name': 'Khrushchev'}], 'body': None}
+            for number in range(count)]
+
+
+def test_ndjson_export(clerk):
+    response = clerk.export(iter(export_rows(3)), ['id', 'date'], 'ndjson')
+
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=documents.ndjson'
+    lines = b''.join(response.response).decode('utf-8').split('\n')
+    assert lines[-1] == ''
+    assert [json.loads(line) for line in lines[:-1]] == [
+        {'id': 'frus{}'.format(number), 'date': '1962-10-16T09:30:00', 'title': 'Cuba, "missiles"',
+         'persons': [{'id': 1, 'name': 'Kennedy'}, {'id': 2, 'name': 'Khrushchev'}], 'body': None}
+        for number in range(3)]
+
+
+def test_csv_export(clerk):
+    response = clerk.export(iter(export_rows(2)), ['id', 'date', 'title', 'persons', 'body', 'subject'], 'csv')
+
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=documents.csv'
+    assert b''.join(response.response).decode('utf-8').split('\r\n') == [
+        'id,date,title,persons,body,subject',
+        'frus0,1962-10-16T09:30:00,"Cuba, ""missiles""",Kennedy; Khrushchev,,',
+        'frus1,1962-10-16T09:30:00,"Cuba, ""missiles""",Kennedy; Khrushchev,,',
+        '']
+
+
+@pytest.mark.parametrize('export_format', ['csv', 'ndjson'])
+@pytest.mark.parametrize('count', [0, Clerk.STREAM_CHUNK_SIZE, Clerk.STREAM_CHUNK_SIZE * 2 + 1])
+def test_exports_are_encoded_a_chunk_at_a_time(clerk, export_format, count):
+    consumed = []
+
+    def rows():
+        for row in export_rows(count):
+            consumed.append(row)
+            yield row
+
+    chunks = iter(clerk.export(rows(), ['id'], export_format).response)
+    assert consumed == []
+    first = next(chunks)
+    assert len(consumed) <= Clerk.STREAM_CHUNK_SIZE
+
+    lines = (first + b''.join(chunks)).decode('utf-8').splitlines()
+    assert len(consumed) == count
+    assert len([line for line in lines if line]) == count + (1 if export_format == 'csv' else 0)
@@ -0,0 +1,370 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from flask import Flask
+from sqlalchemy import Column, DateTime, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from api.cache import Cache
+from api.clerk import Clerk
+from api.controller import Controller
+from api.errors import MissingDataError
+from api.packed import PackedIdSet
+from api.topicstore import TopicStore
+
+Base = declarative_base()
+
+
+class Doc(Base):
+    __tablename__ = 'docs'
+    id = Column(String(32), primary_key=True)
+    date = Column(DateTime)
+    title = Column(String(64))
+
+
+def make_controller(**attributes):
+    # A controller without database engines, holding only what a test needs
+    controller = Controller.__new__(Controller)
+    controller.Topics = defaultdict(dict)
+    controller.topic_lock = threading.Lock()
+    controller.topic_store = None
+    controller.clerk = Clerk(controller)
+    for name, value in attributes.items():
+        setattr(controller, name, value)
+    return controller
+
+
+def test_topic_doc_ids_are_not_built_on_request(monkeypatch, tmp_path):
+    monkeypatch.setattr(Controller, 'TOPIC_DOC_IDS', str(tmp_path))
+    controller = make_controller()
+
+    with pytest.raises(MissingDataError) as error:
+        controller.topic_doc_ids('frus')
+    assert 'build.py topic_docs' in str(error.value)
+
+    PackedIdSet.write(os.path.join(str(tmp_path), 'frus.ids'), ['frus1', 'frus2'])
+    assert 'frus2' in controller.topic_doc_ids('frus')
+
+
+@pytest.fixture
+def app_context():
+    # Responses are built with flask.jsonify, which needs an application
+    with Flask(__name__).app_context():
+        yield
+
+
+def test_topic_routes_answer_503_until_the_topic_store_is_built(monkeypatch, tmp_path, app_context):
+    path = str(tmp_path / 'topics.bin')
+    monkeypatch.setattr(Controller, 'TOPIC_STORE', path)
+    controller = make_controller(collection_names={'frus': 'frus'})
+
+    for response in (controller.get_topic_tokens('frus', 1, 10), controller.get_topic_docs('frus', 1, 10)):
+        assert response.status_code == 503
+        assert 'build.py topics' in response.get_data(as_text=True)
+
+    TopicStore.write(path, {'frus': {'tokens': (['token'], {1: [['cuba']]}), 'docs': (['doc_id'], {1: []})}})
+    controller.load_topic_store()
+    assert controller.Topics['frus']['valid_topic_ids'] == {1}
+
+
+def make_search_controller(collection_docs):
+    def find_collection_docs(collection, entity_filters, filters, count_mode):
+        result = collection_docs[collection]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    controller = make_controller(executor=ThreadPoolExecutor(max_workers=4), count_cache=Cache(10, 60))
+    controller._Controller__find_collection_docs = find_collection_docs
+    return controller
+
+
+def search_filters(collections, page_size=2, page=None, page_count=None, page_seek=None, page_start_index=None):
+    return {'fields': ['id'], 'collections': collections, 'count_mode': 'exact', 'page_count': page_count,
+            'page_size': page_size, 'page': page, 'page_url': '/v0.4/documents/?collections=x',
+            'page_start_index': page_start_index or dict((collection, 0) for collection in collections),
+            'page_seek': page_seek or {}, 'start_date': None, 'end_date': None, 'exact_date': None}
+
+
+def search(controller, filters):
+    output = json.loads(controller.find_docs([], filters).get_data(as_text=True))
+    token = output.get('next_page') and output['next_page'].rsplit('&page=', 1)[1]
+    return (output, token and controller.clerk.decode_page_token(token))
+
+
+def doc(doc_id, day):
+    return {'id': doc_id, 'date': datetime(1962, 10, day), 'collection': doc_id[:4]}
+
+
+def test_count_of_a_partial_search_is_not_carried_to_the_next_page(app_context):
+    controller = make_search_controller({'frus': ([doc('frus1', 1), doc('frus2', 2), doc('frus3', 3)], 10),
+                                         'ddrs': RuntimeError('ddrs is down')})
+
+    (output, token) = search(controller, search_filters(['frus', 'ddrs']))
+    assert output['partial'] == ['ddrs']
+    assert output['count'] == 10
+    assert token['n'] is None
+    assert len(controller.count_cache) == 0
+
+
+def test_count_of_a_complete_search_is_carried_to_the_next_page(app_context):
+    controller = make_search_controller({'frus': ([doc('frus1', 1), doc('frus2', 2), doc('frus3', 3)], 10),
+                                         'ddrs': ([doc('ddrs1', 1)], 1)})
+
+    (output, token) = search(controller, search_filters(['frus', 'ddrs']))
+    assert 'partial' not in output
+    assert token['n'] == 11
+
+
+def merge(controller, collection_results, page_size):
+    page_start_index = dict((collection, 0) for (collection, rows) in collection_results)
+    return controller._Controller__merge_collections_results(collection_results, page_size, page_start_index)
+
+
+def test_collections_are_merged_by_date():
+    controller = make_controller()
+    collection_results = [('frus', [doc('frus1', 1), doc('frus3', 3), doc('frus5', 5)]),
+                          ('ddrs', [doc('ddrs2', 2), doc('ddrs4', 4)]),
+                          ('cpdoc', [])]
+
+    (page, next_index, last_row, has_next) = merge(controller, collection_results, 4)
+    assert [row['id'] for row in page] == ['frus1', 'ddrs2', 'frus3', 'ddrs4']
+    assert next_index == {'frus': 2, 'ddrs': 2, 'cpdoc': 0}
+    assert last_row == {'frus': doc('frus3', 3), 'ddrs': doc('ddrs4', 4)}
+    assert has_next
+
+    (page, next_index, last_row, has_next) = merge(controller, collection_results, 5)
+    assert [row['id'] for row in page][-1] == 'frus5'
+    assert not has_next
+
+
+def test_merge_breaks_ties_by_collection_then_position():
+    controller = make_controller()
+    collection_results = [('frus', [doc('frus2', 1), doc('frus1', 1)]),
+                          ('ddrs', [{'id': 'ddrs0', 'date': None}, doc('ddrs1', 1)]),
+                          ('kiss', [{'id': 'kiss1', 'date': datetime(1962, 10, 1).date()}])]
+
+    (page, next_index, last_row, has_next) = merge(controller, collection_results, 10)
+    # Documents without a date come first, and the rows are never compared
+    assert [row['id'] for row in page] == ['ddrs0', 'frus2', 'frus1', 'ddrs1', 'kiss1']
+
+
+def test_merge_stops_once_the_page_is_filled():
+    controller = make_controller()
+    taken = []
+
+    def rows(collection, days):
+        for day in days:
+            taken.append(collection)
+            yield doc(collection + str(day), day)
+
+    collection_results = [('frus', rows('frus', range(1, 30, 2))), ('ddrs', rows('ddrs', range(2, 30, 2)))]
+    (page, next_index, last_row, has_next) = merge(controller, collection_results, 3)
+    assert [row['id'] for row in page] == ['frus1', 'ddrs2', 'frus3']
+    assert has_next
+    assert len(taken) == 5
+
+
+def test_search_pages_are_merged_across_collections(app_context):
+    controller = make_search_controller({'frus': ([doc('frus1', 1), doc('frus4', 4)], 2),
+                                         'ddrs': ([doc('ddrs2', 2), doc('ddrs3', 3)], 2)})
+
+    (output, token) = search(controller, search_filters(['frus', 'ddrs'], page_size=3))
+    assert [row['id'] for row in output['results']] == ['frus1', 'ddrs2', 'ddrs3']
+    assert output['results'][0]['date'] == '1962-10-01T00:00:00'
+    assert token['s'] == {'frus': (datetime(1962, 10, 1), 'frus1'), 'ddrs': (datetime(1962, 10, 3), 'ddrs3')}
+
+
+def test_collections_that_time_out_are_partial(monkeypatch, app_context):
+    monkeypatch.setattr(Controller, 'QUERY_TIMEOUT', 0.1)
+    released = threading.Event()
+    controller = make_search_controller({'frus': ([doc('frus1', 1), doc('frus2', 2)], 2), 'kiss': None})
+    find_collection_docs = controller._Controller__find_collection_docs
+
+    def slow_find_collection_docs(collection, entity_filters, filters, count_mode):
+        if collection == 'ddrs':
+            released.wait(5)
+            return ([doc('ddrs1', 1)], 1)
+        return find_collection_docs(collection, entity_filters, filters, count_mode)
+    controller._Controller__find_collection_docs = slow_find_collection_docs
+
+    try:
+        (output, token) = search(controller, search_filters(['frus', 'ddrs', 'kiss'], page_size=5))
+    finally:
+        released.set()
+        controller.executor.shutdown()
+    assert output['partial'] == ['ddrs']
+    assert [row['id'] for row in output['results']] == ['frus1', 'frus2']
+    assert output['count'] == 2
+
+
+def test_collections_are_queried_concurrently(monkeypatch, app_context):
+    monkeypatch.setattr(Controller, 'QUERY_TIMEOUT', 5)
+    barrier = threading.Barrier(3, timeout=2)
+    controller = make_search_controller({})
+
+    def find_collection_docs(collection, entity_filters, filters, count_mode):
+        # Fails unless the three collections are queried at the same time
+        barrier.wait()
+        return ([doc(collection + '1', 1)], 1)
+    controller._Controller__find_collection_docs = find_collection_docs
+
+    (output, token) = search(controller, search_filters(['frus', 'ddrs', 'kiss'], page_size=5))
+    assert 'partial' not in output
+    assert output['count'] == 3
+    assert [row['id'] for row in output['results']] == ['frus1', 'ddrs1', 'kiss1']
+
+
+def make_docs_session(docs):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Doc(id=doc_id, date=date_val, title=doc_id.upper()) for (doc_id, date_val) in docs])
+    session.commit()
+    return session
+
+
+def page_ids(session, filters, count=True):
+    controller = make_controller()
+    (query, total_count) = controller._Controller__apply_query_filters(session, session.query(Doc), Doc,
+                                                                        filters, 'frus', count=count)
+    return ([row.id for row in query], total_count)
+
+
+DOCS = [('frus3', datetime(1962, 10, 3)), ('frus1', datetime(1962, 10, 1)), ('frus2b', datetime(1962, 10, 2)),
+        ('frus2a', datetime(1962, 10, 2)), ('frus4', datetime(1962, 10, 4)), ('frus0', None)]
+
+
+def test_pages_are_ordered_and_limited_in_sql():
+    session = make_docs_session(DOCS)
+
+    # A page holds page_size + 1 rows, the extra one signalling a next page
+    assert page_ids(session, search_filters(['frus'], page_size=2)) == (['frus0', 'frus1', 'frus2a'], 6)
+    assert page_ids(session, search_filters(['frus'], page_size=2, page_start_index={'frus': 2})) == \
+        (['frus2a', 'frus2b', 'frus3'], 6)
+    assert page_ids(session, search_filters(['frus'], page_size=2, page_start_index={'frus': 5}), count=False) == \
+        (['frus4'], None)
+
+
+def test_pages_are_filtered_by_date_in_sql():
+    session = make_docs_session(DOCS)
+    filters = search_filters(['frus'], page_size=10)
+
+    filters.update({'start_date': datetime(1962, 10, 2), 'end_date': datetime(1962, 10, 3)})
+    assert page_ids(session, filters) == (['frus2a', 'frus2b', 'frus3'], 3)
+
+    filters.update({'start_date': None, 'end_date': None, 'exact_date': '1962-10-02'})
+    assert page_ids(session, filters) == (['frus2a', 'frus2b'], 2)
+
+
+def test_seek_pages_resume_after_the_last_document():
+    session = make_docs_session(DOCS + [('frus2c', datetime(1962, 10, 2)), ('frus00', None)])
+    clerk = Clerk(None)
+
+    seen = []
+    page_seek = {}
+    while True:
+        (ids, total_count) = page_ids(session, search_filters(['frus'], page_size=2, page_seek=page_seek), count=False)
+        seen.extend(ids[:2])
+        if len(ids) <= 2:
+            break
+        # The seek key of the last document travels through the page token
+        last = session.query(Doc).get(ids[1])
+        token = clerk.encode_page_token({'frus': (last.date, last.id)}, {'frus': 0})
+        page_seek = clerk.set_page_seek(token)
+
+    assert seen == ['frus0', 'frus00', 'frus1', 'frus2a', 'frus2b', 'frus2c', 'frus3', 'frus4']
+
+
+def test_seek_ignores_documents_inserted_before_the_key():
+    session = make_docs_session(DOCS)
+    filters = search_filters(['frus'], page_size=2, page_seek={'frus': (datetime(1962, 10, 2), 'frus2a')})
+    assert page_ids(session, filters, count=False)[0] == ['frus2b', 'frus3', 'frus4']
+
+    session.add_all([Doc(id='frus1b', date=datetime(1962, 10, 1)), Doc(id='frus2', date=datetime(1962, 10, 2))])
+    session.commit()
+    assert page_ids(session, filters, count=False)[0] == ['frus2b', 'frus3', 'frus4']
+
+
+class FakeSession(object):
+
+    def close(self):
+        pass
+
+
+class FakeRegistry(object):
+
+    def __init__(self, listing):
+        self.entity_ids = [entity_id for (entity_id, name, count) in listing]
+        self.rows = listing
+
+    def listing(self, session, database, entity):
+        return (self.entity_ids, self.rows)
+
+
+def make_entity_controller(listing):
+    return make_controller(collection_names={'frus': 'frus'}, Entities={'frus': ['persons', 'classifications']},
+                           Session=FakeSession, registry=FakeRegistry(listing))
+
+
+def entity_page(controller, entity, page=0, after=None):
+    url = '/v0.4/entity_info/?collection=frus&entity={}&page_size=2&page={}'.format(entity, page)
+    if after is not None:
+        url = url + '&after={}'.format(after)
+    response = controller.get_entity_info(entity, 'frus', page, 2, url, after=after)
+    return (response.status_code, json.loads(response.get_data(as_text=True)))
+
+
+def walk_entity_pages(controller, entity):
+    (status, output) = entity_page(controller, entity)
+    ids = [row['id'] for row in output['results']]
+    while output.get('next_page'):
+        assert output['next_page'].count('&after=') == 1
+        after = output['next_page'].rsplit('&after=', 1)[1]
+        (status, output) = entity_page(controller, entity, after=after)
+        assert 'page' not in output
+        ids.extend(row['id'] for row in output['results'])
+    return ids
+
+
+def test_entity_info_pages_seek_after_the_last_id(app_context):
+    controller = make_entity_controller([(2, 'Kennedy', 10), (9, 'Khrushchev', 8), (10, 'Castro', 5),
+                                         (31, 'Rusk', 1), (100, 'Bundy', 1)])
+
+    assert walk_entity_pages(controller, 'persons') == [2, 9, 10, 31, 100]
+    assert entity_page(controller, 'persons', after='9')[1]['results'][0] == {'id': 10, 'name': 'Castro', 'count': 5}
+    # An id missing from the listing resumes at the next one
+    assert [row['id'] for row in entity_page(controller, 'persons', after='3')[1]['results']] == [9, 10]
+    assert entity_page(controller, 'persons', after='100')[1]['results'] == []
+
+
+def test_entity_info_seeks_string_ids(app_context):
+    controller = make_entity_controller([('C', 'Confidential', 3), ('S', 'Secret', 2), ('TS', 'Top Secret', 1)])
+
+    assert walk_entity_pages(controller, 'classifications') == ['C', 'S', 'TS']
+
+
+def test_entity_info_rejects_invalid_after_values(app_context):
+    controller = make_entity_controller([(2, 'Kennedy', 10), (9, 'Khrushchev', 8)])
+
+    assert entity_page(controller, 'persons', after='kennedy')[0] == Controller.HTTP_STATUS_BAD_REQUEST
+    assert entity_page(controller, 'persons', after='-1')[0] == Controller.HTTP_STATUS_BAD_REQUEST
+
+
+def test_exports_are_merged_across_collections():
+    controller = make_controller()
+    collection_docs = {'frus': [doc('frus1', 1), doc('frus4', 4)], 'ddrs': [doc('ddrs2', 2), doc('ddrs3', 3)]}
+    controller._Controller__export_collection_docs = \
+        lambda collection, entity_filters, filters: iter(collection_docs[collection])
+    filters = search_filters(['frus', 'ddrs'])
+
+    response = controller.export_docs([], filters, 'csv')
+    assert b''.join(response.response).decode('utf-8').split('\r\n') == [
+        'id,date,collection', 'frus1,1962-10-01T00:00:00,frus', 'ddrs2,1962-10-02T00:00:00,ddrs',
+        'ddrs3,1962-10-03T00:00:00,ddrs', 'frus4,1962-10-04T00:00:00,frus', '']
@@ -0,0 +1,34 @@
+import pytest
+
+from api.packed import PackedIdSet
+
+
+def test_ids_are_sorted_and_unique(tmp_path):
+    path = str(tmp_path / 'frus.ids')
+    PackedIdSet.write(path, ['frus1964-68v10d2', 'CK3100001', 'frus1964-68v10d2', 'doc-é', '1974STATE085546'])
+    id_set = PackedIdSet(path)
+
+    assert len(id_set) == 4
+    assert [id_set[position] for position in range(len(id_set))] == \
+        ['1974STATE085546', 'CK3100001', 'doc-é', 'frus1964-68v10d2']
+    assert id_set.index('doc-é') == 2
+    assert id_set.index('CK3100002') == -1
+    assert 'frus1964-68v10d2' in id_set
+    assert 'frus1964-68v10d' not in id_set
+
+
+def test_empty_set(tmp_path):
+    path = str(tmp_path / 'sub' / 'empty.ids')
+    PackedIdSet.write(path, [])
+    id_set = PackedIdSet(path)
+
+    assert len(id_set) == 0
+    assert 'frus1' not in id_set
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'frus.ids'
+    path.write_bytes(b'NOTASET0' + b'\0' * 16)
+
+    with pytest.raises(ValueError):
+        PackedIdSet(str(path))
@@ -0,0 +1,72 @@
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from api.planner import Planner
+
+Base = declarative_base()
+
+
+class Doc(Base):
+    __tablename__ = 'docs'
+    id = Column(String(32), primary_key=True)
+
+
+class Person(Base):
+    __tablename__ = 'persons'
+    id = Column(Integer, primary_key=True)
+
+
+class PersonDoc(Base):
+    __tablename__ = 'person_doc'
+    row = Column(Integer, primary_key=True)
+    person_id = Column(Integer, ForeignKey('persons.id'))
+    doc_id = Column(String(32), ForeignKey('docs.id'))
+
+
+class FakeController(object):
+
+    def __init__(self):
+        self.Tables = {'frus': {'docs': Doc, 'persons': Person, 'person_doc': PersonDoc}}
+
+
+def make_session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Doc(id=doc_id) for doc_id in ('d1', 'd2', 'd3')])
+    session.add_all([Person(id=person_id) for person_id in (1, 2)])
+    # d2 links person 1 twice, as when a person is named in two passages
+    session.add_all([PersonDoc(person_id=1, doc_id='d1'), PersonDoc(person_id=2, doc_id='d1'),
+                     PersonDoc(person_id=1, doc_id='d2'), PersonDoc(person_id=1, doc_id='d2'),
+                     PersonDoc(person_id=2, doc_id='d3')])
+    session.commit()
+    return session
+
+
+def doc_ids(planner, session, ids, logic):
+    query = planner.plan(session, 'frus', [('persons', ids, logic)])
+    return sorted(doc.id for doc in query)
+
+
+def test_and_counts_every_id_once():
+    session = make_session()
+    planner = Planner(FakeController(), 100, 60)
+
+    assert doc_ids(planner, session, ['1', '2'], 'AND') == ['d1']
+    assert doc_ids(planner, session, ['1', '01', '2'], 'AND') == ['d1']
+    assert doc_ids(planner, session, ['1', '2'], 'OR') == ['d1', 'd2', 'd3']
+
+
+def test_posting_sizes_are_bounded_and_keyed_by_int():
+    session = make_session()
+    planner = Planner(FakeController(), 2, 60)
+    column = PersonDoc.person_id
+
+    assert planner.estimate(session, 'frus', 'persons', column, ['1', '01'], 'OR') == 3
+    assert planner.posting_sizes.get(('frus', 'persons', 1)) == 3
+    assert planner.estimate(session, 'frus', 'persons', column, ['2', '3'], 'AND') == 0
+    assert len(planner.posting_sizes) == 2
+
+    planner.reload('frus')
+    assert len(planner.posting_sizes) == 0
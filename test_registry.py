@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from api.registry import Registry
+
+Base = declarative_base()
+
+
+class Person(Base):
+    __tablename__ = 'persons'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(64))
+
+
+class FakeController(object):
+    Tables = {'frus': {'persons': Person}}
+    entity_names = ['persons']
+
+
+def test_check_reloads_a_changed_dictionary_at_once():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Person(id=1, name='Kennedy, John F.'))
+    session.commit()
+    registry = Registry(FakeController(), 10, 3600, 3600)
+    assert registry.names(session, 'frus', 'persons') == {1: 'Kennedy, John F.'}
+
+    session.add(Person(id=2, name='Khrushchev, Nikita'))
+    session.commit()
+    assert 2 not in registry.names(session, 'frus', 'persons')
+    assert registry.names(session, 'frus', 'persons', check=True)[2] == 'Khrushchev, Nikita'
+    assert 2 in registry.names(session, 'frus', 'persons')
@@ -0,0 +1,127 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, String, create_engine, event
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+import api.rollup
+from api.rollup import Rollup
+
+Base = declarative_base()
+
+
+class PersonDoc(Base):
+    __tablename__ = 'person_doc'
+    row = Column(Integer, primary_key=True)
+    person_id = Column(Integer)
+    doc_id = Column(String(32))
+    date = Column(DateTime)
+
+
+class FakeRegistry(object):
+
+    def names(self, session, database, entity):
+        return dict((person_id, 'person {}'.format(person_id)) for person_id in range(1, 6))
+
+
+class FakeController(object):
+
+    def __init__(self):
+        self.Tables = {'frus': {'person_doc': PersonDoc}}
+        self.registry = FakeRegistry()
+
+
+def date_part(part):
+    # MySQL's YEAR() and MONTH() for SQLite, which stores datetimes as text
+    return lambda value: None if value is None else int(value[:4] if part == 'year' else value[5:7])
+
+
+def make_session(rows):
+    engine = create_engine('sqlite://')
+
+    @event.listens_for(engine, 'connect')
+    def connect(connection, record):
+        connection.create_function('year', 1, date_part('year'))
+        connection.create_function('month', 1, date_part('month'))
+
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([PersonDoc(person_id=person_id, doc_id='d{}'.format(number), date=date)
+                     for number, (person_id, date) in enumerate(rows)])
+    session.commit()
+    return session
+
+
+@pytest.fixture
+def versions(monkeypatch):
+    versions = {'version': ((None, 1),), 'checks': 0}
+
+    def table_versions(session, sources, mapper):
+        versions['checks'] += 1
+        return versions['version']
+
+    monkeypatch.setattr(api.rollup, 'table_versions', table_versions)
+    return versions
+
+
+def expected(rows, start_date, end_date):
+    start = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end = datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+    counts = {}
+    for (person_id, date) in rows:
+        if date is None or (start and date < start) or (end and date > end):
+            continue
+        counts[person_id] = counts.get(person_id, 0) + 1
+    return counts
+
+
+def top(rollup, session, start_date, end_date):
+    return dict((person_id, count) for (person_id, name, count) in
+                rollup.top(session, 'frus', 'persons', start_date, end_date, 10))
+
+
+@pytest.mark.parametrize('start_date, end_date', [
+    (None, None),
+    ('1962-10-16', '1962-10-28'),  # within a month
+    ('1962-10-16', '1963-03-10'),  # partial months at both ends
+    ('1962-10-01', '1963-02-28'),  # whole months but the last day
+    ('1962-10-01', '1963-03-01'),  # whole months and a day
+    ('1962-11-30', '1962-12-01'),  # two partial months, no whole month
+    ('1962-10-16', None),
+    (None, '1963-03-10'),
+    ('1970-01-01', '1971-01-01'),  # no document
+])
+def test_window_counts(versions, start_date, end_date):
+    generator = random.Random(1962)
+    rows = [(generator.randint(1, 5), datetime(1962, 9, 1) + timedelta(hours=generator.randint(0, 24 * 240)))
+            for number in range(500)]
+    rows += [(1, None), (2, None), (1, datetime(1962, 10, 1)), (1, datetime(1963, 3, 1))]
+    session = make_session(rows)
+    rollup = Rollup(FakeController(), 10, 60)
+
+    assert top(rollup, session, start_date, end_date) == expected(rows, start_date, end_date)
+
+
+def test_rollup_is_rebuilt_when_its_table_changes(versions):
+    rows = [(1, datetime(1962, 10, 5)), (2, datetime(1962, 11, 5))]
+    session = make_session(rows)
+    rollup = Rollup(FakeController(), 10, 0)
+    assert top(rollup, session, None, None) == {1: 1, 2: 1}
+
+    session.add(PersonDoc(person_id=2, doc_id='d3', date=datetime(1962, 12, 5)))
+    session.commit()
+    assert top(rollup, session, None, None) == {1: 1, 2: 1}
+
+    versions['version'] = ((None, 3),)
+    assert top(rollup, session, None, None) == {1: 1, 2: 2}
+
+
+def test_version_is_checked_every_check_interval(versions):
+    session = make_session([(1, datetime(1962, 10, 5))])
+    rollup = Rollup(FakeController(), 10, 3600)
+
+    for repeat in range(3):
+        assert top(rollup, session, None, None) == {1: 1}
+    assert versions['checks'] == 1
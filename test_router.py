@@ -0,0 +1,74 @@
+import json
+
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from api.router import Router
+
+Base = declarative_base()
+
+
+class DocDb(Base):
+    __tablename__ = 'docdb'
+    row = Column(Integer, primary_key=True)
+    doc_id = Column(String(32))
+    db_name = Column(String(32))
+
+
+class FakeController(object):
+    Tables = {'declassification_api': {'docdb': DocDb}}
+
+
+def make_session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([DocDb(doc_id='frus1969-76v19p1d1', db_name='frus'),
+                     DocDb(doc_id='1974STATE085546', db_name='statedeptcables'),
+                     DocDb(doc_id='CK3100001', db_name='ddrs'),
+                     DocDb(doc_id='CK3100002', db_name='kissinger')])
+    session.commit()
+    return session
+
+
+def locate(router, session):
+    return dict((database, sorted(doc_ids)) for (database, doc_ids) in
+                router.locate(session, ['frus1969-76v19p1d1', '1974STATE085546', 'CK3100001']).items())
+
+
+def test_locate_without_snapshot_uses_docdb(tmp_path):
+    session = make_session()
+    router = Router(FakeController(), str(tmp_path / 'routing.json'))
+
+    assert locate(router, session) == {'frus': ['frus1969-76v19p1d1'], 'statedeptcables': ['1974STATE085546'],
+                                       'ddrs': ['CK3100001']}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_build_and_reload(tmp_path):
+    session = make_session()
+    path = tmp_path / 'routing.json'
+    Router(FakeController(), str(path)).build(session)
+
+    snapshot = json.loads(path.read_text())
+    assert snapshot == {'rules': {'frus': 'frus', '#state': 'statedeptcables'}, 'ambiguous': ['ck']}
+
+    router = Router(FakeController(), str(path))
+    assert router.rules == snapshot['rules']
+    assert locate(router, session)['ddrs'] == ['CK3100001']
+
+    path.write_text(json.dumps({'rules': {}, 'ambiguous': []}))
+    router.reload()
+    assert router.rules == {}
+
+
+def test_prefix():
+    router = Router(FakeController(), '/nonexistent/routing.json')
+
+    assert router.prefix('frus1969-76v19p1d1') == 'frus'
+    assert router.prefix('FRUS1969-76v19p1d1') == 'frus'
+    assert router.prefix('1974STATE085546') == '#state'
+    assert router.prefix('CK3100001') == 'ck'
+    assert router.prefix('19740101') == '#'
+    assert router.prefix('') == ''
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from api.errors import MissingDataError
+from api.packed import PackedIdSet
+from api.sampler import Sampler
+
+
+def write_sets(path, sets):
+    for database, doc_ids in sets.items():
+        PackedIdSet.write(os.path.join(path, '{}.ids'.format(database)), doc_ids)
+    with open(os.path.join(path, Sampler.COMPLETE), 'w') as outfile:
+        outfile.write('\n'.join(sets))
+
+
+def test_missing_sets_are_not_built_on_request(tmp_path):
+    sampler = Sampler(None, str(tmp_path))
+
+    with pytest.raises(MissingDataError) as error:
+        sampler.sample(5)
+    assert 'build.py doc_ids' in str(error.value)
+
+
+def test_sample(tmp_path):
+    write_sets(str(tmp_path), {'frus': ['f1', 'f2', 'f3'], 'ddrs': ['d1', 'd2']})
+    sampler = Sampler(None, str(tmp_path))
+
+    assert sorted(sampler.sample(10)) == ['d1', 'd2', 'f1', 'f2', 'f3']
+    assert set(sampler.sample(2, ['ddrs'])) == {'d1', 'd2'}
+    assert sampler.sample(3, seed=7) == sampler.sample(3, seed=7)
+
+    write_sets(str(tmp_path), {'frus': ['f4']})
+    sampler.reload()
+    assert sampler.sample(10) == ['f4']
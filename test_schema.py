@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from api.schema import Schema
+
+
+@pytest.fixture
+def engines(tmp_path):
+    engines = {}
+    for database in ('frus', 'ddrs'):
+        engine = create_engine('sqlite:///{}'.format(tmp_path / '{}.db'.format(database)))
+        engine.execute('CREATE TABLE docs (id VARCHAR(32) PRIMARY KEY, title TEXT)')
+        engine.execute("INSERT INTO docs VALUES ('{0}1', 'a {0} document')".format(database))
+        engines[database] = engine
+    return engines
+
+
+def make_schema(engines, path, fingerprint):
+    schema = Schema(engines, str(path))
+    # SQLite has no information_schema, so the fingerprints are set by the tests
+    schema._Schema__fingerprint = lambda database: fingerprint[database]
+    return schema
+
+
+def test_sessions_find_the_engine_of_every_database(engines, tmp_path):
+    schema = make_schema(engines, tmp_path / 'schema', {'frus': ('1',), 'ddrs': ('1',)})
+    session = sessionmaker(binds=schema.binds())()
+    frus_docs = schema['frus']['docs']
+    ddrs_docs = schema['ddrs']['docs']
+
+    assert session.query(frus_docs.id).all() == [('frus1',)]
+    assert session.query(func.count(ddrs_docs.id)).scalar() == 1
+    assert session.get_bind(mapper=ddrs_docs) is engines['ddrs']
+    assert frus_docs.metadata.bind is None
+    assert schema['unknown'] == {}
+
+
+def test_snapshot_is_trusted_until_reload(engines, tmp_path):
+    fingerprint = {'frus': ('1',), 'ddrs': ('1',)}
+    make_schema(engines, tmp_path / 'schema', fingerprint)['frus']
+
+    def fail(database):
+        raise AssertionError('the database was queried')
+    schema = Schema(engines, str(tmp_path / 'schema'))
+    schema._Schema__fingerprint = fail
+    assert 'title' in schema['frus']['docs'].__table__.columns
+
+    engines['frus'].execute('ALTER TABLE docs ADD COLUMN subject TEXT')
+    schema._Schema__fingerprint = lambda database: {'frus': ('2',), 'ddrs': ('1',)}[database]
+    assert schema.reload() == ['frus']
+    assert 'subject' in schema['frus']['docs'].__table__.columns
+    assert schema.reload() == []
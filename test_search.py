@@ -0,0 +1,202 @@
+import sqlite3
+
+import pytest
+
+import api.search
+from api.search import ElasticsearchBackend, LocalSearchBackend, SearchError
+
+
+class FakeTransportError(Exception):
+    pass
+
+
+class FakeNotFoundError(FakeTransportError):
+    pass
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.opened = []
+        self.closed = []
+
+    def perform_request(self, method, url, params=None, body=None):
+        if method == 'POST':
+            pit_id = 'pit{}'.format(len(self.opened))
+            self.opened.append(pit_id)
+            return {'id': pit_id}
+        self.closed.append(body['id'])
+        return {'succeeded': True}
+
+
+class FakeElasticsearch(object):
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.transport = FakeTransport()
+        self.expired = False
+
+    def search(self, body):
+        if self.expired:
+            raise FakeNotFoundError('No search context found')
+        start = body['search_after'][0] + 1 if 'search_after' in body else body.get('from', 0)
+        hits = [{'_id': str(number), '_source': {'title': 'document {}'.format(number)}, 'sort': [number]}
+                for number in range(start, min(start + body['size'], self.documents))]
+        return {'pit_id': body['pit']['id'], 'hits': {'hits': hits, 'total': {'value': self.documents}}}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    fake = type('elasticsearch', (object,), {'TransportError': FakeTransportError,
+                                             'NotFoundError': FakeNotFoundError,
+                                             'Elasticsearch': lambda *args, **kwargs: None})
+    monkeypatch.setattr(api.search, 'elasticsearch', fake)
+    config = {'index': 'docs', 'pit_keep_alive': '5m', 'facet_fields': {}, 'hosts': [], 'maxsize': 1,
+              'timeout': 1, 'max_retries': 0, 'retry_on_timeout': False}
+    backend = ElasticsearchBackend(config, {})
+    backend.es = FakeElasticsearch(25)
+    return backend
+
+
+def search(backend, page=1, cursor=None):
+    return backend.search(None, 'cuba', None, None, ['frus'], page, 10, cursor=cursor)
+
+
+def test_exhausted_search_closes_its_point_in_time(backend):
+    (results, total_count, cursor, facets) = search(backend)
+    pages = 1
+    while cursor:
+        (results, total_count, cursor, facets) = search(backend, cursor=cursor)
+        pages += 1
+
+    transport = backend.es.transport
+    assert pages == 3
+    assert transport.opened == ['pit0']
+    assert transport.closed == ['pit0']
+    assert backend.open_pits == {}
+
+
+def test_single_page_search_closes_its_point_in_time(backend):
+    (results, total_count, cursor, facets) = search(backend, page=3)
+
+    assert len(results) == 5 and cursor is None
+    assert backend.es.transport.opened == backend.es.transport.closed == ['pit0']
+
+
+def test_reload_closes_open_points_in_time(backend):
+    search(backend)
+    search(backend)
+    transport = backend.es.transport
+    assert len(backend.open_pits) == 2
+
+    backend.reload()
+
+    assert sorted(transport.closed) == sorted(transport.opened) == ['pit0', 'pit1']
+    assert backend.open_pits == {}
+
+
+def test_expired_point_in_time_is_closed(backend):
+    (results, total_count, cursor, facets) = search(backend)
+    backend.es.expired = True
+
+    with pytest.raises(SearchError):
+        search(backend, cursor=cursor)
+    assert backend.es.transport.opened == backend.es.transport.closed == ['pit0']
+
+
+@pytest.mark.parametrize('search_text, match', [
+    ('cuba', '"cuba"'),
+    ('cuban crisis', '"cuban" "crisis"'),
+    ('"cuban crisis"', '"cuban crisis"'),
+    ('title:"cuban crisis"', 'title : "cuban crisis"'),
+    ('subject:cuba body:missiles', 'subject : "cuba" body : "missiles"'),
+    ('author:kennedy', '"kennedy"'),
+    ('cuba AND soviet', '"cuba" AND "soviet"'),
+    ('cuba OR soviet', '"cuba" OR "soviet"'),
+    ('cuba NOT soviet', '"cuba" NOT "soviet"'),
+    ('title:"cuban crisis" AND NOT soviet', 'title : "cuban crisis" NOT "soviet"'),
+    ('cuba -soviet', '"cuba" NOT "soviet"'),
+    ('cuba -title:soviet', '"cuba" NOT title : "soviet"'),
+    ('+cuba +soviet', '"cuba" "soviet"'),
+    ('cuba AND', '"cuba"'),
+    ('cuba AND NOT', '"cuba"'),
+    ('AND cuba', '"cuba"'),
+    ('cuba AND ! soviet', '"cuba" AND "soviet"'),
+    ('U.S.-Cuba', '"U S Cuba"'),
+    ('', ''),
+    (None, ''),
+])
+def test_to_match(search_text, match):
+    assert LocalSearchBackend.to_match(search_text) == match
+
+
+@pytest.mark.parametrize('search_text', [
+    'NOT soviet',
+    '-soviet cuba',
+    'cuba OR NOT soviet',
+    'cuba OR -soviet',
+    'cuba AND OR soviet',
+    'cuba NOT NOT soviet',
+])
+def test_to_match_rejects_unsupported_operators(search_text):
+    with pytest.raises(SearchError):
+        LocalSearchBackend.to_match(search_text)
+
+
+def test_to_match_is_valid_fts5(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'fulltext.sqlite'))
+    connection.execute('CREATE VIRTUAL TABLE fulltext USING fts5(title, subject, body)')
+    connection.executemany('INSERT INTO fulltext VALUES (?, ?, ?)', [
+        ('The Cuban crisis', 'Cuba', 'soviet missiles'),
+        ('The Cuban crisis', 'Cuba', 'naval quarantine'),
+        ('Berlin', 'Germany', 'soviet troops')])
+
+    def titles(search_text):
+        return connection.execute('SELECT rowid FROM fulltext WHERE fulltext MATCH ? ORDER BY rowid',
+                                  [LocalSearchBackend.to_match(search_text)]).fetchall()
+
+    assert titles('title:"cuban crisis" AND NOT soviet') == [(2,)]
+    assert titles('title:"cuban crisis" soviet') == [(1,)]
+    assert titles('cuba OR berlin -troops') == [(1,), (2,)]
+    connection.close()
+
+
+def test_missing_index_is_an_error(tmp_path):
+    backend = LocalSearchBackend(None, str(tmp_path / 'fulltext.sqlite'), {})
+
+    with pytest.raises(SearchError):
+        backend.search(None, 'cuba', None, None, ['frus'], 1, 10)
+    assert not (tmp_path / 'fulltext.sqlite').exists()
+
+
+@pytest.fixture
+def local_backend(tmp_path):
+    path = str(tmp_path / 'fulltext.sqlite')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE VIRTUAL TABLE fulltext USING fts5(title, subject, body, doc_id UNINDEXED, '
+                       'collection UNINDEXED, date UNINDEXED, classification UNINDEXED)')
+    connection.executemany('INSERT INTO fulltext VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           [('Cuba {}'.format(number), None, 'cuba', 'frus{}'.format(number), 'frus',
+                             '1962-10-{:02d}'.format(number), None) for number in range(1, 6)])
+    connection.commit()
+    connection.close()
+    return LocalSearchBackend(None, path, {})
+
+
+def test_local_search_pages(local_backend):
+    (results, total_count, cursor, facets) = local_backend.search(None, 'cuba', None, None, ['frus'], 1, 2)
+    ids = [row['id'] for row in results]
+    assert total_count == 5
+    while cursor:
+        (results, total_count, cursor, facets) = local_backend.search(None, 'cuba', None, None, ['frus'], 1, 2,
+                                                                      cursor=cursor)
+        ids.extend(row['id'] for row in results)
+    assert sorted(ids) == ['frus1', 'frus2', 'frus3', 'frus4', 'frus5']
+
+
+@pytest.mark.parametrize('search_after', [
+    None, 'rank', [], [-1.5], [-1.5, 2, 3], ['-1.5', 2], [-1.5, '2'], [-1.5, 2.5], [True, 2], [-1.5, None],
+])
+def test_malformed_cursors_are_rejected(local_backend, search_after):
+    with pytest.raises(SearchError):
+        local_backend.search(None, 'cuba', None, None, ['frus'], 1, 2, cursor=(None, search_after))
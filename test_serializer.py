@@ -0,0 +1,44 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import api.serializer
+from api.serializer import Serializer
+
+AVAILABLE = [name for name in Serializer.ENCODERS if name == 'json' or getattr(api.serializer, name)]
+
+
+@pytest.mark.parametrize('name', AVAILABLE)
+def test_encoders_agree(name):
+    output = {'count': 2, 'results': [
+        {'id': 'frus1', 'date': datetime(1962, 10, 16, 9, 30), 'title': 'Télégramme', 'score': Decimal('0.5'),
+         'topics': ({'id': 1, 'name': 'cuba'},)},
+        {'id': 'frus2', 'date': date(1962, 10, 22), 'title': None, 'persons': set()}
+    ]}
+
+    encoded = Serializer(name).encode(output)
+
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded.decode('utf-8')) == {'count': 2, 'results': [
+        {'id': 'frus1', 'date': '1962-10-16T09:30:00', 'title': 'Télégramme', 'score': '0.5',
+         'topics': [{'id': 1, 'name': 'cuba'}]},
+        {'id': 'frus2', 'date': '1962-10-22', 'title': None, 'persons': []}
+    ]}
+    assert 'Télégramme'.encode('utf-8') in encoded
+
+
+def test_fastest_encoder_is_the_default():
+    assert Serializer().name == AVAILABLE[0]
+
+
+def test_unknown_encoder_is_rejected():
+    with pytest.raises(ValueError):
+        Serializer('simplejson')
+
+
+@pytest.mark.parametrize('name', AVAILABLE)
+def test_unsupported_values_are_rejected(name):
+    with pytest.raises(TypeError):
+        Serializer(name).encode({'value': object()})
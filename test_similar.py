@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import Column, Float, Integer, String, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from api.errors import MissingDataError
+from api.similar import SimilarityIndex
+
+Base = declarative_base()
+
+
+class TopicDoc(Base):
+    __tablename__ = 'topic_doc'
+    row = Column(Integer, primary_key=True)
+    doc_id = Column(String(32))
+    topic_id = Column(Integer)
+    topic_score = Column(Float)
+
+
+class FakeController(object):
+    Tables = {'frus': {'topic_doc': TopicDoc}}
+
+
+@pytest.fixture
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([TopicDoc(doc_id='d1', topic_id=1, topic_score=0.9), TopicDoc(doc_id='d1', topic_id=2, topic_score=0.1),
+                     TopicDoc(doc_id='d2', topic_id=1, topic_score=0.8), TopicDoc(doc_id='d2', topic_id=2, topic_score=0.2),
+                     TopicDoc(doc_id='d3', topic_id=2, topic_score=1.0)])
+    session.commit()
+    yield session
+    session.close()
+
+
+def test_missing_index_is_not_built_on_request(session, tmp_path):
+    index = SimilarityIndex(FakeController(), str(tmp_path), 10, 100)
+
+    with pytest.raises(MissingDataError) as error:
+        index.similar(session, 'frus', 'd1', 2)
+    assert 'build.py similar' in str(error.value)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_similar_documents(session, tmp_path):
+    index = SimilarityIndex(FakeController(), str(tmp_path), 10, 100)
+    index.build(session, 'frus')
+
+    similar = index.similar(session, 'frus', 'd1', 2)
+    assert [doc_id for (doc_id, score) in similar] == ['d2', 'd3']
+    assert index.similar(session, 'frus', 'd4', 2) is None
+
+    index.reload('frus')
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['frus.ids', 'frus.vec']
@@ -0,0 +1,119 @@
+import requests
+
+import pytest
+
+import api.textdrop
+from api.textdrop import TextDropClient, TextDropError
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.posts = 0
+
+    def post(self, url, data, headers, timeout):
+        self.posts += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def found(*doc_ids):
+    return FakeResponse(200, {'results': [{'doc_id': doc_id} for doc_id in doc_ids]})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(api.textdrop.time, 'time', clock.time)
+    return clock
+
+
+def make_client(answers):
+    client = TextDropClient(pool_size=2, connect_timeout=1, read_timeout=5, retries=0,
+                            failure_threshold=2, reset_timeout=30, cache_size=10, cache_ttl=60)
+    client.session = FakeSession(answers)
+    return client
+
+
+def test_search_is_cached():
+    client = make_client([found('frus1', 'frus2')])
+    assert client.search('http://textdrop', 'cuba', 2) == ['frus1', 'frus2']
+    assert client.search('http://textdrop', 'cuba', 2) == ['frus1', 'frus2']
+    assert client.session.posts == 1
+
+
+def test_failures_are_text_drop_errors():
+    client = make_client([requests.ConnectionError('refused'), FakeResponse(500, None), FakeResponse(200, {})])
+    client.failure_threshold = 10
+    for _ in range(3):
+        with pytest.raises(TextDropError):
+            client.search('http://textdrop', 'cuba', 2)
+    assert client.failures == 3
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    client = make_client([FakeResponse(502, None), FakeResponse(502, None)])
+    for _ in range(2):
+        with pytest.raises(TextDropError):
+            client.search('http://textdrop', 'cuba', 2)
+
+    clock.now += 29
+    with pytest.raises(TextDropError):
+        client.search('http://textdrop', 'cuba', 2)
+    assert client.session.posts == 2
+
+
+def test_circuit_probes_after_reset_timeout(clock):
+    client = make_client([FakeResponse(502, None), FakeResponse(502, None), FakeResponse(502, None),
+                          found('frus1')])
+    for _ in range(2):
+        with pytest.raises(TextDropError):
+            client.search('http://textdrop', 'cuba', 2)
+
+    # A failed probe opens the circuit for another reset_timeout
+    clock.now += 31
+    with pytest.raises(TextDropError):
+        client.search('http://textdrop', 'cuba', 2)
+    assert client.session.posts == 3
+    clock.now += 29
+    with pytest.raises(TextDropError):
+        client.search('http://textdrop', 'cuba', 2)
+    assert client.session.posts == 3
+
+    # A successful probe closes it
+    clock.now += 2
+    assert client.search('http://textdrop', 'cuba', 1) == ['frus1']
+    assert client.failures == 0
+    assert client.opened is None
+
+
+def test_success_resets_the_failure_count():
+    client = make_client([FakeResponse(502, None), found('frus1'), FakeResponse(502, None)])
+    with pytest.raises(TextDropError):
+        client.search('http://textdrop', 'cuba', 1)
+    assert client.search('http://textdrop', 'cuba', 2) == ['frus1']
+    with pytest.raises(TextDropError):
+        client.search('http://textdrop', 'cuba', 3)
+    assert client.opened is None
@@ -0,0 +1,46 @@
+import pytest
+
+from api.topicstore import TopicStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = str(tmp_path / 'topics.bin')
+    TopicStore.write(path, {
+        'frus': {
+            'tokens': (['token', 'weight'], {1: [['cuba', '0.5'], ['missile', '0.25']], 2: [['berlin', '0.5']]}),
+            'docs': (['doc_id', 'score', 'title'], {1: [['frus1', '0.9', 'Telegram'], ['frus2', '0.5']]})
+        },
+        'ddrs': {
+            'tokens': (['token', 'weight'], {7: [['détente', '1.0']]}),
+            'docs': (['doc_id', 'score'], {7: []})
+        }
+    })
+    return TopicStore(path)
+
+
+def test_topics(store):
+    assert store.topic_ids('frus') == {1, 2}
+    assert store.topic_ids('ddrs') == {7}
+    assert store.topic_ids('kissinger') == set()
+    assert store.count('frus', 'tokens', 1) == 2
+    assert store.count('ddrs', 'docs', 7) == 0
+
+
+def test_rows(store):
+    assert store.rows('frus', 'tokens', 1) == [{'token': 'cuba', 'weight': '0.5'},
+                                               {'token': 'missile', 'weight': '0.25'}]
+    assert store.rows('frus', 'tokens', 1, limit=1) == [{'token': 'cuba', 'weight': '0.5'}]
+    assert store.rows('frus', 'tokens', 1, limit=-1) == []
+    assert store.rows('ddrs', 'tokens', 7) == [{'token': 'détente', 'weight': '1.0'}]
+    # Cells missing from short rows are left out
+    assert store.rows('frus', 'docs', 1) == [{'doc_id': 'frus1', 'score': '0.9', 'title': 'Telegram'},
+                                             {'doc_id': 'frus2', 'score': '0.5'}]
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'topics.bin'
+    path.write_bytes(b'NOTTOPIC' + b'\0' * 16)
+
+    with pytest.raises(ValueError):
+        TopicStore(str(path))
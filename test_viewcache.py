@@ -0,0 +1,28 @@
+from datetime import datetime
+from decimal import Decimal
+
+import api.viewcache
+from api.viewcache import ResponseCache
+
+
+def test_last_modified_is_utc(monkeypatch):
+    # UNIX_TIMESTAMP(UPDATE_TIME) of two tables, 2023-11-14 22:13:20 UTC being the latest
+    monkeypatch.setattr(api.viewcache, 'table_versions',
+                        lambda session, sources, mapper: ((Decimal('1699990000'), 10), (1700000000, 20)))
+    cache = ResponseCache(10, 60)
+
+    (body, etag, last_modified) = cache.fetch(None, ('viz',), [('frus', 'a'), ('frus', 'b')], None, lambda: b'{}')
+    assert last_modified == datetime(2023, 11, 14, 22, 13, 20)
+
+
+def test_response_is_rendered_again_when_a_table_changes(monkeypatch):
+    versions = [((1700000000, 10),)]
+    monkeypatch.setattr(api.viewcache, 'table_versions', lambda session, sources, mapper: versions[0])
+    cache = ResponseCache(10, 0)
+    bodies = iter([b'1', b'2'])
+    render = lambda: next(bodies)
+
+    assert cache.fetch(None, ('viz',), [('frus', 'a')], None, render)[0] == b'1'
+    assert cache.fetch(None, ('viz',), [('frus', 'a')], None, render)[0] == b'1'
+    versions[0] = ((1700000100, 11),)
+    assert cache.fetch(None, ('viz',), [('frus', 'a')], None, render)[0] == b'2'